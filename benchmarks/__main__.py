@@ -0,0 +1,131 @@
+"""
+Run the benchmarks, compare results, or serve synthetic documents from a
+local stand-in for upstream, e.g. to load test a running proxy with wrk.
+
+    python -m benchmarks run --size medium --output results.json
+    python -m benchmarks compare baseline.json results.json --threshold 0.1
+    python -m benchmarks upstream --port 8080
+"""
+
+import argparse
+import sys
+import threading
+from pathlib import Path
+
+import orjson
+
+from benchmarks.documents import SIZES, generate_environment_document
+from benchmarks.results import (
+    compare_results,
+    format_comparison,
+    format_results,
+    get_run_metadata,
+    read_results,
+    write_results,
+)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="run benchmarks and write their results")
+    run.add_argument("--suite", choices=("micro", "e2e", "all"), default="all")
+    run.add_argument("--size", choices=SIZES, default="medium")
+    run.add_argument("--output", type=Path, default=Path("benchmark-results.json"))
+    run.add_argument("--repeat", type=int, default=5)
+    run.add_argument("--requests", type=int, default=2000)
+    run.add_argument("--concurrency", type=int, default=10)
+
+    compare = commands.add_parser("compare", help="compare results against a baseline")
+    compare.add_argument("baseline", type=Path)
+    compare.add_argument("current", type=Path)
+    compare.add_argument("--statistic", default="median")
+    compare.add_argument(
+        "--threshold",
+        type=float,
+        default=None,
+        help="exit with an error if any benchmark slowed down by more than this "
+        "fraction, e.g. 0.1",
+    )
+
+    upstream = commands.add_parser(
+        "upstream", help="serve a synthetic environment document"
+    )
+    upstream.add_argument("--size", choices=SIZES, default="medium")
+    upstream.add_argument("--host", default="127.0.0.1")
+    upstream.add_argument("--port", type=int, default=8080)
+    upstream.add_argument("--server-side-key", default="ser.benchmark_environment")
+    upstream.add_argument("--client-side-key", default="benchmark_environment")
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        return _run(args)
+    if args.command == "compare":
+        return _compare(args)
+    return _upstream(args)
+
+
+def _run(args: argparse.Namespace) -> int:
+    spec = SIZES[args.size]
+    results = []
+    if args.suite in ("micro", "all"):
+        from benchmarks.micro import run_micro_benchmarks
+
+        results += run_micro_benchmarks(spec, repeat=args.repeat)
+    if args.suite in ("e2e", "all"):
+        from benchmarks.e2e import run_e2e_benchmarks
+
+        results += run_e2e_benchmarks(
+            spec, requests=args.requests, concurrency=args.concurrency
+        )
+
+    write_results(
+        args.output,
+        get_run_metadata(size=args.size, document_spec=spec.to_dict()),
+        results,
+    )
+    print(format_results(results))
+    print(f"\nResults written to {args.output}")
+    return 0
+
+
+def _compare(args: argparse.Namespace) -> int:
+    baseline = read_results(args.baseline)
+    current = read_results(args.current)
+    if baseline["params"] != current["params"]:
+        print("warning: results were produced with different parameters")
+    comparison = compare_results(baseline, current, args.statistic)
+    print(format_comparison(comparison))
+
+    if args.threshold is not None:
+        regressions = [
+            name for name, *_, change in comparison if change > args.threshold
+        ]
+        if regressions:
+            print(
+                f"\nRegressed by more than {args.threshold:.0%}: {', '.join(regressions)}"
+            )
+            return 1
+    return 0
+
+
+def _upstream(args: argparse.Namespace) -> int:
+    from benchmarks.upstream import run_upstream
+
+    document = orjson.dumps(
+        generate_environment_document(SIZES[args.size], args.client_side_key)
+    )
+    with run_upstream(
+        {args.server_side_key: document}, host=args.host, port=args.port
+    ) as server:
+        print(f"Serving a {args.size} environment document at {server.api_url}")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
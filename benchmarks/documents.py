@@ -0,0 +1,216 @@
+"""
+Synthetic environment documents, shaped like the ones served by the
+Flagsmith API, and identities to evaluate them for.
+"""
+
+import random
+import uuid
+from dataclasses import asdict, dataclass
+from typing import Any
+
+_OPERATORS = ("EQUAL", "NOT_EQUAL", "GREATER_THAN", "LESS_THAN", "IN", "CONTAINS")
+
+
+@dataclass(frozen=True, slots=True)
+class DocumentSpec:
+    features: int = 50
+    # Of the features, how many have multivariate options.
+    multivariate_features: int = 5
+    segments: int = 20
+    rules_per_segment: int = 2
+    conditions_per_rule: int = 2
+    # Feature overrides per segment.
+    segment_overrides: int = 3
+    identity_overrides: int = 100
+    # Distinct trait keys used by segment conditions and identities.
+    trait_keys: int = 20
+    seed: int = 0
+
+    def to_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+
+SIZES = {
+    "small": DocumentSpec(
+        features=10,
+        multivariate_features=1,
+        segments=5,
+        identity_overrides=10,
+        trait_keys=10,
+    ),
+    "medium": DocumentSpec(),
+    "large": DocumentSpec(
+        features=500,
+        multivariate_features=25,
+        segments=200,
+        rules_per_segment=3,
+        conditions_per_rule=3,
+        segment_overrides=5,
+        identity_overrides=20_000,
+        trait_keys=100,
+    ),
+}
+
+
+def generate_environment_document(
+    spec: DocumentSpec,
+    api_key: str = "benchmark_environment",
+) -> dict[str, Any]:
+    """
+    Generate an environment document for the given spec. The same spec always
+    generates the same document.
+    """
+    rng = random.Random(spec.seed)
+    features = [
+        {"id": feature_id, "name": f"feature_{feature_id}"}
+        for feature_id in range(1, spec.features + 1)
+    ]
+    multivariate_feature_ids = {
+        feature["id"] for feature in features[: spec.multivariate_features]
+    }
+    for feature in features:
+        feature["type"] = (
+            "MULTIVARIATE" if feature["id"] in multivariate_feature_ids else "STANDARD"
+        )
+
+    return {
+        "id": 1,
+        "api_key": api_key,
+        "name": "Benchmark",
+        "updated_at": "2024-01-01T00:00:00+00:00",
+        "feature_states": [_feature_state(rng, feature) for feature in features],
+        "identity_overrides": [
+            {
+                "identifier": f"overridden_{i}",
+                "identity_uuid": str(_uuid(rng)),
+                "environment_api_key": api_key,
+                "identity_features": [
+                    _feature_state(rng, rng.choice(features), multivariate=False)
+                ],
+            }
+            for i in range(spec.identity_overrides)
+        ],
+        "project": {
+            "id": 1,
+            "name": "Benchmark",
+            "organisation": {
+                "id": 1,
+                "name": "Benchmark",
+                "feature_analytics": False,
+                "persist_trait_data": True,
+                "stop_serving_flags": False,
+            },
+            "hide_disabled_flags": False,
+            "server_key_only_feature_ids": [],
+            "segments": [
+                {
+                    "id": segment_id,
+                    "name": f"segment_{segment_id}",
+                    "rules": [
+                        {
+                            "type": "ALL",
+                            "conditions": [],
+                            "rules": [
+                                _segment_rule(rng, spec)
+                                for _ in range(spec.rules_per_segment)
+                            ],
+                        }
+                    ],
+                    "feature_states": [
+                        _feature_state(rng, feature, multivariate=False)
+                        for feature in rng.sample(
+                            features, min(spec.segment_overrides, len(features))
+                        )
+                    ],
+                }
+                for segment_id in range(1, spec.segments + 1)
+            ],
+        },
+    }
+
+
+def generate_identities(
+    spec: DocumentSpec,
+    count: int,
+    traits_per_identity: int = 5,
+    seed: int = 0,
+) -> list[dict[str, Any]]:
+    """
+    Generate identity request bodies with traits drawn from the trait keys
+    the segments of the spec's documents depend on.
+    """
+    rng = random.Random(seed)
+    return [
+        {
+            "identifier": f"identity_{i}",
+            "traits": [
+                {"trait_key": trait_key, "trait_value": _trait_value(rng)}
+                for trait_key in rng.sample(
+                    _trait_keys(spec), min(traits_per_identity, spec.trait_keys)
+                )
+            ],
+        }
+        for i in range(count)
+    ]
+
+
+def _feature_state(
+    rng: random.Random,
+    feature: dict[str, Any],
+    multivariate: bool = True,
+) -> dict[str, Any]:
+    feature_state = {
+        "django_id": rng.randrange(1, 2**31),
+        "featurestate_uuid": str(_uuid(rng)),
+        "feature": feature,
+        "enabled": rng.random() < 0.7,
+        "feature_state_value": rng.choice(
+            [None, True, rng.randrange(1000), f"value_{rng.randrange(1000)}"]
+        ),
+        "multivariate_feature_state_values": [],
+    }
+    if multivariate and feature["type"] == "MULTIVARIATE":
+        feature_state["multivariate_feature_state_values"] = [
+            {
+                "id": option_id,
+                "multivariate_feature_option": {
+                    "id": option_id,
+                    "value": f"variant_{option_id}",
+                },
+                "percentage_allocation": 30,
+            }
+            for option_id in range(1, 4)
+        ]
+    return feature_state
+
+
+def _segment_rule(rng: random.Random, spec: DocumentSpec) -> dict[str, Any]:
+    trait_keys = _trait_keys(spec)
+    conditions = []
+    for _ in range(spec.conditions_per_rule):
+        operator = rng.choice(_OPERATORS)
+        value = _trait_value(rng)
+        if operator == "IN":
+            value = ",".join(str(_trait_value(rng)) for _ in range(5))
+        conditions.append(
+            {
+                "operator": operator,
+                "property_": rng.choice(trait_keys),
+                "value": str(value),
+            }
+        )
+    return {"type": rng.choice(("ALL", "ANY")), "conditions": conditions, "rules": []}
+
+
+def _trait_keys(spec: DocumentSpec) -> list[str]:
+    return [f"trait_{i}" for i in range(spec.trait_keys)]
+
+
+def _trait_value(rng: random.Random) -> str | int:
+    if rng.random() < 0.5:
+        return rng.randrange(100)
+    return f"value_{rng.randrange(10)}"
+
+
+def _uuid(rng: random.Random) -> uuid.UUID:
+    return uuid.UUID(int=rng.getrandbits(128), version=4)
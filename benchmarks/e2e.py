@@ -0,0 +1,227 @@
+"""
+End-to-end throughput and latency of the proxy's ASGI app, polling a local
+stand-in for upstream.
+
+The app reads its configuration when imported, so each run happens in a fresh
+interpreter configured through `CONFIG_PATH`. This also keeps runs independent
+of one another and of the micro-benchmarks.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+import httpx
+import orjson
+
+from benchmarks.documents import (
+    DocumentSpec,
+    generate_environment_document,
+    generate_identities,
+)
+from benchmarks.results import BenchmarkResult
+from benchmarks.upstream import run_upstream
+
+CLIENT_SIDE_KEY = "benchmark_environment"
+SERVER_SIDE_KEY = "ser.benchmark_environment"
+
+
+@dataclass(frozen=True, slots=True)
+class Scenario:
+    name: str
+    method: str
+    path: str
+    environment_key: str = CLIENT_SIDE_KEY
+    # Send generated identities in turn, as the `identifier` query parameter
+    # of GET requests and as the body of POST requests.
+    identities: bool = False
+    headers: tuple[tuple[str, str], ...] = ()
+
+
+SCENARIOS = (
+    Scenario("e2e.flags", "GET", "/api/v1/flags/"),
+    Scenario(
+        "e2e.flags.brotli",
+        "GET",
+        "/api/v1/flags/",
+        headers=(("Accept-Encoding", "br"),),
+    ),
+    Scenario(
+        "e2e.identities.identifier_only",
+        "GET",
+        "/api/v1/identities/",
+        identities=True,
+    ),
+    Scenario("e2e.identities.traits", "POST", "/api/v1/identities/", identities=True),
+    Scenario(
+        "e2e.environment_document",
+        "GET",
+        "/api/v1/environment-document",
+        environment_key=SERVER_SIDE_KEY,
+        headers=(("Accept-Encoding", "gzip"),),
+    ),
+)
+
+
+def run_e2e_benchmarks(
+    spec: DocumentSpec,
+    requests: int = 2000,
+    concurrency: int = 10,
+    config: dict[str, Any] | None = None,
+) -> list[BenchmarkResult]:
+    """
+    Serve a document generated from the spec from a local upstream, and
+    measure every scenario against an app configured to poll it. `config`
+    is merged into the app's configuration, e.g. to enable endpoint caches.
+    """
+    document = orjson.dumps(generate_environment_document(spec, CLIENT_SIDE_KEY))
+    with (
+        run_upstream({SERVER_SIDE_KEY: document}) as upstream,
+        tempfile.TemporaryDirectory(prefix="edge-proxy-benchmark-") as tmp_dir,
+    ):
+        config_path = Path(tmp_dir) / "config.json"
+        config_path.write_bytes(
+            orjson.dumps(
+                {
+                    "environment_key_pairs": [
+                        {
+                            "server_side_key": SERVER_SIDE_KEY,
+                            "client_side_key": CLIENT_SIDE_KEY,
+                        }
+                    ],
+                    "api_url": upstream.api_url,
+                    "logging": {"log_level": "WARNING"},
+                    **(config or {}),
+                }
+            )
+        )
+        output_path = Path(tmp_dir) / "results.json"
+        subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "benchmarks.e2e",
+                "--requests",
+                str(requests),
+                "--concurrency",
+                str(concurrency),
+                "--spec",
+                json.dumps(spec.to_dict()),
+                "--output",
+                str(output_path),
+            ],
+            env={**os.environ, "CONFIG_PATH": str(config_path)},
+            cwd=Path(__file__).parent.parent,
+            check=True,
+        )
+        output = output_path.read_bytes()
+
+    return [
+        BenchmarkResult(
+            **result,
+            params={
+                "requests": requests,
+                "concurrency": concurrency,
+                "config": config or {},
+            },
+        )
+        for result in json.loads(output)
+    ]
+
+
+async def _run_scenarios(
+    spec: DocumentSpec,
+    requests: int,
+    concurrency: int,
+) -> list[dict[str, Any]]:
+    from edge_proxy.server import app
+
+    identities = generate_identities(spec, count=min(requests, 1000))
+    results = []
+    async with (
+        app.router.lifespan_context(app),
+        httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://edge-proxy"
+        ) as client,
+    ):
+        for scenario in SCENARIOS:
+            # Warm up caches and code paths before measuring.
+            await _run_scenario(client, scenario, identities, requests // 10 or 1, 1)
+            results.append(
+                await _run_scenario(client, scenario, identities, requests, concurrency)
+            )
+    return results
+
+
+async def _run_scenario(
+    client: httpx.AsyncClient,
+    scenario: Scenario,
+    identities: list[dict[str, Any]],
+    requests: int,
+    concurrency: int,
+) -> dict[str, Any]:
+    headers = {"X-Environment-Key": scenario.environment_key, **dict(scenario.headers)}
+    samples: list[float] = []
+    errors = 0
+    next_request = iter(range(requests))
+
+    async def worker() -> None:
+        nonlocal errors
+        for i in next_request:
+            identity = identities[i % len(identities)]
+            if not scenario.identities:
+                request = client.build_request(
+                    scenario.method, scenario.path, headers=headers
+                )
+            elif scenario.method == "GET":
+                request = client.build_request(
+                    scenario.method,
+                    scenario.path,
+                    headers=headers,
+                    params={"identifier": identity["identifier"]},
+                )
+            else:
+                request = client.build_request(
+                    scenario.method, scenario.path, headers=headers, json=identity
+                )
+            started_at = time.perf_counter()
+            response = await client.send(request)
+            samples.append(time.perf_counter() - started_at)
+            if response.status_code != 200:
+                errors += 1
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started_at
+    return {
+        "name": scenario.name,
+        "samples": samples,
+        "throughput": requests / elapsed,
+        "errors": errors,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, required=True)
+    parser.add_argument("--concurrency", type=int, required=True)
+    parser.add_argument("--spec", type=json.loads, required=True)
+    parser.add_argument("--output", type=Path, required=True)
+    args = parser.parse_args()
+
+    results = asyncio.run(
+        _run_scenarios(DocumentSpec(**args.spec), args.requests, args.concurrency)
+    )
+    args.output.write_bytes(orjson.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Micro-benchmarks of the request paths and document handling, run in-process
+against a synthetic environment document.
+"""
+
+import copy
+import timeit
+from typing import Any, Callable
+
+from flag_engine.engine import get_evaluation_result
+
+from benchmarks.documents import (
+    DocumentSpec,
+    generate_environment_document,
+    generate_identities,
+)
+from benchmarks.results import BenchmarkResult
+from edge_proxy.cache import LocalMemEnvironmentsCache
+from edge_proxy.environments import EnvironmentService
+from edge_proxy.mappers import (
+    convert_traits_to_dict,
+    map_flag_results_to_response_data,
+    map_traits_to_response_data,
+)
+from edge_proxy.models import IdentityWithTraits
+from edge_proxy.settings import AppSettings
+
+CLIENT_SIDE_KEY = "benchmark_environment"
+SERVER_SIDE_KEY = "ser.benchmark_environment"
+
+
+def run_micro_benchmarks(
+    spec: DocumentSpec,
+    repeat: int = 5,
+    min_time: float = 0.2,
+) -> list[BenchmarkResult]:
+    """
+    Run every micro-benchmark. Each is timed `repeat` times, over as many
+    iterations as take at least `min_time` seconds.
+    """
+    environment_document = generate_environment_document(spec, CLIENT_SIDE_KEY)
+    environment_service = EnvironmentService(
+        settings=AppSettings(
+            environment_key_pairs=[
+                {
+                    "client_side_key": CLIENT_SIDE_KEY,
+                    "server_side_key": SERVER_SIDE_KEY,
+                }
+            ],
+        ),
+    )
+    environment_service.cache.put_environment(CLIENT_SIDE_KEY, environment_document)
+
+    identity = IdentityWithTraits.model_validate(generate_identities(spec, 1)[0])
+    identifier_only = IdentityWithTraits(identifier=identity.identifier)
+    overridden_identity = IdentityWithTraits(
+        identifier=environment_document["identity_overrides"][0]["identifier"]
+        if environment_document["identity_overrides"]
+        else identity.identifier,
+        traits=identity.traits,
+    )
+    compiled_environment = environment_service.cache.get_compiled_environment(
+        CLIENT_SIDE_KEY
+    )
+    flag_results = list(
+        get_evaluation_result(compiled_environment.environment_context)[
+            "flags"
+        ].values()
+    )
+
+    modified_document = copy.deepcopy(environment_document)
+    for feature_state in modified_document["feature_states"]:
+        feature_state["enabled"] = not feature_state["enabled"]
+    alternating_documents = _alternate(environment_document, modified_document)
+    # Equal to the cached document, but not the same object.
+    unchanged_document = copy.deepcopy(environment_document)
+    put_cache = LocalMemEnvironmentsCache()
+
+    benchmarks: dict[str, Callable[[], Any]] = {
+        "flags.client_key": lambda: environment_service.get_flags_response_data(
+            CLIENT_SIDE_KEY
+        ),
+        "flags.server_key": lambda: environment_service.get_flags_response_data(
+            SERVER_SIDE_KEY
+        ),
+        "identities.identifier_only": lambda: (
+            environment_service.get_identity_response_data(
+                identifier_only, CLIENT_SIDE_KEY
+            )
+        ),
+        "identities.traits": lambda: environment_service.get_identity_response_data(
+            identity, CLIENT_SIDE_KEY
+        ),
+        "identities.identity_override": lambda: (
+            environment_service.get_identity_response_data(
+                overridden_identity, CLIENT_SIDE_KEY
+            )
+        ),
+        "mappers.map_flag_results_to_response_data": lambda: (
+            map_flag_results_to_response_data(
+                flag_results, compiled_environment.feature_types
+            )
+        ),
+        "mappers.traits": lambda: (
+            convert_traits_to_dict(identity.traits),
+            map_traits_to_response_data(identity.traits),
+        ),
+        "cache.put_environment.unchanged": lambda: (
+            environment_service.cache.put_environment(
+                CLIENT_SIDE_KEY, unchanged_document
+            )
+        ),
+        "cache.put_environment.changed": lambda: put_cache.put_environment(
+            CLIENT_SIDE_KEY, next(alternating_documents)
+        ),
+    }
+    return [
+        _measure(f"micro.{name}", benchmark, repeat, min_time)
+        for name, benchmark in benchmarks.items()
+    ]
+
+
+def _measure(
+    name: str,
+    benchmark: Callable[[], Any],
+    repeat: int,
+    min_time: float,
+) -> BenchmarkResult:
+    timer = timeit.Timer(benchmark)
+    number = 1
+    while (elapsed := timer.timeit(number)) < min_time:
+        number = max(number * 2, int(number * min_time / max(elapsed, 1e-9)))
+    return BenchmarkResult(
+        name=name,
+        samples=[total / number for total in timer.repeat(repeat, number)],
+        params={"iterations": number},
+    )
+
+
+def _alternate(*documents: dict[str, Any]):
+    while True:
+        yield from documents
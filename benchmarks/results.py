@@ -0,0 +1,164 @@
+"""
+Machine-readable benchmark results, and comparison of two sets of them.
+"""
+
+import json
+import platform
+import statistics
+import subprocess
+import sys
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from importlib import metadata
+from pathlib import Path
+from typing import Any
+
+RESULTS_FORMAT_VERSION = 1
+
+
+@dataclass(slots=True)
+class BenchmarkResult:
+    """
+    Timings of a single benchmark, in seconds per operation. For end-to-end
+    runs, `throughput` is the number of requests served per second.
+    """
+
+    name: str
+    samples: list[float]
+    throughput: float | None = None
+    errors: int = 0
+    params: dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def summary(self) -> dict[str, float]:
+        samples = sorted(self.samples)
+        return {
+            "min": samples[0],
+            "median": statistics.median(samples),
+            "mean": statistics.fmean(samples),
+            "p90": _percentile(samples, 0.90),
+            "p99": _percentile(samples, 0.99),
+            "max": samples[-1],
+        }
+
+    def to_dict(self) -> dict[str, Any]:
+        result = {
+            "name": self.name,
+            "unit": "seconds",
+            "count": len(self.samples),
+            **self.summary,
+            "params": self.params,
+        }
+        if self.throughput is not None:
+            result["throughput"] = self.throughput
+            result["errors"] = self.errors
+        return result
+
+
+def get_run_metadata(**params: Any) -> dict[str, Any]:
+    return {
+        "format_version": RESULTS_FORMAT_VERSION,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "edge_proxy_version": _get_version(),
+        "git_commit": _get_git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "params": params,
+    }
+
+
+def write_results(
+    path: Path,
+    run_metadata: dict[str, Any],
+    results: list[BenchmarkResult],
+) -> None:
+    path.write_text(
+        json.dumps(
+            {**run_metadata, "results": [result.to_dict() for result in results]},
+            indent=2,
+        )
+    )
+
+
+def read_results(path: Path) -> dict[str, Any]:
+    return json.loads(path.read_text())
+
+
+def compare_results(
+    baseline: dict[str, Any],
+    current: dict[str, Any],
+    statistic: str = "median",
+) -> list[tuple[str, float, float, float]]:
+    """
+    Return the name, baseline and current value of the given statistic, and
+    the relative change, for every benchmark present in both sets of results.
+    Positive changes are slowdowns.
+    """
+    baseline_results = {result["name"]: result for result in baseline["results"]}
+    comparison = []
+    for result in current["results"]:
+        if (baseline_result := baseline_results.get(result["name"])) is None:
+            continue
+        baseline_value = baseline_result[statistic]
+        current_value = result[statistic]
+        change = (
+            (current_value - baseline_value) / baseline_value if baseline_value else 0.0
+        )
+        comparison.append((result["name"], baseline_value, current_value, change))
+    return comparison
+
+
+def format_results(results: list[BenchmarkResult]) -> str:
+    lines = [f"{'benchmark':<48} {'median':>12} {'p99':>12} {'throughput':>12}"]
+    for result in results:
+        summary = result.summary
+        throughput = f"{result.throughput:,.0f}/s" if result.throughput else ""
+        lines.append(
+            f"{result.name:<48} {_format_duration(summary['median']):>12} "
+            f"{_format_duration(summary['p99']):>12} {throughput:>12}"
+        )
+    return "\n".join(lines)
+
+
+def format_comparison(comparison: list[tuple[str, float, float, float]]) -> str:
+    lines = [f"{'benchmark':<48} {'baseline':>12} {'current':>12} {'change':>8}"]
+    for name, baseline_value, current_value, change in comparison:
+        lines.append(
+            f"{name:<48} {_format_duration(baseline_value):>12} "
+            f"{_format_duration(current_value):>12} {change:>+8.1%}"
+        )
+    return "\n".join(lines)
+
+
+def _format_duration(seconds: float) -> str:
+    if seconds >= 1:
+        return f"{seconds:.2f}s"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.2f}ms"
+    return f"{seconds * 1e6:.2f}us"
+
+
+def _percentile(sorted_samples: list[float], fraction: float) -> float:
+    index = min(len(sorted_samples) - 1, int(len(sorted_samples) * fraction))
+    return sorted_samples[index]
+
+
+def _get_version() -> str | None:
+    try:
+        return metadata.version("edge-proxy")
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def _get_git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
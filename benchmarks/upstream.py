@@ -0,0 +1,106 @@
+"""
+A local stand-in for the Flagsmith API's environment document endpoint, so that
+the proxy can be exercised without a live environment or network access.
+"""
+
+import hashlib
+import threading
+from contextlib import contextmanager
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator
+
+ENVIRONMENT_DOCUMENT_PATH = "/api/v1/environment-document/"
+
+
+class UpstreamServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        documents_by_server_key: dict[str, bytes],
+    ) -> None:
+        super().__init__(address, _EnvironmentDocumentHandler)
+        self.requests = 0
+        self.set_documents(documents_by_server_key)
+
+    @property
+    def api_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/api/v1"
+
+    def set_documents(self, documents_by_server_key: dict[str, bytes]) -> None:
+        """
+        Replace the served documents, e.g. to have the proxy pick up a change.
+        """
+        self.documents = {
+            server_key: (document, f'"{hashlib.sha1(document).hexdigest()}"')
+            for server_key, document in documents_by_server_key.items()
+        }
+
+
+class _EnvironmentDocumentHandler(BaseHTTPRequestHandler):
+    server: UpstreamServer
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self) -> None:
+        self.server.requests += 1
+        if self.path.partition("?")[0] != ENVIRONMENT_DOCUMENT_PATH:
+            self._respond(HTTPStatus.NOT_FOUND)
+            return
+        server_key = self.headers.get("X-Environment-Key", "")
+        if (served := self.server.documents.get(server_key)) is None:
+            self._respond(HTTPStatus.UNAUTHORIZED)
+            return
+
+        document, etag = served
+        if self.headers.get("If-None-Match") == etag:
+            self._respond(HTTPStatus.NOT_MODIFIED, headers={"ETag": etag})
+            return
+        self._respond(
+            HTTPStatus.OK,
+            document,
+            headers={"ETag": etag, "Content-Type": "application/json"},
+        )
+
+    def _respond(
+        self,
+        status: HTTPStatus,
+        body: bytes = b"",
+        headers: dict[str, str] | None = None,
+    ) -> None:
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if status != HTTPStatus.NOT_MODIFIED:
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+
+@contextmanager
+def run_upstream(
+    documents_by_server_key: dict[str, bytes],
+    host: str = "127.0.0.1",
+    port: int = 0,
+) -> Iterator[UpstreamServer]:
+    """
+    Serve the given documents from a background thread for the duration of
+    the context. Binds to a free port unless one is given.
+    """
+    server = UpstreamServer((host, port), documents_by_server_key)
+    thread = threading.Thread(
+        target=server.serve_forever, name="benchmark-upstream", daemon=True
+    )
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
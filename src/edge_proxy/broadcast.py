@@ -0,0 +1,60 @@
+import asyncio
+from typing import AsyncIterator
+
+
+class EnvironmentBroadcaster:
+    """
+    Notify subscribers of changes to a single environment.
+
+    Subscribers share one event, replaced on every publish, so an idle
+    subscriber costs a single waiter on that event. A subscriber that falls
+    behind skips straight to the latest message instead of queueing every
+    change it missed.
+    """
+
+    __slots__ = ("version", "message", "_changed")
+
+    def __init__(self) -> None:
+        self.version = 0
+        self.message: bytes | None = None
+        # Created on first wait, so that the broadcaster is bound to the loop
+        # of its subscribers rather than to whichever loop was current when
+        # it was created.
+        self._changed: asyncio.Event | None = None
+
+    def publish(self, message: bytes) -> None:
+        self.version += 1
+        self.message = message
+        if self._changed is not None:
+            self._changed.set()
+            self._changed = None
+
+    async def wait(self, version: int, timeout: float | None = None) -> bool:
+        """
+        Wait until a message newer than `version` is published, for at most
+        `timeout` seconds. Returns a boolean confirming if there is one.
+        """
+        if self.version > version:
+            return True
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def subscribe(
+        self, keepalive_seconds: float | None = None
+    ) -> AsyncIterator[bytes | None]:
+        """
+        Yield the latest message, if any, then every message published after
+        it. Yields None when nothing was published for `keepalive_seconds`.
+        """
+        version = 0
+        while True:
+            if not await self.wait(version, keepalive_seconds):
+                yield None
+                continue
+            version = self.version
+            yield self.message
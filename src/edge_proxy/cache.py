@@ -1,10 +1,44 @@
+import sys
 from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from pathlib import Path
 from typing import Any
 
-from edge_proxy.feature_utils import build_feature_types_lookup
+import orjson
+import structlog
+
+from edge_proxy.compiled import CompiledEnvironment, compile_environment
+from edge_proxy.diffing import EnvironmentChanges, diff_compiled_environments
+from edge_proxy.exceptions import InvalidSnapshotError
+from edge_proxy.settings import AppSettings, EnvironmentsCacheBackend
+from edge_proxy.snapshots import (
+    STATUSES_FILE_NAME,
+    get_snapshot_path,
+    read_snapshot,
+    write_file_atomically,
+    write_snapshot,
+)
+
+logger = structlog.get_logger(__name__)
+
+
+@dataclass(frozen=True, slots=True)
+class EnvironmentValidators:
+    """
+    Upstream validators for a cached environment document, used to detect
+    changes without parsing or comparing documents.
+    """
+
+    etag: str | None = None
+    last_modified: str | None = None
+    digest: bytes | None = None
 
 
 class BaseEnvironmentsCache(ABC):
+    # Whether the cache keeps the serialized environment documents, in which
+    # case callers pass them to `put_environment` when they have them.
+    keeps_content = False
+
     def __init__(self, *args, **kwargs):
         self.last_updated_at = None
 
@@ -12,52 +46,293 @@ class BaseEnvironmentsCache(ABC):
         self,
         environment_api_key: str,
         environment_document: dict[str, Any],
+        validators: EnvironmentValidators | None = None,
+        content: bytes | None = None,
     ) -> bool:
         """
         Update the environment cache for the given key with the given environment document.
 
         Returns a boolean confirming if the cache was updated or not (i.e. if the environment document
         was different from the one already in the cache).
+
+        When validators carrying a digest of the upstream response are given, the digests
+        are compared instead of the documents themselves. `content` is the document as
+        received from upstream, if available.
         """
-        # TODO: can we use the environment header here instead of comparing the document?
-        if environment_document != self.get_environment(environment_api_key):
-            self._put_environment(environment_api_key, environment_document)
-            return True
-        return False
+        if validators and validators.digest:
+            cached_validators = self.get_validators(environment_api_key)
+            changed = not (
+                cached_validators and cached_validators.digest == validators.digest
+            )
+        else:
+            changed = environment_document != self.get_environment(environment_api_key)
+
+        if changed:
+            self._put_environment(
+                environment_api_key,
+                environment_document,
+                validators or EnvironmentValidators(),
+                content,
+            )
+        return changed
 
     @abstractmethod
     def _put_environment(
         self,
         environment_api_key: str,
         environment_document: dict[str, Any],
+        validators: EnvironmentValidators,
+        content: bytes | None,
     ) -> None: ...
 
     @abstractmethod
     def get_environment(self, environment_api_key: str) -> dict[str, Any] | None: ...
 
+    def has_environment(self, environment_api_key: str) -> bool:
+        return self.get_environment(environment_api_key) is not None
+
+    def get_environment_content(self, environment_api_key: str) -> bytes | None:
+        """
+        Return the cached environment document serialized as JSON, if the cache
+        keeps it. Callers are expected to serialize the document themselves when
+        this returns None.
+        """
+        return None
+
     @abstractmethod
     def get_feature_types(self, environment_api_key: str) -> dict[int, str] | None: ...
 
+    @abstractmethod
+    def get_validators(
+        self, environment_api_key: str
+    ) -> EnvironmentValidators | None: ...
+
+    def get_compiled_environment(
+        self, environment_api_key: str
+    ) -> CompiledEnvironment | None:
+        """
+        Return the compiled form of the cached environment document, if the
+        cache keeps one. Callers are expected to compile the document themselves
+        when this returns None.
+        """
+        return None
+
+    def get_environment_changes(
+        self, environment_api_key: str
+    ) -> EnvironmentChanges | None:
+        """
+        Return the changes made by the last update of the environment document
+        for the given key. None means that they are unknown, and callers should
+        assume that everything changed.
+        """
+        return None
+
+    def put_statuses(self, content: bytes) -> None:
+        """
+        Share the serialized environment statuses of the replica polling
+        upstream with the others, if the cache is shared between replicas.
+        """
+
+    def get_statuses(self) -> bytes | None:
+        """
+        Return the environment statuses shared with `put_statuses`, if any.
+        """
+        return None
+
+    async def write_shared_environments(self) -> None:
+        """
+        Write the environment documents put since the last call to the store
+        shared between replicas, if the cache is shared. Documents that could
+        not be written are written again on the next call.
+        """
+
+    def load_snapshot(self, environment_api_key: str) -> bool:
+        """
+        Restore the environment document for the given key from a snapshot.
+
+        Returns a boolean confirming if a snapshot was loaded.
+        """
+        return False
+
+    def reload_snapshot(self, environment_api_key: str) -> bool:
+        """
+        Restore the environment document for the given key from a snapshot
+        written by another process, if it changed since it was last loaded.
+
+        Returns a boolean confirming if a snapshot was loaded.
+        """
+        return False
+
+    async def reload_snapshots(self, environment_api_keys: list[str]) -> list[str]:
+        """
+        Reload the snapshots for the given keys that changed since they were
+        last loaded, and return the keys of those reloaded.
+        """
+        return [
+            environment_api_key
+            for environment_api_key in environment_api_keys
+            if self.reload_snapshot(environment_api_key)
+        ]
+
 
 _LocalCacheDict = dict[str, dict[str, Any]]
 
 
 class LocalMemEnvironmentsCache(BaseEnvironmentsCache):
-    def __init__(self, *args, **kwargs):
+    keeps_content = True
+
+    def __init__(self, *args, snapshot_dir: Path | None = None, **kwargs):
         super().__init__(*args, **kwargs)
+        self.snapshot_dir = snapshot_dir
         self._environment_cache: _LocalCacheDict = {}
+        self._content_cache: dict[str, bytes] = {}
         self._feature_types_cache: dict[str, dict[int, str]] = {}
+        self._compiled_environment_cache: dict[str, CompiledEnvironment] = {}
+        self._validators_cache: dict[str, EnvironmentValidators] = {}
+        self._environment_changes: dict[str, EnvironmentChanges] = {}
+        self._snapshot_file_ids: dict[str, tuple[int, int, int]] = {}
 
     def _put_environment(
         self,
         environment_api_key: str,
         environment_document: dict[str, Any],
+        validators: EnvironmentValidators,
+        content: bytes | None,
     ) -> None:
-        self._environment_cache[environment_api_key] = environment_document
+        self._store_environment(
+            environment_api_key, environment_document, validators, content
+        )
+        if self.snapshot_dir:
+            self._write_snapshot(
+                environment_api_key,
+                self.get_environment_content(environment_api_key)
+                or orjson.dumps(environment_document),
+                validators,
+            )
 
-        self._feature_types_cache[environment_api_key] = build_feature_types_lookup(
-            environment_document
+    def load_snapshot(self, environment_api_key: str) -> bool:
+        if not self.snapshot_dir:
+            return False
+        path = get_snapshot_path(self.snapshot_dir, environment_api_key)
+        try:
+            file_id = _get_file_id(path)
+            snapshot = read_snapshot(path)
+        except FileNotFoundError:
+            return False
+        except (InvalidSnapshotError, OSError):
+            logger.exception(
+                "error_reading_snapshot", client_side_key=environment_api_key
+            )
+            return False
+
+        self._store_environment(
+            environment_api_key,
+            snapshot.document,
+            EnvironmentValidators(
+                etag=snapshot.etag,
+                last_modified=snapshot.last_modified,
+                digest=snapshot.digest,
+            ),
         )
+        self._snapshot_file_ids[environment_api_key] = file_id
+        return True
+
+    def reload_snapshot(self, environment_api_key: str) -> bool:
+        if not self.snapshot_dir:
+            return False
+        # Snapshots are replaced by renaming, so a rewritten snapshot always
+        # has a new inode; a stat is enough to tell whether to read it again.
+        try:
+            file_id = _get_file_id(
+                get_snapshot_path(self.snapshot_dir, environment_api_key)
+            )
+        except FileNotFoundError:
+            return False
+        if self._snapshot_file_ids.get(environment_api_key) == file_id:
+            return False
+        return self.load_snapshot(environment_api_key)
+
+    def put_statuses(self, content: bytes) -> None:
+        if not self.snapshot_dir:
+            return
+        try:
+            write_file_atomically(self.snapshot_dir / STATUSES_FILE_NAME, content)
+        except OSError:
+            logger.exception("error_writing_environment_statuses")
+
+    def get_statuses(self) -> bytes | None:
+        if not self.snapshot_dir:
+            return None
+        try:
+            return (self.snapshot_dir / STATUSES_FILE_NAME).read_bytes()
+        except FileNotFoundError:
+            return None
+        except OSError:
+            logger.exception("error_reading_environment_statuses")
+            return None
+
+    def _write_snapshot(
+        self,
+        environment_api_key: str,
+        content: bytes,
+        validators: EnvironmentValidators,
+    ) -> None:
+        try:
+            write_snapshot(
+                get_snapshot_path(self.snapshot_dir, environment_api_key),
+                content,
+                etag=validators.etag,
+                last_modified=validators.last_modified,
+                digest=validators.digest,
+            )
+        except OSError:
+            logger.exception(
+                "error_writing_snapshot", client_side_key=environment_api_key
+            )
+
+    def _store_environment(
+        self,
+        environment_api_key: str,
+        environment_document: dict[str, Any],
+        validators: EnvironmentValidators,
+        content: bytes | None = None,
+    ) -> None:
+        self._store_document(environment_api_key, environment_document, content)
+        self._validators_cache[environment_api_key] = validators
+
+        previous_compiled_environment = self._compiled_environment_cache.pop(
+            environment_api_key, None
+        )
+        self._environment_changes.pop(environment_api_key, None)
+        try:
+            compiled_environment = compile_environment(environment_document)
+        except (KeyError, TypeError):
+            logger.exception(
+                "error_compiling_document", client_side_key=environment_api_key
+            )
+            self._feature_types_cache.pop(environment_api_key, None)
+            return
+
+        if previous_compiled_environment:
+            self._environment_changes[environment_api_key] = diff_compiled_environments(
+                previous_compiled_environment, compiled_environment
+            )
+        self._compiled_environment_cache[environment_api_key] = compiled_environment
+        self._feature_types_cache[environment_api_key] = (
+            compiled_environment.feature_types
+        )
+
+    def _store_document(
+        self,
+        environment_api_key: str,
+        environment_document: dict[str, Any],
+        content: bytes | None,
+    ) -> None:
+        self._environment_cache[environment_api_key] = environment_document
+        if content is None:
+            self._content_cache.pop(environment_api_key, None)
+        else:
+            self._content_cache[environment_api_key] = content
 
     def get_environment(
         self,
@@ -67,3 +342,98 @@ class LocalMemEnvironmentsCache(BaseEnvironmentsCache):
 
     def get_feature_types(self, environment_api_key: str) -> dict[int, str] | None:
         return self._feature_types_cache.get(environment_api_key)
+
+    def get_compiled_environment(
+        self, environment_api_key: str
+    ) -> CompiledEnvironment | None:
+        return self._compiled_environment_cache.get(environment_api_key)
+
+    def get_environment_content(self, environment_api_key: str) -> bytes | None:
+        return self._content_cache.get(environment_api_key)
+
+    def get_validators(self, environment_api_key: str) -> EnvironmentValidators | None:
+        return self._validators_cache.get(environment_api_key)
+
+    def get_environment_changes(
+        self, environment_api_key: str
+    ) -> EnvironmentChanges | None:
+        return self._environment_changes.get(environment_api_key)
+
+
+class CompactEnvironmentsCache(LocalMemEnvironmentsCache):
+    """
+    A local in-memory cache that keeps environment documents serialized, next
+    to their compiled form, rather than as parsed trees. Short strings, such
+    as feature names, trait keys and operators, are interned so that a single
+    copy of each is shared across documents.
+
+    `get_environment` parses the serialized document on every call, so the
+    request paths rely on compiled environments and serialized documents only.
+    """
+
+    def _store_document(
+        self,
+        environment_api_key: str,
+        environment_document: dict[str, Any],
+        content: bytes | None,
+    ) -> None:
+        # Interned before compiling, so that compiled environments share the
+        # interned strings.
+        _intern_strings(environment_document)
+        self._content_cache[environment_api_key] = (
+            content if content is not None else orjson.dumps(environment_document)
+        )
+
+    def get_environment(
+        self,
+        environment_api_key: str,
+    ) -> dict[str, Any] | None:
+        if (content := self._content_cache.get(environment_api_key)) is None:
+            return None
+        return orjson.loads(content)
+
+    def has_environment(self, environment_api_key: str) -> bool:
+        return environment_api_key in self._content_cache
+
+
+def create_environments_cache(settings: AppSettings) -> BaseEnvironmentsCache:
+    if settings.environments_cache_backend == EnvironmentsCacheBackend.COMPACT:
+        return CompactEnvironmentsCache(snapshot_dir=settings.snapshot_dir)
+    if settings.environments_cache_backend == EnvironmentsCacheBackend.REDIS:
+        from edge_proxy.redis_cache import RedisEnvironmentsCache, create_redis_client
+
+        return RedisEnvironmentsCache(
+            create_redis_client(settings.redis),
+            key_prefix=settings.redis.key_prefix,
+            snapshot_dir=settings.snapshot_dir,
+        )
+    return LocalMemEnvironmentsCache(snapshot_dir=settings.snapshot_dir)
+
+
+# Longer strings are mostly values unique to a document, e.g. identifiers and
+# remote config, which interning would not deduplicate.
+_MAX_INTERNED_LENGTH = 64
+
+
+def _intern_strings(value: Any) -> None:
+    """
+    Replace the short strings among the values of the given JSON tree with
+    their interned copies, in place.
+    """
+    if isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, list):
+        items = enumerate(value)
+    else:
+        return
+    for key, item in items:
+        if isinstance(item, str):
+            if len(item) <= _MAX_INTERNED_LENGTH:
+                value[key] = sys.intern(item)
+        else:
+            _intern_strings(item)
+
+
+def _get_file_id(path: Path) -> tuple[int, int, int]:
+    stat_result = path.stat()
+    return stat_result.st_ino, stat_result.st_mtime_ns, stat_result.st_size
@@ -0,0 +1,236 @@
+import hashlib
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any
+
+import orjson
+from flagsmith.mappers import map_environment_document_to_context
+from flag_engine.context.types import FeatureContext, SegmentContext
+from flag_engine.result.types import FlagResult
+from flag_engine.segments.evaluator import get_flag_result_from_context
+from flagsmith.types import SDKEvaluationContext
+
+from edge_proxy.feature_utils import (
+    build_feature_types_lookup,
+    filter_disabled_flags,
+    filter_out_server_key_only_flags,
+)
+from edge_proxy.mappers import map_flag_result_to_response_data
+from edge_proxy.segment_index import SegmentIndex, build_segment_index
+
+
+@dataclass(frozen=True, slots=True)
+class DefaultIdentityFlags:
+    """
+    The flags of identities that are in no segment and have no overrides.
+
+    These are the environment's default flags, except for multivariate
+    features, whose variant is picked by hashing the identity's key.
+    """
+
+    response_data: list[dict[str, Any]]
+    # Positions in `response_data` of the multivariate features.
+    multivariate_features: tuple[tuple[int, FeatureContext[Any]], ...]
+    feature_types: dict[int, str]
+    environment_key: str
+
+    def get_response_data(self, identifier: str) -> list[dict[str, Any]]:
+        if not self.multivariate_features:
+            return self.response_data
+
+        response_data = self.response_data.copy()
+        for position, feature_context in self.multivariate_features:
+            response_data[position] = map_flag_result_to_response_data(
+                get_default_flag_result(
+                    self.environment_key, identifier, feature_context
+                ),
+                self.feature_types,
+            )
+        return response_data
+
+
+def get_default_flag_result(
+    environment_key: str,
+    identifier: str,
+    feature_context: FeatureContext[Any],
+) -> FlagResult[Any]:
+    """
+    Return the flag for an identity that no segment or identity override
+    overrides the feature for.
+    """
+    # Only the identity key is read when picking a variant.
+    identity_context: Any = {"identity": {"key": f"{environment_key}_{identifier}"}}
+    return get_flag_result_from_context(
+        identity_context, feature_context, reason="DEFAULT"
+    )
+
+
+@dataclass(frozen=True, slots=True)
+class CompiledEnvironment:
+    """
+    Everything the request paths need from an environment document,
+    derived once when the document changes rather than on every request.
+    """
+
+    context: SDKEvaluationContext
+    # The context to evaluate environment flags with, i.e. without an identity.
+    environment_context: SDKEvaluationContext
+    segment_index: SegmentIndex
+    # Identity override segments by identifier, with rules that always match.
+    identity_overrides: dict[str, dict[str, SegmentContext[Any, Any]]]
+    feature_types: dict[int, str]
+    server_key_only_feature_ids: frozenset[int]
+    hide_disabled_flags: bool
+    # By whether the flags are for a server side key. None if the environment
+    # has segments that identities can be in regardless of their traits.
+    default_identity_flags: dict[bool, DefaultIdentityFlags] | None
+    # Identifies the document's content, e.g. for use in ETags.
+    version: str
+    updated_at: datetime | None
+
+
+def get_document_digest(content: bytes) -> bytes:
+    return new_document_hash(content).digest()
+
+
+def new_document_hash(content: bytes = b"") -> "hashlib.blake2b":
+    """
+    Return a hash object that `get_document_digest` computes its digests with,
+    for documents received in chunks.
+    """
+    return hashlib.blake2b(content, digest_size=16)
+
+
+def compile_environment(environment_document: dict[str, Any]) -> CompiledEnvironment:
+    project = environment_document.get("project", {})
+    context = map_environment_document_to_context(environment_document)
+    segments, identity_overrides = _split_identity_overrides(context.get("segments"))
+    segment_index = build_segment_index(segments)
+    feature_types = build_feature_types_lookup(environment_document)
+    server_key_only_feature_ids = frozenset(
+        project.get("server_key_only_feature_ids", [])
+    )
+    hide_disabled_flags = project.get("hide_disabled_flags", False)
+    return CompiledEnvironment(
+        context=context,
+        environment_context={
+            **context,
+            "segments": segment_index.get_candidate_segments(None),
+        },
+        segment_index=segment_index,
+        identity_overrides=identity_overrides,
+        feature_types=feature_types,
+        server_key_only_feature_ids=server_key_only_feature_ids,
+        hide_disabled_flags=hide_disabled_flags,
+        default_identity_flags=(
+            None
+            if segment_index.unconstrained_segments
+            else _get_default_identity_flags(
+                context,
+                feature_types,
+                server_key_only_feature_ids,
+                hide_disabled_flags,
+            )
+        ),
+        version=get_document_digest(orjson.dumps(environment_document)).hex(),
+        updated_at=parse_updated_at(environment_document.get("updated_at")),
+    )
+
+
+def _get_default_identity_flags(
+    context: SDKEvaluationContext,
+    feature_types: dict[int, str],
+    server_key_only_feature_ids: frozenset[int],
+    hide_disabled_flags: bool,
+) -> dict[bool, DefaultIdentityFlags]:
+    features = context.get("features") or {}
+    # Without an identity in the context, every feature gets its default value.
+    flags = [
+        get_flag_result_from_context(context, feature_context, reason="DEFAULT")
+        for feature_context in features.values()
+    ]
+    client_flags = filter_disabled_flags(
+        filter_out_server_key_only_flags(flags, server_key_only_feature_ids),
+        hide_disabled_flags,
+    )
+
+    default_identity_flags = {}
+    for is_server_key, key_flags in ((False, client_flags), (True, flags)):
+        default_identity_flags[is_server_key] = DefaultIdentityFlags(
+            response_data=[
+                map_flag_result_to_response_data(flag_result, feature_types)
+                for flag_result in key_flags
+            ],
+            multivariate_features=tuple(
+                (position, feature_context)
+                for position, flag_result in enumerate(key_flags)
+                if (feature_context := features[flag_result["name"]]).get("variants")
+            ),
+            feature_types=feature_types,
+            environment_key=context["environment"]["key"],
+        )
+    return default_identity_flags
+
+
+def parse_updated_at(updated_at: Any) -> datetime | None:
+    if not isinstance(updated_at, str):
+        return None
+    try:
+        parsed = datetime.fromisoformat(updated_at)
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _split_identity_overrides(
+    segments: dict[str, SegmentContext[Any, Any]] | None,
+) -> tuple[
+    dict[str, SegmentContext[Any, Any]],
+    dict[str, dict[str, SegmentContext[Any, Any]]],
+]:
+    """
+    Separate the segments the SDK builds from identity overrides, which match
+    identifiers listed in a single `IN` condition, from the other segments.
+
+    Rather than evaluating that condition against every listed identifier on
+    each request, index the override segments by identifier. The indexed
+    copies get a rule without conditions, which always matches.
+    """
+    other_segments: dict[str, SegmentContext[Any, Any]] = {}
+    identity_overrides: dict[str, dict[str, SegmentContext[Any, Any]]] = {}
+
+    for segment_key, segment in (segments or {}).items():
+        if (identifiers := _get_overridden_identifiers(segment)) is None:
+            other_segments[segment_key] = segment
+            continue
+
+        matched_segment = {**segment, "rules": [{"type": "ALL", "conditions": []}]}
+        for identifier in identifiers:
+            identity_overrides.setdefault(
+                identifier if type(identifier) is str else str(identifier), {}
+            )[segment_key] = matched_segment
+
+    return other_segments, identity_overrides
+
+
+def _get_overridden_identifiers(
+    segment: SegmentContext[Any, Any],
+) -> list[Any] | None:
+    if (segment.get("metadata") or {}).get("source") != "identity_overrides":
+        return None
+    match_rules = segment["rules"]
+    if (
+        len(match_rules) != 1
+        or match_rules[0]["type"] != "ALL"
+        or match_rules[0].get("rules")
+        or len(conditions := match_rules[0].get("conditions") or []) != 1
+    ):
+        return None
+    condition = conditions[0]
+    if (
+        condition["property"] == "$.identity.identifier"
+        and condition["operator"] == "IN"
+        and isinstance(condition["value"], list)
+    ):
+        return condition["value"]
+    return None
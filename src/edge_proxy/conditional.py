@@ -0,0 +1,61 @@
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+
+@dataclass(frozen=True, slots=True)
+class ResponseValidators:
+    """
+    Validators for a response derived from an environment document, used to
+    answer conditional requests without rendering the response.
+    """
+
+    etag: str
+    last_modified: datetime | None = None
+
+    @property
+    def headers(self) -> dict[str, str]:
+        headers = {"ETag": self.etag}
+        if self.last_modified:
+            headers["Last-Modified"] = format_datetime(
+                self.last_modified.astimezone(timezone.utc), usegmt=True
+            )
+        return headers
+
+    def is_not_modified(
+        self,
+        if_none_match: str | None,
+        if_modified_since: str | None,
+    ) -> bool:
+        """
+        Whether a request with the given conditional headers can be answered
+        with 304 Not Modified. As per RFC 9110, If-Modified-Since is ignored
+        when If-None-Match is present.
+        """
+        if if_none_match:
+            return _matches_etag(self.etag, if_none_match)
+        if if_modified_since and self.last_modified:
+            try:
+                modified_since = parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            if modified_since.tzinfo is None:
+                return False
+            # HTTP dates have a resolution of one second.
+            return self.last_modified.replace(microsecond=0) <= modified_since
+        return False
+
+
+def _matches_etag(etag: str, if_none_match: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    opaque_tag = _get_opaque_tag(etag)
+    return any(
+        _get_opaque_tag(candidate.strip()) == opaque_tag
+        for candidate in if_none_match.split(",")
+    )
+
+
+def _get_opaque_tag(etag: str) -> str:
+    # If-None-Match uses weak comparison.
+    return etag.removeprefix("W/")
@@ -0,0 +1,106 @@
+from dataclasses import dataclass
+
+from edge_proxy.compiled import CompiledEnvironment
+from edge_proxy.segment_index import Requirements, SegmentIndex
+
+
+@dataclass(frozen=True, slots=True)
+class EnvironmentChanges:
+    """
+    What changed between two versions of an environment document, as far as
+    flag evaluation is concerned, so that only the responses it affects need
+    to be computed again.
+    """
+
+    # Settings that can change any response: which features there are, hiding
+    # disabled flags, server side only features or the environment key.
+    project: bool
+    # Names of the features, present in both versions, whose environment
+    # default or type changed.
+    features: frozenset[str]
+    # Requirements of the segments that were added, removed or changed, in
+    # either version. Identities that can match none of these are unaffected.
+    segment_requirements: tuple[Requirements, ...]
+    # Identifiers whose identity overrides changed.
+    identity_overrides: frozenset[str]
+
+    def get_changed_environment_flags(self) -> frozenset[str] | None:
+        """
+        Return the names of the features whose environment flags, i.e. those
+        evaluated without an identity, may have changed, or None if all of them
+        may have.
+        """
+        if self.project or not all(self.segment_requirements):
+            # Environment flags are evaluated against the segments that do not
+            # depend on traits.
+            return None
+        return self.features
+
+
+def diff_compiled_environments(
+    previous: CompiledEnvironment,
+    current: CompiledEnvironment,
+) -> EnvironmentChanges:
+    previous_features = previous.context.get("features") or {}
+    current_features = current.context.get("features") or {}
+    project = (
+        list(previous_features) != list(current_features)
+        or previous.hide_disabled_flags != current.hide_disabled_flags
+        or previous.server_key_only_feature_ids != current.server_key_only_feature_ids
+        or previous.context["environment"]["key"]
+        != current.context["environment"]["key"]
+    )
+
+    features = frozenset()
+    if not project:
+        features = frozenset(
+            feature_name
+            for feature_name, feature_context in current_features.items()
+            if feature_context != previous_features[feature_name]
+            or _get_feature_type(previous, feature_name)
+            != _get_feature_type(current, feature_name)
+        )
+
+    segment_requirements = []
+    previous_segments = previous.segment_index.segments
+    current_segments = current.segment_index.segments
+    for segment_key in previous_segments.keys() | current_segments.keys():
+        if previous_segments.get(segment_key) == current_segments.get(segment_key):
+            continue
+        for segment_index in (previous.segment_index, current.segment_index):
+            if (
+                requirements := _get_requirements(segment_index, segment_key)
+            ) is not None:
+                segment_requirements.append(requirements)
+
+    previous_overrides = previous.identity_overrides
+    current_overrides = current.identity_overrides
+    identity_overrides = frozenset(
+        identifier
+        for identifier in previous_overrides.keys() | current_overrides.keys()
+        if previous_overrides.get(identifier) != current_overrides.get(identifier)
+    )
+
+    return EnvironmentChanges(
+        project=project,
+        features=features,
+        segment_requirements=tuple(segment_requirements),
+        identity_overrides=identity_overrides,
+    )
+
+
+def _get_feature_type(
+    compiled_environment: CompiledEnvironment, feature_name: str
+) -> str | None:
+    feature_context = compiled_environment.context["features"][feature_name]
+    feature_id = (feature_context.get("metadata") or {}).get("id")
+    return compiled_environment.feature_types.get(feature_id)
+
+
+def _get_requirements(
+    segment_index: SegmentIndex, segment_key: str
+) -> Requirements | None:
+    # Segments left out of the index never match, so cannot affect anything.
+    if segment_key in segment_index.unconstrained_segments:
+        return ()
+    return segment_index.requirements.get(segment_key)
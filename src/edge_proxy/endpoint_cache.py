@@ -0,0 +1,132 @@
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, NamedTuple, TypeVar
+
+T = TypeVar("T")
+
+
+class EndpointCacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    evictions: int
+    currsize: int
+    maxsize: int
+    generation: int
+
+
+class _Partition:
+    __slots__ = ("entries", "generation", "hits", "misses", "evictions")
+
+    def __init__(self) -> None:
+        self.entries: OrderedDict[Hashable, Any] = OrderedDict()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+class EndpointCache:
+    """
+    An LRU cache for endpoint responses, partitioned by environment.
+
+    Each environment gets its own partition of up to `maxsize` entries and a
+    generation number. Invalidating an environment bumps its generation and
+    drops its entries without touching any other environment's partition.
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self._partitions: dict[str, _Partition] = {}
+
+    def get_or_compute(
+        self,
+        environment_key: str,
+        key: Hashable,
+        compute: Callable[[], T],
+        generation: int | None = None,
+    ) -> T:
+        """
+        Return the cached value for the given key, or compute and cache it.
+
+        Callers computing values from a document captured earlier pass the
+        generation they started in: if the environment was invalidated or
+        updated since, the value is computed but not cached, as it may be
+        derived from the replaced document.
+        """
+        partition = self._partitions.get(environment_key)
+        if partition is not None:
+            try:
+                value = partition.entries[key]
+            except KeyError:
+                pass
+            else:
+                partition.hits += 1
+                partition.entries.move_to_end(key)
+                return value
+
+        value = compute()
+        if generation is not None and generation != self.get_generation(
+            environment_key
+        ):
+            return value
+        # Only create the partition once `compute` succeeded, so that unknown
+        # environment keys do not leave one behind.
+        if partition is None:
+            partition = self._get_partition(environment_key)
+        partition.misses += 1
+        entries = partition.entries
+        entries[key] = value
+        if len(entries) > self.maxsize:
+            entries.popitem(last=False)
+            partition.evictions += 1
+        return value
+
+    def invalidate(self, environment_key: str) -> None:
+        partition = self._get_partition(environment_key)
+        partition.entries.clear()
+        partition.generation += 1
+
+    def update(
+        self,
+        environment_key: str,
+        update_entry: Callable[[Hashable, Any], Any | None],
+    ) -> None:
+        """
+        Replace each of the environment's entries with what `update_entry`
+        returns for its key and value, dropping the entries it returns None
+        for. Like invalidating, this starts a new generation.
+        """
+        partition = self._get_partition(environment_key)
+        entries = partition.entries
+        for key, value in list(entries.items()):
+            if (updated_value := update_entry(key, value)) is None:
+                del entries[key]
+            else:
+                entries[key] = updated_value
+        partition.generation += 1
+
+    def get_generation(self, environment_key: str) -> int:
+        if (partition := self._partitions.get(environment_key)) is None:
+            return 0
+        return partition.generation
+
+    def cache_info(self, environment_key: str) -> EndpointCacheInfo:
+        partition = self._partitions.get(environment_key) or _Partition()
+        return EndpointCacheInfo(
+            hits=partition.hits,
+            misses=partition.misses,
+            evictions=partition.evictions,
+            currsize=len(partition.entries),
+            maxsize=self.maxsize,
+            generation=partition.generation,
+        )
+
+    def cache_infos(self) -> dict[str, EndpointCacheInfo]:
+        return {
+            environment_key: self.cache_info(environment_key)
+            for environment_key in self._partitions
+        }
+
+    def _get_partition(self, environment_key: str) -> _Partition:
+        if (partition := self._partitions.get(environment_key)) is None:
+            partition = self._partitions[environment_key] = _Partition()
+        return partition
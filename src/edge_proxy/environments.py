@@ -1,22 +1,35 @@
-from typing import Any
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Any, Iterator
 from datetime import datetime
 from email.utils import formatdate
-from functools import lru_cache
 
 import httpx
 import starlette.status
 import structlog
 from flag_engine.engine import get_evaluation_result
-from flagsmith.mappers import (
-    map_environment_document_to_context,
-    map_context_and_identity_data_to_context,
-)
+from flag_engine.result.types import FlagResult
+from flagsmith.mappers import map_context_and_identity_data_to_context
 from orjson import orjson
 
-from edge_proxy.cache import BaseEnvironmentsCache, LocalMemEnvironmentsCache
+from edge_proxy.broadcast import EnvironmentBroadcaster
+from edge_proxy.cache import (
+    BaseEnvironmentsCache,
+    EnvironmentValidators,
+    LocalMemEnvironmentsCache,
+)
+from edge_proxy.compiled import (
+    CompiledEnvironment,
+    compile_environment,
+    get_default_flag_result,
+    parse_updated_at,
+)
+from edge_proxy.conditional import ResponseValidators
+from edge_proxy.diffing import EnvironmentChanges
+from edge_proxy.endpoint_cache import EndpointCache
 from edge_proxy.exceptions import FeatureNotFoundError, FlagsmithUnknownKeyError
 from edge_proxy.feature_utils import (
-    build_feature_types_lookup,
     filter_disabled_flags,
     filter_out_server_key_only_flags,
 )
@@ -26,16 +39,36 @@ from edge_proxy.mappers import (
     map_flag_results_to_response_data,
     map_traits_to_response_data,
 )
-from edge_proxy.models import IdentityWithTraits
+from edge_proxy.metrics import Metrics
+from edge_proxy.models import IdentityCacheKey, IdentityWithTraits
+from edge_proxy.rendering import RenderedBody, RenderedFlags, encode_body, render_body
+from edge_proxy.segment_index import can_match
 from edge_proxy.settings import AppSettings, EnvironmentKeyPair
+from edge_proxy.spooling import SpooledDocument
 
 logger = structlog.get_logger(__name__)
 
 SERVER_API_KEY_PREFIX = "ser."
 
 
-def _get_hide_disabled_flags(environment_document: dict[str, Any]) -> bool:
-    return environment_document.get("project", {}).get("hide_disabled_flags", False)
+@dataclass(slots=True)
+class EnvironmentStatus:
+    last_attempted_at: datetime | None = None
+    last_successful_fetch_at: datetime | None = None
+    last_changed_at: datetime | None = None
+    error_streak: int = 0
+    # When the document was restored from a snapshot, which may be much older.
+    restored_at: datetime | None = None
+
+    @property
+    def last_loaded_at(self) -> datetime | None:
+        """
+        When the document was last fetched or restored from a snapshot.
+        """
+        return max(
+            filter(None, (self.last_successful_fetch_at, self.restored_at)),
+            default=None,
+        )
 
 
 class EnvironmentService:
@@ -50,179 +83,767 @@ class EnvironmentService:
         self._client = client or httpx.AsyncClient(
             timeout=settings.api_poll_timeout_seconds,
         )
-        self.last_updated_at = None
+        self.environment_statuses: dict[str, EnvironmentStatus] = {
+            key_pair.client_side_key: EnvironmentStatus()
+            for key_pair in self.settings.environment_key_pairs
+        }
+        self._client_keys_by_server_key = {
+            key_pair.server_side_key: key_pair.client_side_key
+            for key_pair in self.settings.environment_key_pairs
+        }
+        self._rendered_flags: dict[tuple[str, bool], RenderedFlags] = {}
+        # Rendered environment documents, along with the document or content
+        # they were rendered from so that a replaced one is never served stale.
+        self._rendered_documents: dict[
+            str, tuple[dict[str, Any] | bytes, RenderedBody]
+        ] = {}
+        self._broadcasters = {
+            key_pair.client_side_key: EnvironmentBroadcaster()
+            for key_pair in self.settings.environment_key_pairs
+        }
+        self.metrics = Metrics(self.settings.environment_key_pairs)
 
+        self.flags_cache: EndpointCache | None = None
+        self.identities_cache: EndpointCache | None = None
         if settings.endpoint_caches:
             if settings.endpoint_caches.flags.use_cache:
-                self.get_flags_response_data = lru_cache(
+                self.flags_cache = EndpointCache(
                     maxsize=settings.endpoint_caches.flags.cache_max_size,
-                )(self.get_flags_response_data)
+                )
 
             if settings.endpoint_caches.identities.use_cache:
-                self.get_identity_response_data = lru_cache(
+                self.identities_cache = EndpointCache(
                     maxsize=settings.endpoint_caches.identities.cache_max_size,
-                )(self.get_identity_response_data)
+                )
+        self.metrics.register_service(self)
 
     async def refresh_environment_caches(self):
-        received_error = False
+        semaphore = asyncio.Semaphore(self.settings.api_poll_concurrency)
+        await asyncio.gather(
+            *(
+                self._refresh_environment(key_pair, semaphore)
+                for key_pair in self.settings.environment_key_pairs
+            )
+        )
+        # Also retries documents whose write failed on a previous poll, as
+        # upstream answers 304 for them until they change again.
+        await self.cache.write_shared_environments()
+
+    def load_snapshots(self) -> bool:
+        """
+        Restore environment documents from the cache's snapshots.
+
+        A restored environment counts as loaded, so a pod started from snapshots
+        is as ready as one that has just polled upstream. The restore is
+        recorded apart from fetches, which it says nothing about. Returns a
+        boolean confirming if every environment was restored.
+        """
+        restored_all = True
         for key_pair in self.settings.environment_key_pairs:
-            try:
-                environment_document = await self._fetch_document(key_pair)
-                if self.cache.put_environment(
-                    environment_api_key=key_pair.client_side_key,
-                    environment_document=environment_document,
-                ):
-                    await self._clear_endpoint_caches()
-            except (httpx.HTTPError, orjson.JSONDecodeError):
-                logger.exception(
-                    "error_fetching_document", client_side_key=key_pair.client_side_key
-                )
-                received_error = True
-        if not received_error:
-            self.last_updated_at = datetime.now()
+            if not self.cache.load_snapshot(key_pair.client_side_key):
+                restored_all = False
+                continue
+            self.environment_statuses[
+                key_pair.client_side_key
+            ].restored_at = datetime.now()
+            if self.settings.prerender_flags:
+                self._render_flags(key_pair.client_side_key)
+            self._publish_change(key_pair.client_side_key)
+        return restored_all
+
+    async def reload_snapshots(self) -> None:
+        """
+        Pick up snapshots written by another process polling upstream on this
+        service's behalf, dropping everything derived from documents that changed.
+        """
+        for client_side_key in await self.cache.reload_snapshots(
+            [
+                key_pair.client_side_key
+                for key_pair in self.settings.environment_key_pairs
+            ]
+        ):
+            await self._update_endpoint_caches(client_side_key)
+            if self.settings.prerender_flags:
+                self._render_flags(client_side_key)
+            self._rerender_environment_document(client_side_key)
+            self._publish_change(client_side_key)
+
+    @property
+    def last_updated_at(self) -> datetime | None:
+        """
+        The last fetch or restore of the least recently loaded environment, or
+        None if any environment has never been loaded.
+        """
+        loaded_at = [
+            status.last_loaded_at for status in self.environment_statuses.values()
+        ]
+        if not loaded_at or None in loaded_at:
+            return None
+        return min(loaded_at)
 
     def get_flags_response_data(
-        self, environment_key: str, feature: str | None = None
+        self,
+        environment_key: str,
+        feature: str | None = None,
+        *,
+        is_server_key: bool | None = None,
     ) -> dict[str, Any] | list[dict[str, Any]]:
-        is_server_key = environment_key.startswith(SERVER_API_KEY_PREFIX)
-        if is_server_key:
-            environment_key = self._get_client_key_from_server_key(environment_key)
-
-        environment_document = self.get_environment(environment_key=environment_key)
-        server_key_only_feature_ids = environment_document.get("project", {}).get(
-            "server_key_only_feature_ids", []
+        environment_key, is_server_key = self._resolve_environment_key(
+            environment_key, is_server_key
         )
-        hide_disabled_flags = _get_hide_disabled_flags(environment_document)
 
-        context = map_environment_document_to_context(environment_document)
-        evaluation_result = get_evaluation_result(context)
+        if self.flags_cache is None:
+            return self._get_flags_response_data(
+                environment_key, is_server_key, feature
+            )
+        return self.flags_cache.get_or_compute(
+            environment_key,
+            (is_server_key, feature),
+            lambda: self._get_flags_response_data(
+                environment_key, is_server_key, feature
+            ),
+        )
 
-        feature_types = self.cache.get_feature_types(environment_key)
-        if feature_types is None:
-            feature_types = build_feature_types_lookup(environment_document)
+    def _get_flags_response_data(
+        self,
+        client_side_key: str,
+        is_server_key: bool,
+        feature: str | None,
+    ) -> dict[str, Any] | list[dict[str, Any]]:
+        compiled_environment = self._get_compiled_environment(client_side_key)
+        started_at = time.perf_counter()
+        evaluation_result = get_evaluation_result(
+            compiled_environment.environment_context
+        )
+        self.metrics.get_environment_metrics(
+            client_side_key
+        ).evaluation_duration.observe(time.perf_counter() - started_at)
+        flags = self._filter_flags(
+            compiled_environment,
+            list(evaluation_result["flags"].values()),
+            is_server_key,
+        )
+        feature_types = compiled_environment.feature_types
 
         if feature:
-            if feature not in evaluation_result["flags"]:
-                raise FeatureNotFoundError()
-
-            flag_result = evaluation_result["flags"][feature]
-
-            if not is_server_key:
-                filtered = filter_out_server_key_only_flags(
-                    [flag_result], server_key_only_feature_ids
-                )
-                if not filtered:
-                    raise FeatureNotFoundError()
-
-                if hide_disabled_flags and not flag_result.get("enabled", False):
-                    raise FeatureNotFoundError()
+            for flag_result in flags:
+                if flag_result["name"] == feature:
+                    return map_flag_result_to_response_data(flag_result, feature_types)
+            raise FeatureNotFoundError()
 
-            return map_flag_result_to_response_data(flag_result, feature_types)
-
-        flags = list(evaluation_result["flags"].values())
+        return map_flag_results_to_response_data(flags, feature_types)
 
-        if not is_server_key:
-            flags = filter_out_server_key_only_flags(flags, server_key_only_feature_ids)
-            flags = filter_disabled_flags(flags, hide_disabled_flags)
+    def get_rendered_flags(
+        self,
+        environment_key: str,
+        *,
+        is_server_key: bool | None = None,
+    ) -> RenderedFlags | None:
+        """
+        Return the pre-rendered flags payload for the given key, or None if
+        pre-rendering is disabled or the environment has not been rendered yet.
+        """
+        if not self.settings.prerender_flags:
+            return None
+
+        environment_key, is_server_key = self._resolve_environment_key(
+            environment_key, is_server_key
+        )
 
-        return map_flag_results_to_response_data(flags, feature_types)
+        return self._rendered_flags.get((environment_key, is_server_key))
 
     def get_identity_response_data(
         self, input_data: IdentityWithTraits, environment_key: str
     ) -> dict[str, Any]:
-        is_server_key = environment_key.startswith(SERVER_API_KEY_PREFIX)
-        if is_server_key:
-            environment_key = self._get_client_key_from_server_key(environment_key)
+        environment_key, is_server_key = self._resolve_environment_key(environment_key)
 
-        environment_document = self.get_environment(environment_key=environment_key)
-        server_key_only_feature_ids = environment_document.get("project", {}).get(
-            "server_key_only_feature_ids", []
+        return self._get_identity_response_data(
+            input_data,
+            environment_key,
+            is_server_key,
+            self._get_compiled_environment(environment_key),
         )
-        hide_disabled_flags = _get_hide_disabled_flags(environment_document)
 
-        environment_context = map_environment_document_to_context(environment_document)
-        context = map_context_and_identity_data_to_context(
-            context=environment_context,
-            identifier=input_data.identifier,
-            traits=convert_traits_to_dict(input_data.traits),
+    def get_bulk_identities_response_data(
+        self, identities: list[IdentityWithTraits], environment_key: str
+    ) -> Iterator[dict[str, Any]]:
+        """
+        Return an iterator over the identity response data for each of the given
+        identities, evaluated lazily against a single compiled environment.
+
+        The key is resolved eagerly so that unknown keys raise before iteration.
+        The document may be replaced while the response is streamed, so the
+        identities cache is left alone from then on.
+        """
+        environment_key, is_server_key = self._resolve_environment_key(environment_key)
+        compiled_environment = self._get_compiled_environment(environment_key)
+        generation = (
+            self.identities_cache.get_generation(environment_key)
+            if self.identities_cache is not None
+            else None
         )
-        evaluation_result = get_evaluation_result(context)
 
-        feature_types = self.cache.get_feature_types(environment_key)
-        if feature_types is None:
-            feature_types = build_feature_types_lookup(environment_document)
+        return (
+            self._get_identity_response_data(
+                input_data,
+                environment_key,
+                is_server_key,
+                compiled_environment,
+                generation,
+            )
+            for input_data in identities
+        )
 
-        flags = list(evaluation_result["flags"].values())
-        if not is_server_key:
-            flags = filter_out_server_key_only_flags(flags, server_key_only_feature_ids)
-            flags = filter_disabled_flags(flags, hide_disabled_flags)
+    def _get_identity_response_data(
+        self,
+        input_data: IdentityWithTraits,
+        client_side_key: str,
+        is_server_key: bool,
+        compiled_environment: CompiledEnvironment,
+        generation: int | None = None,
+    ) -> dict[str, Any]:
+        flags = self._get_default_identity_flags_response_data(
+            input_data, client_side_key, is_server_key, compiled_environment
+        )
+        if flags is None and self.identities_cache is None:
+            flags = self._get_identity_flags_response_data(
+                input_data, client_side_key, is_server_key, compiled_environment
+            )
+        elif flags is None:
+            # Only the flags are cached so that the traits echoed back always
+            # match the order they were sent in.
+            flags = self.identities_cache.get_or_compute(
+                client_side_key,
+                (is_server_key, input_data.cache_key),
+                lambda: self._get_identity_flags_response_data(
+                    input_data, client_side_key, is_server_key, compiled_environment
+                ),
+                generation,
+            )
 
         return {
             "identifier": input_data.identifier,
             "traits": map_traits_to_response_data(input_data.traits),
-            "flags": map_flag_results_to_response_data(flags, feature_types),
+            "flags": flags,
         }
 
+    def _get_default_identity_flags_response_data(
+        self,
+        input_data: IdentityWithTraits,
+        client_side_key: str,
+        is_server_key: bool,
+        compiled_environment: CompiledEnvironment,
+    ) -> list[dict[str, Any]] | None:
+        """
+        Return the flags for an identity that is in no segment and has no
+        overrides, without evaluating them, or None if the identity may be in
+        some segment or has overrides.
+        """
+        if (
+            compiled_environment.default_identity_flags is None
+            or input_data.identifier in compiled_environment.identity_overrides
+        ):
+            return None
+        if (
+            input_data.traits
+            and compiled_environment.segment_index.get_candidate_segments(
+                convert_traits_to_dict(input_data.traits)
+            )
+        ):
+            return None
+
+        started_at = time.perf_counter()
+        flags = compiled_environment.default_identity_flags[
+            is_server_key
+        ].get_response_data(input_data.identifier)
+        self.metrics.get_environment_metrics(
+            client_side_key
+        ).evaluation_duration.observe(time.perf_counter() - started_at)
+        return flags
+
+    def _get_identity_flags_response_data(
+        self,
+        input_data: IdentityWithTraits,
+        client_side_key: str,
+        is_server_key: bool,
+        compiled_environment: CompiledEnvironment,
+    ) -> list[dict[str, Any]]:
+        context = map_context_and_identity_data_to_context(
+            context=compiled_environment.context,
+            identifier=input_data.identifier,
+            traits=convert_traits_to_dict(input_data.traits),
+        )
+        segments = compiled_environment.segment_index.get_candidate_segments(
+            context["identity"]["traits"]
+        )
+        if identity_overrides := compiled_environment.identity_overrides.get(
+            input_data.identifier
+        ):
+            segments = {**segments, **identity_overrides}
+        context["segments"] = segments
+        started_at = time.perf_counter()
+        evaluation_result = get_evaluation_result(context)
+        self.metrics.get_environment_metrics(
+            client_side_key
+        ).evaluation_duration.observe(time.perf_counter() - started_at)
+        flags = self._filter_flags(
+            compiled_environment,
+            list(evaluation_result["flags"].values()),
+            is_server_key,
+        )
+        return map_flag_results_to_response_data(
+            flags, compiled_environment.feature_types
+        )
+
     def get_environment(
         self,
         *,
         environment_key: str | None = None,
     ) -> dict[str, Any]:
-        if environment_key and environment_key.startswith(SERVER_API_KEY_PREFIX):
-            client_side_key = self._get_client_key_from_server_key(environment_key)
-        else:
-            client_side_key = environment_key
+        client_side_key = environment_key
+        if environment_key:
+            client_side_key, _ = self._resolve_environment_key(environment_key)
 
         if environment_document := self.cache.get_environment(client_side_key):
             return environment_document
 
         raise FlagsmithUnknownKeyError(environment_key)
 
-    async def _fetch_document(self, key_pair: EnvironmentKeyPair) -> dict[str, Any]:
+    def get_response_validators(
+        self,
+        environment_key: str,
+        *,
+        is_server_key: bool | None = None,
+    ) -> ResponseValidators:
+        """
+        Return validators for responses derived from the environment document
+        for the given key. Server and client side keys get different ETags,
+        as their responses differ.
+        """
+        if not environment_key:
+            raise FlagsmithUnknownKeyError(environment_key)
+        client_side_key, is_server_key = self._resolve_environment_key(
+            environment_key, is_server_key
+        )
+        compiled_environment = self._get_compiled_environment(client_side_key)
+        return ResponseValidators(
+            etag=f'W/"{compiled_environment.version}-{"s" if is_server_key else "c"}"',
+            last_modified=compiled_environment.updated_at,
+        )
+
+    def get_rendered_environment_document(
+        self,
+        environment_key: str,
+        *,
+        is_server_key: bool | None = None,
+    ) -> RenderedBody:
+        """
+        Return the environment document for the given key, serialized and
+        compressed once per document rather than on every request.
+        """
+        if not environment_key:
+            raise FlagsmithUnknownKeyError(environment_key)
+        client_side_key, _ = self._resolve_environment_key(
+            environment_key, is_server_key
+        )
+        if rendered_document := self._render_environment_document(client_side_key):
+            return rendered_document
+        raise FlagsmithUnknownKeyError(environment_key)
+
+    def _render_environment_document(self, client_side_key: str) -> RenderedBody | None:
+        # The document as received from upstream is served as is when the
+        # cache keeps it, and only serialized again otherwise.
+        if content := self.cache.get_environment_content(client_side_key):
+            source, render = content, encode_body
+        elif environment_document := self.cache.get_environment(client_side_key):
+            source, render = environment_document, render_body
+        else:
+            return None
+
+        rendered_document = self._rendered_documents.get(client_side_key)
+        if rendered_document is None or rendered_document[0] is not source:
+            rendered_document = self._rendered_documents[client_side_key] = (
+                source,
+                render(source),
+            )
+        return rendered_document[1]
+
+    def _rerender_environment_document(self, client_side_key: str) -> None:
+        # Compress a replaced document that is being requested now rather than
+        # on the next request.
+        if client_side_key in self._rendered_documents:
+            self._render_environment_document(client_side_key)
+
+    def get_broadcaster(self, environment_key: str) -> EnvironmentBroadcaster:
+        """
+        Return the broadcaster notifying changes to the environment for the
+        given server or client side key.
+        """
+        if not environment_key:
+            raise FlagsmithUnknownKeyError(environment_key)
+        client_side_key, _ = self._resolve_environment_key(environment_key)
+        try:
+            return self._broadcasters[client_side_key]
+        except KeyError:
+            raise FlagsmithUnknownKeyError(environment_key) from None
+
+    def _publish_change(self, client_side_key: str) -> None:
+        # Same payload as the Flagsmith realtime stream, so that SDKs in
+        # realtime mode can subscribe to the proxy directly.
+        compiled_environment = self.cache.get_compiled_environment(client_side_key)
+        if compiled_environment and compiled_environment.updated_at:
+            updated_at = compiled_environment.updated_at.timestamp()
+        else:
+            updated_at = time.time()
+        self._broadcasters[client_side_key].publish(
+            orjson.dumps({"updated_at": updated_at})
+        )
+
+    def _get_updated_at(self, client_side_key: str) -> datetime | None:
+        if compiled_environment := self.cache.get_compiled_environment(client_side_key):
+            return compiled_environment.updated_at
+        if environment_document := self.cache.get_environment(client_side_key):
+            return parse_updated_at(environment_document.get("updated_at"))
+        return None
+
+    def _get_compiled_environment(self, client_side_key: str) -> CompiledEnvironment:
+        if compiled_environment := self.cache.get_compiled_environment(client_side_key):
+            return compiled_environment
+        if environment_document := self.cache.get_environment(client_side_key):
+            return compile_environment(environment_document)
+        raise FlagsmithUnknownKeyError(client_side_key)
+
+    def _filter_flags(
+        self,
+        compiled_environment: CompiledEnvironment,
+        flags: list[FlagResult[Any]],
+        is_server_key: bool,
+    ) -> list[FlagResult[Any]]:
+        if is_server_key:
+            return flags
+        flags = filter_out_server_key_only_flags(
+            flags, compiled_environment.server_key_only_feature_ids
+        )
+        return filter_disabled_flags(flags, compiled_environment.hide_disabled_flags)
+
+    def _render_flags(self, client_side_key: str) -> None:
+        compiled_environment = self.cache.get_compiled_environment(client_side_key)
+        if compiled_environment is None:
+            self._rendered_flags.pop((client_side_key, False), None)
+            self._rendered_flags.pop((client_side_key, True), None)
+            return
+
+        changes = self.cache.get_environment_changes(client_side_key)
+        changed_features = changes and changes.get_changed_environment_flags()
+        if changed_features == frozenset() and all(
+            (client_side_key, is_server_key) in self._rendered_flags
+            for is_server_key in (False, True)
+        ):
+            # Nothing the environment flags depend on changed.
+            return
+
+        evaluation_result = get_evaluation_result(
+            compiled_environment.environment_context
+        )
+        feature_types = compiled_environment.feature_types
+        for is_server_key in (False, True):
+            flags = self._filter_flags(
+                compiled_environment,
+                list(evaluation_result["flags"].values()),
+                is_server_key,
+            )
+            # Reuse the rendered flags of the features that did not change.
+            previous_features = {}
+            if changed_features is not None and (
+                previous := self._rendered_flags.get((client_side_key, is_server_key))
+            ):
+                previous_features = previous.features
+            features = {}
+            for flag_result in flags:
+                feature_name = flag_result["name"]
+                if (
+                    body := previous_features.get(feature_name)
+                ) is None or feature_name in changed_features:
+                    body = orjson.dumps(
+                        map_flag_result_to_response_data(flag_result, feature_types)
+                    )
+                features[feature_name] = body
+            self._rendered_flags[(client_side_key, is_server_key)] = RenderedFlags(
+                flags=encode_body(b"[" + b",".join(features.values()) + b"]"),
+                features=features,
+            )
+
+    async def _refresh_environment(
+        self,
+        key_pair: EnvironmentKeyPair,
+        semaphore: asyncio.Semaphore,
+    ) -> None:
+        status = self.environment_statuses[key_pair.client_side_key]
+        environment_metrics = self.metrics.get_environment_metrics(
+            key_pair.client_side_key
+        )
+        async with semaphore:
+            status.last_attempted_at = datetime.now()
+            started_at = time.perf_counter()
+            try:
+                changed = False
+                if fetched_document := await self._fetch_document(key_pair):
+                    environment_document, validators, content = fetched_document
+                    changed = self.cache.put_environment(
+                        environment_api_key=key_pair.client_side_key,
+                        environment_document=environment_document,
+                        validators=validators,
+                        content=content,
+                    )
+                if changed:
+                    await self._update_endpoint_caches(key_pair.client_side_key)
+                    if self.settings.prerender_flags:
+                        self._render_flags(key_pair.client_side_key)
+                    self._rerender_environment_document(key_pair.client_side_key)
+                    self._publish_change(key_pair.client_side_key)
+            except (httpx.HTTPError, orjson.JSONDecodeError):
+                environment_metrics.polls_error.inc()
+                environment_metrics.poll_duration.observe(
+                    time.perf_counter() - started_at
+                )
+                status.error_streak += 1
+                logger.exception(
+                    "error_fetching_document",
+                    client_side_key=key_pair.client_side_key,
+                    duration_seconds=time.perf_counter() - started_at,
+                    error_streak=status.error_streak,
+                )
+                return
+
+            environment_metrics.poll_duration.observe(time.perf_counter() - started_at)
+            status.last_successful_fetch_at = datetime.now()
+            status.error_streak = 0
+            if changed:
+                status.last_changed_at = status.last_successful_fetch_at
+            logger.debug(
+                "environment_document_refreshed",
+                client_side_key=key_pair.client_side_key,
+                duration_seconds=time.perf_counter() - started_at,
+                changed=changed,
+            )
+
+    async def _fetch_document(
+        self, key_pair: EnvironmentKeyPair
+    ) -> tuple[dict[str, Any], EnvironmentValidators, bytes | None] | None:
+        """
+        Fetch the environment document for the given key pair, along with its
+        serialized form if the cache keeps it.
+
+        Returns None if the document is unchanged since it was last cached,
+        either because upstream answered 304 or because the response body is
+        byte-for-byte identical to the cached one.
+
+        The response body is streamed into a `SpooledDocument` and parsed from
+        there, so that at most one copy of the raw document is held, in memory
+        only up to `api_poll_spool_max_memory_bytes`.
+        """
         headers = {
             "X-Environment-Key": key_pair.server_side_key,
         }
-        environment_document = self.cache.get_environment(
-            environment_api_key=key_pair.client_side_key
-        )
-        if environment_document:
-            updated_at: str = environment_document.get("updated_at")
-            if updated_at:
-                try:
-                    epoch_seconds = datetime.fromisoformat(updated_at).timestamp()
-                    # Same implementation as https://docs.djangoproject.com/en/4.2/ref/utils/#django.utils.http.http_date
-                    headers["If-Modified-Since"] = formatdate(
-                        epoch_seconds, usegmt=True
-                    )
-                except ValueError:
-                    logger.warning(
-                        f"failed to parse updated_at, environment={key_pair.client_side_key} updated_at={updated_at}"
-                    )
+        has_environment = self.cache.has_environment(key_pair.client_side_key)
+        validators = self.cache.get_validators(key_pair.client_side_key)
+        if has_environment:
+            if validators and validators.etag:
+                headers["If-None-Match"] = validators.etag
+            if validators and validators.last_modified:
+                headers["If-Modified-Since"] = validators.last_modified
+            elif updated_at := self._get_updated_at(key_pair.client_side_key):
+                # Same implementation as https://docs.djangoproject.com/en/4.2/ref/utils/#django.utils.http.http_date
+                headers["If-Modified-Since"] = formatdate(
+                    updated_at.timestamp(), usegmt=True
+                )
             else:
                 logger.warning(
-                    f"received environment with no updated_at: {key_pair.client_side_key}"
+                    f"received environment with no valid updated_at: {key_pair.client_side_key}"
                 )
-        response = await self._client.get(
+        environment_metrics = self.metrics.get_environment_metrics(
+            key_pair.client_side_key
+        )
+        async with self._client.stream(
+            "GET",
             url=f"{self.settings.api_url}/environment-document/",
             headers=headers,
-        )
-        if response.status_code == starlette.status.HTTP_304_NOT_MODIFIED:
-            assert environment_document, (
-                f"GET /environment-document returned 304 without a cached document. environment={key_pair.client_side_key}"
+        ) as response:
+            if response.status_code == starlette.status.HTTP_304_NOT_MODIFIED:
+                assert has_environment, (
+                    f"GET /environment-document returned 304 without a cached document. environment={key_pair.client_side_key}"
+                )
+                environment_metrics.polls_not_modified.inc()
+                return None
+            response.raise_for_status()
+
+            with SpooledDocument(
+                max_memory_size=self.settings.api_poll_spool_max_memory_bytes
+            ) as document:
+                async for chunk in response.aiter_bytes():
+                    document.write(chunk)
+
+                environment_metrics.polls_ok.inc()
+                environment_metrics.document_size.set(document.size)
+                if (
+                    has_environment
+                    and validators
+                    and validators.digest == document.digest
+                ):
+                    return None
+
+                return (
+                    document.load(),
+                    EnvironmentValidators(
+                        etag=response.headers.get("ETag"),
+                        last_modified=response.headers.get("Last-Modified"),
+                        digest=document.digest,
+                    ),
+                    document.getvalue() if self.cache.keeps_content else None,
+                )
+
+    async def _clear_endpoint_caches(self, client_side_key: str) -> None:
+        for endpoint_cache in (self.identities_cache, self.flags_cache):
+            if endpoint_cache is not None:
+                endpoint_cache.invalidate(client_side_key)
+
+    async def _update_endpoint_caches(self, client_side_key: str) -> None:
+        """
+        Bring the endpoint caches up to date with a new environment document,
+        keeping, or patching, the entries that its changes cannot affect.
+        """
+        changes = self.cache.get_environment_changes(client_side_key)
+        compiled_environment = self.cache.get_compiled_environment(client_side_key)
+        if changes is None or changes.project or compiled_environment is None:
+            await self._clear_endpoint_caches(client_side_key)
+            return
+
+        if self.flags_cache is not None:
+            changed_features = changes.get_changed_environment_flags()
+            if changed_features is None:
+                self.flags_cache.invalidate(client_side_key)
+            else:
+                # Entries are keyed by whether the key is server side, and by
+                # the requested feature, if any.
+                self.flags_cache.update(
+                    client_side_key,
+                    lambda key, flags: (
+                        None
+                        if changed_features
+                        and (key[1] is None or key[1] in changed_features)
+                        else flags
+                    ),
+                )
+
+        if self.identities_cache is not None:
+            self.identities_cache.update(
+                client_side_key,
+                lambda key, flags: self._update_identity_flags(
+                    changes, compiled_environment, *key, flags
+                ),
             )
-            return environment_document
-        response.raise_for_status()
-        return orjson.loads(response.text)
 
-    async def _clear_endpoint_caches(self):
-        for func in (self.get_identity_response_data, self.get_flags_response_data):
-            try:
-                func.cache_clear()
-            except AttributeError:
-                pass
+    def _update_identity_flags(
+        self,
+        changes: EnvironmentChanges,
+        compiled_environment: CompiledEnvironment,
+        is_server_key: bool,
+        identity_cache_key: IdentityCacheKey,
+        flags: list[dict[str, Any]],
+    ) -> list[dict[str, Any]] | None:
+        """
+        Return an identity's cached flags updated for the given changes, or None
+        if they need evaluating again.
+        """
+        identifier, traits = identity_cache_key
+        if identifier in changes.identity_overrides:
+            return None
+        traits_dict = {trait_key: trait_value for trait_key, _, trait_value in traits}
+        trait_keys = {
+            trait_key
+            for trait_key, trait_value in traits_dict.items()
+            if trait_value is not None
+        }
+        if any(
+            can_match(requirements, trait_keys)
+            for requirements in changes.segment_requirements
+        ):
+            return None
+        if not changes.features:
+            return flags
+
+        # Identity overrides take precedence over anything else, so features
+        # they override are unaffected. The identity may be in any of its
+        # candidate segments, so the flags of features they override can't be
+        # told without evaluating them.
+        identity_overridden = _get_overridden_feature_names(
+            compiled_environment.identity_overrides.get(identifier)
+        )
+        segment_overridden = _get_overridden_feature_names(
+            compiled_environment.segment_index.get_candidate_segments(traits_dict)
+        )
+        features = compiled_environment.context["features"]
+        environment_key = compiled_environment.context["environment"]["key"]
+        positions = {flag["feature"]["name"]: i for i, flag in enumerate(flags)}
+        updated_flags = flags.copy()
+        for feature_name in changes.features - identity_overridden:
+            if feature_name in segment_overridden:
+                return None
+            filtered_flags = self._filter_flags(
+                compiled_environment,
+                [
+                    get_default_flag_result(
+                        environment_key, identifier, features[feature_name]
+                    )
+                ],
+                is_server_key,
+            )
+            position = positions.get(feature_name)
+            if not filtered_flags and position is None:
+                continue
+            if not filtered_flags or position is None:
+                # The flag was shown or hidden; re-evaluate rather than
+                # working out where it goes.
+                return None
+            updated_flags[position] = map_flag_result_to_response_data(
+                filtered_flags[0], compiled_environment.feature_types
+            )
+        return updated_flags
+
+    def resolve_environment_key(self, environment_key: str | None) -> tuple[str, bool]:
+        """
+        Return the client side key for the given server or client side key, and
+        whether it was a server side key.
+
+        Requests served by several of this service's methods resolve their key
+        once, and pass the client side key and `is_server_key` to each of them.
+        """
+        if not environment_key:
+            raise FlagsmithUnknownKeyError(environment_key)
+        return self._resolve_environment_key(environment_key)
+
+    def _resolve_environment_key(
+        self, environment_key: str, is_server_key: bool | None = None
+    ) -> tuple[str, bool]:
+        # A known `is_server_key` means that the key was resolved already.
+        if is_server_key is not None:
+            return environment_key, is_server_key
+        if environment_key.startswith(SERVER_API_KEY_PREFIX):
+            return self._get_client_key_from_server_key(environment_key), True
+        return environment_key, False
 
     def _get_client_key_from_server_key(self, server_key: str) -> str:
-        for key_pair in self.settings.environment_key_pairs:
-            if key_pair.server_side_key == server_key:
-                return key_pair.client_side_key
-        raise FlagsmithUnknownKeyError(server_key)
+        try:
+            return self._client_keys_by_server_key[server_key]
+        except KeyError:
+            raise FlagsmithUnknownKeyError(server_key) from None
+
+
+def _get_overridden_feature_names(
+    segments: dict[str, Any] | None,
+) -> frozenset[str]:
+    return frozenset(
+        feature_context["name"]
+        for segment in (segments or {}).values()
+        for feature_context in segment.get("overrides") or ()
+    )
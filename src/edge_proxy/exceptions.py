@@ -4,3 +4,7 @@ class FlagsmithUnknownKeyError(KeyError):
 
 class FeatureNotFoundError(Exception):
     pass
+
+
+class InvalidSnapshotError(Exception):
+    pass
@@ -5,6 +5,9 @@ from typing import Optional
 from fastapi.responses import ORJSONResponse
 from starlette.background import BackgroundTask
 
+if typing.TYPE_CHECKING:
+    from edge_proxy.environments import EnvironmentStatus
+
 
 class HealthCheckResponse(ORJSONResponse):
     def __init__(
@@ -29,3 +32,44 @@ class HealthCheckResponse(ORJSONResponse):
             media_type=media_type,
             background=background,
         )
+
+
+class EnvironmentsHealthCheckResponse(ORJSONResponse):
+    def __init__(
+        self,
+        environment_statuses: typing.Mapping[str, "EnvironmentStatus"],
+        staleness_threshold: Optional[datetime] = None,
+        headers: typing.Mapping[str, str] | None = None,
+        media_type: str | None = None,
+        background: BackgroundTask | None = None,
+    ):
+        environments = {}
+        for client_side_key, environment_status in environment_statuses.items():
+            last_successful_fetch_at = environment_status.last_successful_fetch_at
+            if last_successful_fetch_at is None:
+                # A document restored from a snapshot has yet to be confirmed
+                # with upstream.
+                status = "restored" if environment_status.restored_at else "not_updated"
+            elif staleness_threshold and last_successful_fetch_at < staleness_threshold:
+                status = "stale"
+            else:
+                status = "ok"
+            environments[client_side_key] = {
+                "status": status,
+                "last_attempted_at": environment_status.last_attempted_at,
+                "last_successful_fetch_at": last_successful_fetch_at,
+                "last_changed_at": environment_status.last_changed_at,
+                "error_streak": environment_status.error_streak,
+                "restored_at": environment_status.restored_at,
+            }
+        super().__init__(
+            status_code=(
+                200
+                if all(env["status"] == "ok" for env in environments.values())
+                else 503
+            ),
+            content={"environments": environments},
+            headers=headers,
+            media_type=media_type,
+            background=background,
+        )
@@ -0,0 +1,147 @@
+import fcntl
+import os
+import socket
+import uuid
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+import redis
+import structlog
+
+from edge_proxy.redis_cache import create_redis_client
+from edge_proxy.settings import (
+    AppSettings,
+    EnvironmentsCacheBackend,
+    LeaderElection,
+)
+
+logger = structlog.get_logger(__name__)
+
+LEASE_FILE_NAME = "poller.lock"
+
+
+class BaseLease(ABC):
+    """
+    A lease electing the single replica that polls upstream.
+    """
+
+    @abstractmethod
+    def acquire(self) -> bool:
+        """
+        Acquire the lease, or renew it if it is already held.
+
+        Returns a boolean confirming if the lease is held.
+        """
+
+    @abstractmethod
+    def release(self) -> None: ...
+
+
+class RedisLease(BaseLease):
+    """
+    A lease held as a key expiring after `ttl_seconds` unless renewed, set to
+    a token identifying its holder.
+
+    If the store is unreachable, the lease is reported as held: every replica
+    then polls upstream on its own rather than none of them polling.
+    """
+
+    def __init__(self, client: redis.Redis, key: str, ttl_seconds: int) -> None:
+        self.client = client
+        self.key = key
+        self.ttl_milliseconds = ttl_seconds * 1000
+        self.token = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+
+    def acquire(self) -> bool:
+        try:
+            if self.client.set(self.key, self.token, nx=True, px=self.ttl_milliseconds):
+                return True
+            return self.client.transaction(self._renew, self.key) == [True]
+        except redis.RedisError:
+            logger.exception("error_acquiring_lease", key=self.key)
+            return True
+
+    def release(self) -> None:
+        try:
+            self.client.transaction(self._delete, self.key)
+        except redis.RedisError:
+            logger.exception("error_releasing_lease", key=self.key)
+
+    def _renew(self, pipeline: redis.client.Pipeline) -> None:
+        # The key is watched, so the renewal is discarded if the lease expired
+        # and was taken over since it was read.
+        if pipeline.get(self.key) == self.token.encode():
+            pipeline.multi()
+            pipeline.pexpire(self.key, self.ttl_milliseconds)
+
+    def _delete(self, pipeline: redis.client.Pipeline) -> None:
+        if pipeline.get(self.key) == self.token.encode():
+            pipeline.multi()
+            pipeline.delete(self.key)
+
+
+class FileLease(BaseLease):
+    """
+    A lease held as an exclusive lock on a file, for replicas sharing a volume.
+
+    The lock is released by the operating system when its holder exits, so
+    a replica that crashed does not need to be waited on. If the file cannot
+    be opened or locked, the lease is reported as held: every replica then
+    polls upstream on its own rather than none of them polling.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._fd: int | None = None
+
+    def acquire(self) -> bool:
+        if self._fd is not None:
+            return True
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd = os.open(self.path, os.O_WRONLY | os.O_CREAT, 0o644)
+        except OSError:
+            logger.exception("error_acquiring_lease", path=str(self.path))
+            return True
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        except OSError:
+            os.close(fd)
+            logger.exception("error_acquiring_lease", path=str(self.path))
+            return True
+        self._fd = fd
+        return True
+
+    def release(self) -> None:
+        if self._fd is not None:
+            # Closing the file releases the lock.
+            os.close(self._fd)
+            self._fd = None
+
+
+def get_leader_election(settings: AppSettings) -> LeaderElection:
+    if settings.leader_election is not None:
+        return settings.leader_election
+    if settings.environments_cache_backend == EnvironmentsCacheBackend.REDIS:
+        return LeaderElection.REDIS
+    return LeaderElection.NONE
+
+
+def create_lease(settings: AppSettings) -> BaseLease | None:
+    """
+    Return the lease replicas compete for to poll upstream, if they elect a
+    leader.
+    """
+    leader_election = get_leader_election(settings)
+    if leader_election == LeaderElection.REDIS:
+        return RedisLease(
+            create_redis_client(settings.redis),
+            key=f"{settings.redis.key_prefix}:lease",
+            ttl_seconds=settings.redis.lease_ttl_seconds,
+        )
+    if leader_election == LeaderElection.FILE_LOCK:
+        return FileLease(settings.snapshot_dir / LEASE_FILE_NAME)
+    return None
@@ -1,19 +1,46 @@
 import uvicorn
 
-from edge_proxy.settings import ensure_defaults, get_settings
+from edge_proxy.leases import get_leader_election
+from edge_proxy.settings import (
+    LeaderElection,
+    ensure_defaults,
+    get_settings,
+)
+from edge_proxy.workers import run_poller_process
 
 
 def serve():
     settings = get_settings()
-    uvicorn.run(
-        "edge_proxy.server:app",
+    options = dict(
         host=str(settings.server.host),
         port=settings.server.port,
         proxy_headers=settings.server.proxy_headers,
-        reload=settings.server.reload,
         use_colors=settings.logging.colours,
         timeout_keep_alive=settings.server.timeout_keep_alive,
     )
+    if settings.server.workers == 1:
+        uvicorn.run(
+            "edge_proxy.server:app",
+            reload=settings.server.reload,
+            **options,
+        )
+        return
+
+    if get_leader_election(settings) != LeaderElection.NONE:
+        # Every worker takes part in electing the replica that polls upstream.
+        uvicorn.run(
+            "edge_proxy.server:app",
+            workers=settings.server.workers,
+            **options,
+        )
+        return
+
+    with run_poller_process(settings):
+        uvicorn.run(
+            "edge_proxy.server:app",
+            workers=settings.server.workers,
+            **options,
+        )
 
 
 def render_config():
@@ -0,0 +1,278 @@
+import time
+import typing
+from datetime import datetime
+from typing import Iterable, Iterator
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram
+from prometheus_client.core import (
+    CounterMetricFamily,
+    GaugeMetricFamily,
+    Metric,
+)
+from prometheus_client.registry import Collector
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from edge_proxy.settings import EnvironmentKeyPair
+
+if typing.TYPE_CHECKING:
+    from edge_proxy.environments import EnvironmentService
+
+# Label used for requests made with keys that match no configured environment,
+# keeping label cardinality bounded by the configuration.
+UNKNOWN_ENVIRONMENT = "unknown"
+
+FLAGS_ROUTE = "/api/v1/flags/"
+IDENTITIES_ROUTE = "/api/v1/identities/"
+BULK_IDENTITIES_ROUTE = "/api/v1/identities/bulk/"
+ENVIRONMENT_DOCUMENT_ROUTE = "/api/v1/environment-document"
+INSTRUMENTED_ROUTES = (
+    FLAGS_ROUTE,
+    IDENTITIES_ROUTE,
+    BULK_IDENTITIES_ROUTE,
+    ENVIRONMENT_DOCUMENT_ROUTE,
+)
+
+POLL_OUTCOME_OK = "200"
+POLL_OUTCOME_NOT_MODIFIED = "304"
+POLL_OUTCOME_ERROR = "error"
+
+_LATENCY_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+)
+_POLL_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class EnvironmentMetrics:
+    """
+    Metric children bound to a single environment's labels, so that
+    recording a sample on the request path is a plain attribute access.
+    """
+
+    __slots__ = (
+        "evaluation_duration",
+        "poll_duration",
+        "polls_ok",
+        "polls_not_modified",
+        "polls_error",
+        "document_size",
+    )
+
+    def __init__(self, metrics: "Metrics", environment: str) -> None:
+        self.evaluation_duration = metrics.evaluation_duration.labels(environment)
+        self.poll_duration = metrics.poll_duration.labels(environment)
+        self.polls_ok = metrics.polls.labels(environment, POLL_OUTCOME_OK)
+        self.polls_not_modified = metrics.polls.labels(
+            environment, POLL_OUTCOME_NOT_MODIFIED
+        )
+        self.polls_error = metrics.polls.labels(environment, POLL_OUTCOME_ERROR)
+        self.document_size = metrics.document_size.labels(environment)
+
+
+class Metrics:
+    """
+    The proxy's Prometheus metrics, in a registry of their own.
+
+    Every labelled child is created up front for the configured environments
+    and instrumented routes; nothing is allocated per request.
+    """
+
+    def __init__(self, environment_key_pairs: Iterable[EnvironmentKeyPair]) -> None:
+        self.registry = CollectorRegistry(auto_describe=True)
+
+        self.request_duration = Histogram(
+            "edge_proxy_request_duration_seconds",
+            "Time spent serving requests.",
+            ["route", "environment"],
+            buckets=_LATENCY_BUCKETS,
+            registry=self.registry,
+        )
+        self.evaluation_duration = Histogram(
+            "edge_proxy_evaluation_duration_seconds",
+            "Time spent evaluating flags.",
+            ["environment"],
+            buckets=_LATENCY_BUCKETS,
+            registry=self.registry,
+        )
+        self.serialization_duration = Histogram(
+            "edge_proxy_serialization_duration_seconds",
+            "Time spent serializing response bodies.",
+            ["route"],
+            buckets=_LATENCY_BUCKETS,
+            registry=self.registry,
+        )
+        self.poll_duration = Histogram(
+            "edge_proxy_poll_duration_seconds",
+            "Time spent fetching environment documents from upstream.",
+            ["environment"],
+            buckets=_POLL_BUCKETS,
+            registry=self.registry,
+        )
+        self.polls = Counter(
+            "edge_proxy_polls",
+            "Environment document fetches by outcome.",
+            ["environment", "outcome"],
+            registry=self.registry,
+        )
+        self.document_size = Gauge(
+            "edge_proxy_environment_document_size_bytes",
+            "Size of the last environment document received from upstream.",
+            ["environment"],
+            registry=self.registry,
+        )
+
+        self._environment_labels: dict[bytes, str] = {}
+        for key_pair in environment_key_pairs:
+            self._environment_labels[key_pair.client_side_key.encode()] = (
+                key_pair.client_side_key
+            )
+            self._environment_labels[key_pair.server_side_key.encode()] = (
+                key_pair.client_side_key
+            )
+        environments = {*self._environment_labels.values(), UNKNOWN_ENVIRONMENT}
+
+        self._environments = {
+            environment: EnvironmentMetrics(self, environment)
+            for environment in environments
+        }
+        self._request_durations = {
+            route.encode(): {
+                environment_key: self.request_duration.labels(route, environment)
+                for environment_key, environment in (
+                    *self._environment_labels.items(),
+                    (None, UNKNOWN_ENVIRONMENT),
+                )
+            }
+            for route in INSTRUMENTED_ROUTES
+        }
+        self._serialization_durations = {
+            route: self.serialization_duration.labels(route)
+            for route in INSTRUMENTED_ROUTES
+        }
+
+    def get_environment_metrics(self, client_side_key: str) -> EnvironmentMetrics:
+        return (
+            self._environments.get(client_side_key)
+            or self._environments[UNKNOWN_ENVIRONMENT]
+        )
+
+    def get_request_duration(
+        self, raw_path: bytes, environment_key: bytes | None
+    ) -> Histogram | None:
+        """
+        Return the request latency histogram for the given route and raw
+        `X-Environment-Key` header value, or None if the route is not instrumented.
+        """
+        if (durations := self._request_durations.get(raw_path)) is None:
+            return None
+        return durations.get(environment_key) or durations[None]
+
+    def observe_serialization(self, route: str, started_at: float) -> None:
+        self._serialization_durations[route].observe(time.perf_counter() - started_at)
+
+    def register_service(self, environment_service: "EnvironmentService") -> None:
+        self.registry.register(_EnvironmentServiceCollector(environment_service))
+
+
+class MetricsMiddleware:
+    """
+    Record the latency of requests to the instrumented routes, labelled by
+    route and by the environment of the `X-Environment-Key` header.
+    """
+
+    def __init__(self, app: ASGIApp, metrics: Metrics) -> None:
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        environment_key = None
+        for name, value in scope["headers"]:
+            if name == b"x-environment-key":
+                environment_key = value
+                break
+        histogram = self.metrics.get_request_duration(
+            scope.get("raw_path") or scope["path"].encode(), environment_key
+        )
+        if histogram is None:
+            await self.app(scope, receive, send)
+            return
+
+        started_at = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            histogram.observe(time.perf_counter() - started_at)
+
+
+class _EnvironmentServiceCollector(Collector):
+    """
+    Metrics derived from the service's state at scrape time, costing nothing
+    on the request path.
+    """
+
+    def __init__(self, environment_service: "EnvironmentService") -> None:
+        self.environment_service = environment_service
+
+    def collect(self) -> Iterator[Metric]:
+        document_age = GaugeMetricFamily(
+            "edge_proxy_environment_document_age_seconds",
+            "Time since the environment document was last fetched successfully.",
+            labels=["environment"],
+        )
+        now = datetime.now()
+        for (
+            client_side_key,
+            status,
+        ) in self.environment_service.environment_statuses.items():
+            if status.last_successful_fetch_at:
+                document_age.add_metric(
+                    [client_side_key],
+                    (now - status.last_successful_fetch_at).total_seconds(),
+                )
+        yield document_age
+
+        hits = CounterMetricFamily(
+            "edge_proxy_endpoint_cache_hits",
+            "Endpoint cache hits.",
+            labels=["endpoint", "environment"],
+        )
+        misses = CounterMetricFamily(
+            "edge_proxy_endpoint_cache_misses",
+            "Endpoint cache misses.",
+            labels=["endpoint", "environment"],
+        )
+        hit_ratio = GaugeMetricFamily(
+            "edge_proxy_endpoint_cache_hit_ratio",
+            "Share of endpoint cache lookups served from the cache.",
+            labels=["endpoint", "environment"],
+        )
+        for endpoint, endpoint_cache in (
+            ("flags", self.environment_service.flags_cache),
+            ("identities", self.environment_service.identities_cache),
+        ):
+            if endpoint_cache is None:
+                continue
+            for client_side_key, cache_info in endpoint_cache.cache_infos().items():
+                labels = [endpoint, client_side_key]
+                hits.add_metric(labels, cache_info.hits)
+                misses.add_metric(labels, cache_info.misses)
+                if lookups := cache_info.hits + cache_info.misses:
+                    hit_ratio.add_metric(labels, cache_info.hits / lookups)
+        yield hits
+        yield misses
+        yield hit_ratio
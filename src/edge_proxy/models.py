@@ -1,3 +1,4 @@
+from functools import cached_property
 from typing import Union
 
 from pydantic import BaseModel, Field, field_validator
@@ -6,6 +7,10 @@ from pydantic_core import PydanticCustomError
 
 TraitValue = Union[str, int, float, bool, None]
 
+IdentityCacheKey = tuple[str, tuple[tuple[str, type, TraitValue], ...]]
+
+BULK_IDENTITIES_MAX_SIZE = 1000
+
 
 class TraitModel(BaseModel):
     trait_key: str
@@ -35,3 +40,24 @@ class IdentityWithTraits(BaseModel):
 
     def __hash__(self):
         return hash(str(self))
+
+    @cached_property
+    def cache_key(self) -> IdentityCacheKey:
+        """
+        Canonical key for the identity: traits are deduplicated (last value wins,
+        as in evaluation), sorted by key and tagged with their value type so that
+        e.g. `1`, `1.0`, `"1"` and `True` never collide.
+        """
+        if not self.traits:
+            return self.identifier, ()
+        traits = {trait.trait_key: trait.trait_value for trait in self.traits}
+        return self.identifier, tuple(
+            (trait_key, type(trait_value), trait_value)
+            for trait_key, trait_value in sorted(traits.items())
+        )
+
+
+class BulkIdentitiesWithTraits(BaseModel):
+    identities: list[IdentityWithTraits] = Field(
+        min_length=1, max_length=BULK_IDENTITIES_MAX_SIZE
+    )
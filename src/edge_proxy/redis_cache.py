@@ -0,0 +1,217 @@
+import asyncio
+from pathlib import Path
+from typing import Any
+
+import orjson
+import redis
+import structlog
+
+from edge_proxy.cache import EnvironmentValidators, LocalMemEnvironmentsCache
+from edge_proxy.settings import RedisSettings
+
+logger = structlog.get_logger(__name__)
+
+
+def create_redis_client(settings: RedisSettings) -> redis.Redis:
+    return redis.Redis.from_url(
+        settings.url,
+        socket_timeout=settings.socket_timeout_seconds,
+        socket_connect_timeout=settings.socket_timeout_seconds,
+    )
+
+
+class RedisEnvironmentsCache(LocalMemEnvironmentsCache):
+    """
+    An environments cache shared between replicas through a Redis-compatible
+    store, with a local in-memory tier in front of it.
+
+    Documents put in the cache, by the replica polling upstream, are written
+    to the store along with their validators and an increasing version by
+    `write_shared_environments`, after each poll. Other replicas load them
+    with `load_snapshot` on startup, and pick up newer versions with
+    `reload_snapshots`. Both run the store commands in a thread, so that a
+    slow store never holds up requests, which are only ever served from the
+    local tier. Documents that could not be written are written again on the
+    next poll.
+    """
+
+    def __init__(
+        self,
+        client: redis.Redis,
+        *args,
+        key_prefix: str = "edge-proxy",
+        snapshot_dir: Path | None = None,
+        **kwargs,
+    ):
+        super().__init__(*args, snapshot_dir=snapshot_dir, **kwargs)
+        self.client = client
+        self.key_prefix = key_prefix
+        # Versions of the documents in the local tier, as written to the store.
+        self._versions: dict[str, int] = {}
+        # Documents put in the local tier but not written to the store yet.
+        self._unwritten: set[str] = set()
+
+    def _put_environment(
+        self,
+        environment_api_key: str,
+        environment_document: dict[str, Any],
+        validators: EnvironmentValidators,
+        content: bytes | None,
+    ) -> None:
+        super()._put_environment(
+            environment_api_key, environment_document, validators, content
+        )
+        self._unwritten.add(environment_api_key)
+
+    async def write_shared_environments(self) -> None:
+        if not self._unwritten:
+            return
+        environment_api_keys, self._unwritten = self._unwritten, set()
+        fields = {
+            environment_api_key: self._get_environment_fields(environment_api_key)
+            for environment_api_key in environment_api_keys
+        }
+        try:
+            versions = await asyncio.to_thread(self._write_environments, fields)
+        except redis.RedisError:
+            logger.exception(
+                "error_writing_shared_environments",
+                client_side_keys=sorted(environment_api_keys),
+            )
+            # Documents put in the meantime are already in `_unwritten`.
+            self._unwritten |= environment_api_keys
+            return
+        self._versions.update(versions)
+
+    def load_snapshot(self, environment_api_key: str) -> bool:
+        try:
+            fields = self.client.hgetall(self._get_environment_key(environment_api_key))
+        except redis.RedisError:
+            logger.exception(
+                "error_reading_shared_environment", client_side_key=environment_api_key
+            )
+            return super().load_snapshot(environment_api_key)
+        if not fields:
+            return super().load_snapshot(environment_api_key)
+        return self._load_environment(environment_api_key, fields)
+
+    def reload_snapshot(self, environment_api_key: str) -> bool:
+        try:
+            fields = self._read_changed_environments(
+                [environment_api_key], self._versions.copy()
+            )
+        except redis.RedisError:
+            logger.exception(
+                "error_reading_shared_environment", client_side_key=environment_api_key
+            )
+            return False
+        if environment_api_key not in fields:
+            return False
+        return self._load_environment(environment_api_key, fields[environment_api_key])
+
+    async def reload_snapshots(self, environment_api_keys: list[str]) -> list[str]:
+        try:
+            changed_fields = await asyncio.to_thread(
+                self._read_changed_environments,
+                environment_api_keys,
+                self._versions.copy(),
+            )
+        except redis.RedisError:
+            logger.exception("error_reading_shared_environments")
+            return []
+        return [
+            environment_api_key
+            for environment_api_key, fields in changed_fields.items()
+            if self._load_environment(environment_api_key, fields)
+        ]
+
+    def _get_environment_fields(self, environment_api_key: str) -> dict[str, Any]:
+        validators = self.get_validators(environment_api_key)
+        return {
+            "content": self.get_environment_content(environment_api_key)
+            or orjson.dumps(self.get_environment(environment_api_key)),
+            "etag": validators.etag or "",
+            "last_modified": validators.last_modified or "",
+            "digest": validators.digest or b"",
+        }
+
+    def _write_environments(self, fields: dict[str, dict[str, Any]]) -> dict[str, int]:
+        # Run in a thread: writes every document in a single transaction,
+        # bumping their versions, and returns the new versions.
+        pipeline = self.client.pipeline(transaction=True)
+        for environment_api_key, environment_fields in fields.items():
+            key = self._get_environment_key(environment_api_key)
+            pipeline.hset(key, mapping=environment_fields)
+            pipeline.hincrby(key, "version", 1)
+        results = pipeline.execute()
+        return dict(zip(fields, results[1::2]))
+
+    def _read_changed_environments(
+        self,
+        environment_api_keys: list[str],
+        versions: dict[str, int],
+    ) -> dict[str, dict[bytes, bytes]]:
+        # Run in a thread: checks the versions of every document in a single
+        # round trip, and only reads those that changed.
+        pipeline = self.client.pipeline(transaction=False)
+        for environment_api_key in environment_api_keys:
+            pipeline.hget(self._get_environment_key(environment_api_key), "version")
+        changed_keys = [
+            environment_api_key
+            for environment_api_key, version in zip(
+                environment_api_keys, pipeline.execute()
+            )
+            if version is not None and int(version) != versions.get(environment_api_key)
+        ]
+        if not changed_keys:
+            return {}
+        pipeline = self.client.pipeline(transaction=False)
+        for environment_api_key in changed_keys:
+            pipeline.hgetall(self._get_environment_key(environment_api_key))
+        return {
+            environment_api_key: fields
+            for environment_api_key, fields in zip(changed_keys, pipeline.execute())
+            if fields
+        }
+
+    def _load_environment(
+        self, environment_api_key: str, fields: dict[bytes, bytes]
+    ) -> bool:
+        content = fields[b"content"]
+        try:
+            environment_document = orjson.loads(content)
+        except orjson.JSONDecodeError:
+            logger.exception(
+                "error_reading_shared_environment", client_side_key=environment_api_key
+            )
+            return False
+        self._store_environment(
+            environment_api_key,
+            environment_document,
+            EnvironmentValidators(
+                etag=fields[b"etag"].decode() or None,
+                last_modified=fields[b"last_modified"].decode() or None,
+                digest=fields[b"digest"] or None,
+            ),
+            content,
+        )
+        self._versions[environment_api_key] = int(fields[b"version"])
+        # The store holds a document put since, by the replica now polling.
+        self._unwritten.discard(environment_api_key)
+        return True
+
+    def put_statuses(self, content: bytes) -> None:
+        try:
+            self.client.set(f"{self.key_prefix}:statuses", content)
+        except redis.RedisError:
+            logger.exception("error_writing_shared_statuses")
+
+    def get_statuses(self) -> bytes | None:
+        try:
+            return self.client.get(f"{self.key_prefix}:statuses")
+        except redis.RedisError:
+            logger.exception("error_reading_shared_statuses")
+            return None
+
+    def _get_environment_key(self, environment_api_key: str) -> str:
+        return f"{self.key_prefix}:environment:{environment_api_key}"
@@ -0,0 +1,99 @@
+import gzip
+from dataclasses import dataclass
+from typing import Any
+
+import brotli
+import orjson
+import zstandard
+
+IDENTITY = "identity"
+GZIP = "gzip"
+BROTLI = "br"
+ZSTD = "zstd"
+
+# Preferred content codings, best first.
+SUPPORTED_ENCODINGS = (BROTLI, ZSTD, GZIP, IDENTITY)
+
+# Brotli's best quality takes seconds for bodies the size of a large environment
+# document, so it is only used for smaller ones.
+_BROTLI_BEST_QUALITY_MAX_SIZE = 64 * 1024
+_BROTLI_BEST_QUALITY = 11
+_BROTLI_FAST_QUALITY = 5
+_GZIP_LEVEL = 6
+_ZSTD_LEVEL = 10
+
+
+@dataclass(frozen=True, slots=True)
+class RenderedBody:
+    """
+    A JSON response body serialized once and held in every supported
+    content coding.
+    """
+
+    identity: bytes
+    gzip: bytes
+    br: bytes
+    zstd: bytes
+
+    def get_encoded(self, encoding: str) -> bytes:
+        if encoding == BROTLI:
+            return self.br
+        if encoding == ZSTD:
+            return self.zstd
+        if encoding == GZIP:
+            return self.gzip
+        return self.identity
+
+
+@dataclass(frozen=True, slots=True)
+class RenderedFlags:
+    flags: RenderedBody
+    features: dict[str, bytes]
+
+
+def render_body(content: Any) -> RenderedBody:
+    return encode_body(orjson.dumps(content))
+
+
+def encode_body(identity: bytes) -> RenderedBody:
+    """
+    Compress an already serialized body in every supported content coding.
+    """
+    brotli_quality = (
+        _BROTLI_BEST_QUALITY
+        if len(identity) <= _BROTLI_BEST_QUALITY_MAX_SIZE
+        else _BROTLI_FAST_QUALITY
+    )
+    return RenderedBody(
+        identity=identity,
+        gzip=gzip.compress(identity, compresslevel=_GZIP_LEVEL),
+        br=brotli.compress(identity, quality=brotli_quality, mode=brotli.MODE_TEXT),
+        zstd=zstandard.ZstdCompressor(level=_ZSTD_LEVEL).compress(identity),
+    )
+
+
+def negotiate_encoding(accept_encoding: str | None) -> str:
+    """
+    Pick the best supported content coding for an Accept-Encoding header,
+    honouring `q=0` exclusions. Falls back to identity.
+    """
+    if not accept_encoding:
+        return IDENTITY
+
+    accepted: dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.partition(";")
+        quality = 1.0
+        if params:
+            name, _, value = params.strip().partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding.strip().lower()] = quality
+
+    for encoding in SUPPORTED_ENCODINGS:
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return IDENTITY
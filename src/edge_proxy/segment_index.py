@@ -0,0 +1,149 @@
+from dataclasses import dataclass
+from typing import Any, Mapping
+
+from flag_engine.context.types import SegmentCondition, SegmentContext, SegmentRule
+from flag_engine.segments import constants
+
+# A conjunction of clauses, each a set of trait keys at least one of which the
+# identity must have for a segment to possibly match. No clauses means the
+# segment does not depend on traits at all.
+Requirements = tuple[frozenset[str], ...]
+
+_UNCONSTRAINED: Requirements = ()
+
+
+@dataclass(frozen=True, slots=True)
+class SegmentIndex:
+    """
+    Which segments of an environment an identity can possibly be in, given the
+    keys of its traits.
+
+    Conditions on traits never match an identity without the trait (or with a
+    null value), except for `IS_NOT_SET`. Most segments therefore need some
+    traits to match, and can be left out of the evaluation context of any
+    identity that does not have them. Segments without rules never match and
+    are always left out.
+    """
+
+    segments: dict[str, SegmentContext[Any, Any]]
+    requirements: dict[str, Requirements]
+    segment_keys_by_trait_key: dict[str, tuple[str, ...]]
+    positions: dict[str, int]
+    # Segments every identity is evaluated against, in evaluation order.
+    unconstrained_segments: dict[str, SegmentContext[Any, Any]]
+
+    def get_candidate_segments(
+        self, traits: Mapping[str, Any] | None
+    ) -> dict[str, SegmentContext[Any, Any]]:
+        """
+        Return the segments an identity with the given traits can be in, in the
+        same order as in the environment, so that evaluation is unchanged.
+        """
+        trait_keys = {
+            trait_key
+            for trait_key, trait_value in (traits or {}).items()
+            if trait_value is not None
+        }
+        candidate_keys = set()
+        for trait_key in trait_keys:
+            for segment_key in self.segment_keys_by_trait_key.get(trait_key, ()):
+                if segment_key not in candidate_keys and can_match(
+                    self.requirements[segment_key], trait_keys
+                ):
+                    candidate_keys.add(segment_key)
+        if not candidate_keys:
+            return self.unconstrained_segments
+
+        candidate_keys.update(self.unconstrained_segments)
+        return {
+            segment_key: self.segments[segment_key]
+            for segment_key in sorted(candidate_keys, key=self.positions.__getitem__)
+        }
+
+
+def can_match(requirements: Requirements, trait_keys: set[str]) -> bool:
+    """
+    Return a boolean confirming if a segment with the given requirements can
+    match an identity with the given (non-null) trait keys.
+    """
+    return all(not clause.isdisjoint(trait_keys) for clause in requirements)
+
+
+def build_segment_index(
+    segments: dict[str, SegmentContext[Any, Any]] | None,
+) -> SegmentIndex:
+    segments = segments or {}
+    requirements: dict[str, Requirements] = {}
+    segment_keys_by_trait_key: dict[str, list[str]] = {}
+    unconstrained_segments: dict[str, SegmentContext[Any, Any]] = {}
+
+    for segment_key, segment_context in segments.items():
+        if not (rules := segment_context["rules"]):
+            # Segments without rules never match.
+            continue
+
+        segment_requirements = _get_all_requirements(
+            [_get_rule_requirements(rule) for rule in rules]
+        )
+        if not segment_requirements:
+            unconstrained_segments[segment_key] = segment_context
+            continue
+
+        requirements[segment_key] = segment_requirements
+        for trait_key in frozenset().union(*segment_requirements):
+            segment_keys_by_trait_key.setdefault(trait_key, []).append(segment_key)
+
+    return SegmentIndex(
+        segments=segments,
+        requirements=requirements,
+        segment_keys_by_trait_key={
+            trait_key: tuple(segment_keys)
+            for trait_key, segment_keys in segment_keys_by_trait_key.items()
+        },
+        positions={segment_key: i for i, segment_key in enumerate(segments)},
+        unconstrained_segments=unconstrained_segments,
+    )
+
+
+def _get_rule_requirements(rule: SegmentRule) -> Requirements:
+    # A rule matches if its conditions and its sub-rules both match, each
+    # combined according to the rule type.
+    parts = []
+    if conditions := rule.get("conditions"):
+        parts.append([_get_condition_requirements(c) for c in conditions])
+    if sub_rules := rule.get("rules"):
+        parts.append([_get_rule_requirements(r) for r in sub_rules])
+
+    rule_type = rule["type"]
+    if rule_type == constants.ALL_RULE:
+        return _get_all_requirements(
+            [requirements for part in parts for requirements in part]
+        )
+    if rule_type == constants.ANY_RULE:
+        return _get_all_requirements([_get_any_requirements(part) for part in parts])
+    # NONE rules match when their conditions don't, e.g. for missing traits.
+    return _UNCONSTRAINED
+
+
+def _get_condition_requirements(condition: SegmentCondition) -> Requirements:
+    condition_property = condition["property"]
+    if (
+        condition["operator"] == constants.IS_NOT_SET
+        or not condition_property
+        or condition_property.startswith("$.")
+    ):
+        # Matches missing traits, or depends on something other than traits.
+        return _UNCONSTRAINED
+    return (frozenset((condition_property,)),)
+
+
+def _get_all_requirements(requirements: list[Requirements]) -> Requirements:
+    return tuple(clause for clauses in requirements for clause in clauses)
+
+
+def _get_any_requirements(requirements: list[Requirements]) -> Requirements:
+    # Any of the alternatives matching needs one of the trait keys of at least
+    # one of them. Taking each alternative's narrowest clause keeps it tight.
+    if not all(requirements):
+        return _UNCONSTRAINED
+    return (frozenset().union(*(min(clauses, key=len) for clauses in requirements)),)
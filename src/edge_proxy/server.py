@@ -1,26 +1,52 @@
 from datetime import datetime, timedelta
 import asyncio
+import time
+from typing import Any, AsyncIterator, Iterable
 
 import httpx
+import orjson
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, Header
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
-from fastapi.responses import ORJSONResponse, Response
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
-from edge_proxy.health_check.responses import HealthCheckResponse
+from edge_proxy.health_check.responses import (
+    EnvironmentsHealthCheckResponse,
+    HealthCheckResponse,
+)
 
-from edge_proxy.cache import LocalMemEnvironmentsCache
+from edge_proxy.broadcast import EnvironmentBroadcaster
+from edge_proxy.cache import create_environments_cache
 from edge_proxy.environments import EnvironmentService
 from edge_proxy.exceptions import FeatureNotFoundError, FlagsmithUnknownKeyError
+from edge_proxy.leases import create_lease
 from edge_proxy.logging import setup_logging
-from edge_proxy.models import IdentityWithTraits
+from edge_proxy.metrics import (
+    BULK_IDENTITIES_ROUTE,
+    FLAGS_ROUTE,
+    IDENTITIES_ROUTE,
+    MetricsMiddleware,
+)
+from edge_proxy.models import BulkIdentitiesWithTraits, IdentityWithTraits
+from edge_proxy.rendering import (
+    IDENTITY,
+    RenderedBody,
+    RenderedFlags,
+    negotiate_encoding,
+)
 from edge_proxy.settings import get_settings
+from edge_proxy.workers import (
+    follow_snapshots,
+    is_snapshot_follower,
+    poll_with_lease,
+)
 
 settings = get_settings()
 setup_logging(settings.logging)
 environment_service = EnvironmentService(
-    LocalMemEnvironmentsCache(),
+    create_environments_cache(settings),
     httpx.AsyncClient(
         timeout=settings.api_poll_timeout_seconds,
         follow_redirects=True,
@@ -37,7 +63,32 @@ async def poll_environments():
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    await environment_service.refresh_environment_caches()
+    if lease := create_lease(settings):
+        # Replicas share documents through the cache, and only the one
+        # holding the lease polls upstream.
+        environment_service.load_snapshots()
+        poll = asyncio.create_task(
+            poll_with_lease(environment_service, lease, settings)
+        )
+        yield
+        poll.cancel()
+        await asyncio.to_thread(lease.release)
+        return
+
+    if is_snapshot_follower():
+        # Another process polls upstream and publishes snapshots for us.
+        environment_service.load_snapshots()
+        follow = asyncio.create_task(
+            follow_snapshots(environment_service, settings.snapshot_dir)
+        )
+        yield
+        follow.cancel()
+        return
+
+    # When every document was restored from a snapshot, start serving right
+    # away and let the poller revalidate them in the background.
+    if not environment_service.load_snapshots():
+        await environment_service.refresh_environment_caches()
     poll = asyncio.create_task(poll_environments())
     yield
     poll.cancel()
@@ -70,32 +121,89 @@ async def health_check():
             last_successful_update=None,
         )
 
-    grace_period = settings.health_check.environment_update_grace_period_seconds
-    if grace_period is not None:
-        buffer = grace_period * len(settings.environment_key_pairs)
-        threshold = datetime.now() - timedelta(
-            seconds=settings.api_poll_frequency_seconds + buffer
+    # Tolerate environments failing to refresh while enough of them keep
+    # being refreshed, rather than going unready because of a single one.
+    threshold = _get_staleness_threshold()
+    environment_statuses = environment_service.environment_statuses.values()
+    required = min(
+        settings.health_check.min_fresh_environments, len(environment_statuses)
+    )
+    if (
+        threshold is not None
+        and sum(status.last_loaded_at >= threshold for status in environment_statuses)
+        < required
+    ):
+        return HealthCheckResponse(
+            status_code=503,
+            status="error",
+            reason="environment document(s) stale.",
+            last_successful_update=last_updated_at,
         )
-        if last_updated_at < threshold:
-            return HealthCheckResponse(
-                status_code=503,
-                status="error",
-                reason="environment document(s) stale.",
-                last_successful_update=last_updated_at,
-            )
 
     return HealthCheckResponse(last_successful_update=last_updated_at)
 
 
+@app.get("/proxy/health/environments", response_class=ORJSONResponse)
+async def environments_health_check():
+    return EnvironmentsHealthCheckResponse(
+        environment_statuses=environment_service.environment_statuses,
+        staleness_threshold=_get_staleness_threshold(),
+    )
+
+
+def _get_staleness_threshold() -> datetime | None:
+    grace_period = settings.health_check.environment_update_grace_period_seconds
+    if grace_period is None:
+        return None
+    return datetime.now() - timedelta(
+        seconds=settings.api_poll_frequency_seconds + grace_period
+    )
+
+
 @app.get("/proxy/health/liveness")
 async def liveness_check():
     return Response(status_code=200)
 
 
+@app.get("/proxy/metrics")
+async def metrics():
+    return Response(
+        generate_latest(environment_service.metrics.registry),
+        media_type=CONTENT_TYPE_LATEST,
+    )
+
+
 @app.get("/api/v1/flags/", response_class=ORJSONResponse)
-async def flags(feature: str = None, x_environment_key: str = Header(None)):
+async def flags(
+    feature: str = None,
+    x_environment_key: str = Header(None),
+    accept_encoding: str = Header(None),
+    if_none_match: str = Header(None),
+    if_modified_since: str = Header(None),
+):
+    client_side_key, is_server_key = environment_service.resolve_environment_key(
+        x_environment_key
+    )
+    validators = environment_service.get_response_validators(
+        client_side_key, is_server_key=is_server_key
+    )
+    if validators.is_not_modified(if_none_match, if_modified_since):
+        return Response(status_code=304, headers=validators.headers)
+
     try:
-        data = environment_service.get_flags_response_data(x_environment_key, feature)
+        if rendered_flags := environment_service.get_rendered_flags(
+            client_side_key, is_server_key=is_server_key
+        ):
+            response = _rendered_flags_response(
+                rendered_flags, feature, accept_encoding
+            )
+        else:
+            response = _json_response(
+                FLAGS_ROUTE,
+                environment_service.get_flags_response_data(
+                    client_side_key, feature, is_server_key=is_server_key
+                ),
+            )
     except FeatureNotFoundError:
         return ORJSONResponse(
             status_code=404,
@@ -105,7 +213,40 @@ async def flags(feature: str = None, x_environment_key: str = Header(None)):
             },
         )
 
-    return ORJSONResponse(data)
+    response.headers.update(validators.headers)
+    return response
+
+
+def _rendered_flags_response(
+    rendered_flags: RenderedFlags,
+    feature: str | None,
+    accept_encoding: str | None,
+) -> Response:
+    if feature:
+        if (body := rendered_flags.features.get(feature)) is None:
+            raise FeatureNotFoundError()
+        return Response(body, media_type="application/json")
+    return _encoded_response(rendered_flags.flags, accept_encoding)
+
+
+def _encoded_response(
+    rendered_body: RenderedBody,
+    accept_encoding: str | None,
+) -> Response:
+    """
+    Serve a pre-encoded body in the best content coding the client accepts.
+    Responses that already carry a Content-Encoding are left alone by
+    GZipMiddleware, which only compresses the bodies rendered per request.
+    """
+    encoding = negotiate_encoding(accept_encoding)
+    headers = {"Vary": "Accept-Encoding"}
+    if encoding != IDENTITY:
+        headers["Content-Encoding"] = encoding
+    return Response(
+        rendered_body.get_encoded(encoding),
+        media_type="application/json",
+        headers=headers,
+    )
 
 
 @app.post("/api/v1/identities/", response_class=ORJSONResponse)
@@ -114,7 +255,41 @@ async def identity(
     x_environment_key: str = Header(None),
 ):
     data = environment_service.get_identity_response_data(input_data, x_environment_key)
-    return ORJSONResponse(data)
+    return _json_response(IDENTITIES_ROUTE, data)
+
+
+@app.post(BULK_IDENTITIES_ROUTE)
+async def bulk_identities(
+    input_data: BulkIdentitiesWithTraits,
+    x_environment_key: str = Header(None),
+) -> StreamingResponse:
+    data = environment_service.get_bulk_identities_response_data(
+        input_data.identities, x_environment_key
+    )
+    return StreamingResponse(
+        _render_json_array(data),
+        media_type="application/json",
+    )
+
+
+async def _render_json_array(
+    items: Iterable[Any], chunk_size: int = 64 * 1024
+) -> AsyncIterator[bytes]:
+    """
+    Serialize items into a JSON array as they are produced, yielding
+    chunks of roughly `chunk_size` bytes.
+    """
+    chunk = bytearray(b"[")
+    separator = b""
+    for item in items:
+        chunk += separator
+        chunk += orjson.dumps(item)
+        separator = b","
+        if len(chunk) >= chunk_size:
+            yield bytes(chunk)
+            chunk.clear()
+    chunk += b"]"
+    yield bytes(chunk)
 
 
 @app.get("/api/v1/identities/", response_class=ORJSONResponse)
@@ -125,18 +300,70 @@ async def get_identities(
     data = environment_service.get_identity_response_data(
         IdentityWithTraits(identifier=identifier), x_environment_key
     )
-    return ORJSONResponse(data)
+    return _json_response(IDENTITIES_ROUTE, data)
 
 
 @app.get("/api/v1/environment-document", response_class=ORJSONResponse)
 async def environment_document(
     x_environment_key: str = Header(None),
-) -> ORJSONResponse:
-    if environment_doc := environment_service.get_environment(
-        environment_key=x_environment_key,
-    ):
-        return ORJSONResponse(environment_doc)
-    return ORJSONResponse(status_code=401, content=None)
+    accept_encoding: str = Header(None),
+    if_none_match: str = Header(None),
+    if_modified_since: str = Header(None),
+) -> Response:
+    client_side_key, is_server_key = environment_service.resolve_environment_key(
+        x_environment_key
+    )
+    validators = environment_service.get_response_validators(
+        client_side_key, is_server_key=is_server_key
+    )
+    if validators.is_not_modified(if_none_match, if_modified_since):
+        return Response(status_code=304, headers=validators.headers)
+
+    response = _encoded_response(
+        environment_service.get_rendered_environment_document(
+            client_side_key, is_server_key=is_server_key
+        ),
+        accept_encoding,
+    )
+    response.headers.update(validators.headers)
+    return response
+
+
+@app.get("/sse/environments/{environment_key}/stream")
+async def environment_stream(environment_key: str) -> StreamingResponse:
+    broadcaster = environment_service.get_broadcaster(environment_key)
+    return StreamingResponse(
+        _render_environment_events(broadcaster, settings.stream_keepalive_seconds),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # Keeps GZipMiddleware, and proxies in front of us, from buffering
+            # events until enough of them have accumulated.
+            "Content-Encoding": "identity",
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+
+async def _render_environment_events(
+    broadcaster: EnvironmentBroadcaster, keepalive_seconds: float
+) -> AsyncIterator[bytes]:
+    """
+    Render environment changes as server-sent events, starting with the
+    latest one, with comments in between to keep idle connections open.
+    """
+    async for message in broadcaster.subscribe(keepalive_seconds):
+        if message is None:
+            yield b": keepalive\n\n"
+        else:
+            yield b"event: environment_updated\ndata: " + message + b"\n\n"
+
+
+def _json_response(route: str, content: Any) -> ORJSONResponse:
+    started_at = time.perf_counter()
+    response = ORJSONResponse(content)
+    environment_service.metrics.observe_serialization(route, started_at)
+    return response
 
 
 app.add_middleware(
@@ -147,3 +374,4 @@ app.add_middleware(
     allow_headers=["*"],
 )
 app.add_middleware(GZipMiddleware, minimum_size=1000)
+app.add_middleware(MetricsMiddleware, metrics=environment_service.metrics)
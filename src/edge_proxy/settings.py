@@ -8,7 +8,15 @@ from typing import Any, Optional
 
 import structlog
 
-from pydantic import AliasChoices, BaseModel, HttpUrl, IPvAnyAddress, Field, constr
+from pydantic import (
+    AliasChoices,
+    BaseModel,
+    HttpUrl,
+    IPvAnyAddress,
+    Field,
+    constr,
+    model_validator,
+)
 
 from pydantic_settings import BaseSettings, PydanticBaseSettingsSource
 
@@ -37,6 +45,18 @@ class LogLevel(Enum):
         return getattr(logging, self.value)
 
 
+class EnvironmentsCacheBackend(Enum):
+    LOCAL_MEM = "local_mem"
+    COMPACT = "compact"
+    REDIS = "redis"
+
+
+class LeaderElection(Enum):
+    NONE = "none"
+    REDIS = "redis"
+    FILE_LOCK = "file_lock"
+
+
 def ensure_defaults() -> None:
     if not os.path.exists(CONFIG_PATH):
         defaults = AppSettings()
@@ -75,6 +95,7 @@ class EnvironmentKeyPair(BaseModel):
 
 class EndpointCacheSettings(BaseModel):
     use_cache: bool = False
+    # Maximum number of cached responses per environment.
     cache_max_size: int = 128
 
 
@@ -107,10 +128,29 @@ class ServerSettings(BaseModel):
     # an interval longer than this — otherwise pooled connections get closed
     # server-side before the next poll, causing ConnectionResetError clients.
     timeout_keep_alive: int = Field(default=5, gt=0)
+    # Number of worker processes serving requests. With more than one, a
+    # separate process polls upstream and shares the documents with the workers.
+    workers: int = Field(default=1, gt=0)
+
+
+class RedisSettings(BaseModel):
+    url: str = "redis://localhost:6379/0"
+    # Prefix of the keys the proxy stores documents, statuses and its lease
+    # under, so that several deployments can share a database.
+    key_prefix: str = "edge-proxy"
+    socket_timeout_seconds: float = Field(default=5, gt=0)
+    # How long the replica polling upstream holds its lease without renewing
+    # it, which it does on every poll. Should be a few poll intervals long.
+    lease_ttl_seconds: int = Field(default=30, gt=0)
 
 
 class HealthCheckSettings(BaseModel):
     environment_update_grace_period_seconds: Optional[int] = 30
+    # Number of environments that must have been fetched within the grace
+    # period for the pod to be ready, capped at the number of environments.
+    # Every environment must have been fetched at least once regardless.
+    # Per-environment freshness is reported by /proxy/health/environments.
+    min_fresh_environments: int = Field(default=1, gt=0)
 
 
 class AppSettings(BaseModel):
@@ -130,12 +170,59 @@ class AppSettings(BaseModel):
             "api_poll_timeout",
         ),
     )
+    # Maximum number of environment documents fetched concurrently per poll.
+    api_poll_concurrency: int = Field(default=10, gt=0)
+    # Size up to which a fetched environment document is buffered in memory
+    # before it is parsed. Larger documents are spooled to a temporary file.
+    api_poll_spool_max_memory_bytes: int = Field(default=8 * 1024 * 1024, ge=0)
     endpoint_caches: EndpointCachesSettings | None = None
+    # `compact` keeps environment documents serialized rather than parsed,
+    # trading a slower `get_environment` for a smaller memory footprint.
+    # `redis` shares documents between replicas through the Redis-compatible
+    # store configured in `redis`: a single elected replica polls upstream.
+    environments_cache_backend: EnvironmentsCacheBackend = (
+        EnvironmentsCacheBackend.LOCAL_MEM
+    )
+    redis: RedisSettings = RedisSettings()
+    # How replicas elect the single one of them that polls upstream. The
+    # others follow the documents it shares through the `redis` cache, or
+    # through snapshots in `snapshot_dir` on a volume they all mount.
+    # `redis` holds a lease in the store configured in `redis`, `file_lock`
+    # holds a lock on a file in `snapshot_dir`. Defaults to `redis` with the
+    # `redis` cache backend, and to `none` otherwise.
+    leader_election: LeaderElection | None = None
+    # Directory to persist environment documents to. When set, the proxy
+    # serves from the persisted snapshots on startup and revalidates them
+    # in the background.
+    snapshot_dir: Path | None = None
+    # Render the environment flags payload once per document change and serve
+    # the stored bytes from GET /api/v1/flags/.
+    prerender_flags: bool = False
+    # Interval between keepalive comments on idle environment change streams.
+    stream_keepalive_seconds: int = Field(default=15, gt=0)
     allow_origins: list[str] = Field(default_factory=lambda: ["*"])
     logging: LoggingSettings = LoggingSettings()
     server: ServerSettings = ServerSettings()
     health_check: HealthCheckSettings = HealthCheckSettings()
 
+    @model_validator(mode="after")
+    def validate_leader_election(self) -> "AppSettings":
+        if self.snapshot_dir is not None:
+            return self
+        if self.leader_election == LeaderElection.FILE_LOCK:
+            raise ValueError(
+                "snapshot_dir is required to elect a leader with a file lock."
+            )
+        if (
+            self.leader_election == LeaderElection.REDIS
+            and self.environments_cache_backend != EnvironmentsCacheBackend.REDIS
+        ):
+            raise ValueError(
+                "snapshot_dir is required for replicas to share documents, "
+                "unless the redis cache backend is used."
+            )
+        return self
+
 
 class AppConfig(AppSettings, BaseSettings):
     class Config:
@@ -0,0 +1,122 @@
+import mmap
+import os
+import struct
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+from urllib.parse import quote
+
+import orjson
+
+from edge_proxy.exceptions import InvalidSnapshotError
+
+# Snapshot layout (little-endian):
+#   magic (8 bytes) | etag length (u16) | last modified length (u16)
+#   | digest length (u16) | document length (u64)
+#   | etag | last modified | digest | document (compact JSON)
+_MAGIC = b"EPSNAP\x00\x01"
+_HEADER = struct.Struct("<8sHHHQ")
+
+SNAPSHOT_SUFFIX = ".snapshot"
+STATUSES_FILE_NAME = "statuses.json"
+
+
+@dataclass(frozen=True, slots=True)
+class Snapshot:
+    document: dict[str, Any]
+    etag: str | None
+    last_modified: str | None
+    digest: bytes | None
+
+
+def get_snapshot_path(snapshot_dir: Path, environment_api_key: str) -> Path:
+    return snapshot_dir / f"{quote(environment_api_key, safe='')}{SNAPSHOT_SUFFIX}"
+
+
+def write_snapshot(
+    path: Path,
+    document: bytes,
+    etag: str | None = None,
+    last_modified: str | None = None,
+    digest: bytes | None = None,
+) -> None:
+    """
+    Atomically write a snapshot: readers see either the previous snapshot or the
+    complete new one, never a partial write.
+    """
+    etag_bytes = (etag or "").encode()
+    last_modified_bytes = (last_modified or "").encode()
+    digest = digest or b""
+    header = _HEADER.pack(
+        _MAGIC,
+        len(etag_bytes),
+        len(last_modified_bytes),
+        len(digest),
+        len(document),
+    )
+
+    write_file_atomically(
+        path, header, etag_bytes, last_modified_bytes, digest, document
+    )
+
+
+def write_file_atomically(path: Path, *chunks: bytes) -> None:
+    """
+    Write the given chunks to a temporary file next to `path`, then rename it
+    over `path` so that readers see either the previous file or the complete
+    new one, never a partial write.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            for chunk in chunks:
+                fp.write(chunk)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def read_snapshot(path: Path) -> Snapshot:
+    """
+    Read a snapshot written by `write_snapshot`. The file is memory-mapped and the
+    document is parsed straight from the mapping without an intermediate copy.
+
+    Raises FileNotFoundError if there is no snapshot at the given path, and
+    InvalidSnapshotError if the file is not a valid snapshot.
+    """
+    with open(path, "rb") as fp:
+        if os.fstat(fp.fileno()).st_size < _HEADER.size:
+            raise InvalidSnapshotError(path)
+        with (
+            mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mapped,
+            memoryview(mapped) as view,
+        ):
+            magic, etag_len, last_modified_len, digest_len, document_len = (
+                _HEADER.unpack_from(view)
+            )
+            offset = _HEADER.size
+            end = offset + etag_len + last_modified_len + digest_len + document_len
+            if magic != _MAGIC or end != len(view):
+                raise InvalidSnapshotError(path)
+
+            etag = bytes(view[offset : offset + etag_len]).decode()
+            offset += etag_len
+            last_modified = bytes(view[offset : offset + last_modified_len]).decode()
+            offset += last_modified_len
+            digest = bytes(view[offset : offset + digest_len])
+            offset += digest_len
+            try:
+                document = orjson.loads(view[offset:end])
+            except orjson.JSONDecodeError as e:
+                raise InvalidSnapshotError(path) from e
+
+    return Snapshot(
+        document=document,
+        etag=etag or None,
+        last_modified=last_modified or None,
+        digest=digest or None,
+    )
@@ -0,0 +1,77 @@
+import mmap
+import tempfile
+from typing import Any, BinaryIO
+
+import orjson
+
+from edge_proxy.compiled import new_document_hash
+
+
+class SpooledDocument:
+    """
+    Buffer for an environment document received in chunks. The document is
+    kept in memory up to `max_memory_size` bytes, and spooled to a temporary
+    file beyond that. Its digest is computed as it is written, and it is
+    parsed straight from the buffer without decoding or copying it.
+    """
+
+    def __init__(self, max_memory_size: int) -> None:
+        self.max_memory_size = max_memory_size
+        self.size = 0
+        self._hash = new_document_hash()
+        self._buffer: bytearray | None = bytearray()
+        self._file: BinaryIO | None = None
+
+    def __enter__(self) -> "SpooledDocument":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    @property
+    def digest(self) -> bytes:
+        return self._hash.digest()
+
+    @property
+    def spooled(self) -> bool:
+        return self._file is not None
+
+    def write(self, chunk: bytes) -> None:
+        self._hash.update(chunk)
+        self.size += len(chunk)
+        if self._file is not None:
+            self._file.write(chunk)
+            return
+        if self.size <= self.max_memory_size:
+            self._buffer += chunk
+            return
+        self._file = tempfile.TemporaryFile(prefix="edge-proxy-document-")
+        self._file.write(self._buffer)
+        self._file.write(chunk)
+        self._buffer = None
+
+    def load(self) -> dict[str, Any]:
+        """
+        Parse the buffered document. Raises orjson.JSONDecodeError if it is not
+        valid JSON.
+        """
+        if self._file is None:
+            return orjson.loads(self._buffer)
+        self._file.flush()
+        with (
+            mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) as mapped,
+            memoryview(mapped) as view,
+        ):
+            return orjson.loads(view)
+
+    def getvalue(self) -> bytes:
+        if self._file is None:
+            return bytes(self._buffer)
+        self._file.seek(0)
+        return self._file.read()
+
+    def close(self) -> None:
+        self._buffer = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
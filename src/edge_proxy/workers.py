@@ -0,0 +1,228 @@
+import asyncio
+import multiprocessing
+import os
+import tempfile
+from contextlib import contextmanager
+from dataclasses import asdict
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator
+
+import httpx
+import orjson
+import structlog
+
+from edge_proxy.cache import create_environments_cache
+from edge_proxy.environments import EnvironmentService, EnvironmentStatus
+from edge_proxy.leases import BaseLease
+from edge_proxy.logging import setup_logging
+from edge_proxy.settings import AppSettings
+from edge_proxy.snapshots import STATUSES_FILE_NAME, write_file_atomically
+
+logger = structlog.get_logger(__name__)
+
+# Set in the environment of uvicorn workers that serve from the snapshots
+# written by the poller process instead of polling upstream themselves.
+SNAPSHOT_FOLLOWER_ENV_VAR = "EDGE_PROXY_SNAPSHOT_FOLLOWER"
+SNAPSHOT_DIR_ENV_VAR = "SNAPSHOT_DIR"
+
+SNAPSHOT_RELOAD_INTERVAL_SECONDS = 1
+
+
+def is_snapshot_follower() -> bool:
+    return os.environ.get(SNAPSHOT_FOLLOWER_ENV_VAR) == "1"
+
+
+@contextmanager
+def run_poller_process(settings: AppSettings) -> Iterator[Path]:
+    """
+    Run a single process polling upstream and publishing the documents as
+    snapshots, and set up the environment so that processes started within
+    this context follow those snapshots rather than polling.
+
+    Yields the snapshot directory. A temporary one is used and removed on exit
+    if `snapshot_dir` is not configured.
+    """
+    with tempfile.TemporaryDirectory(prefix="edge-proxy-") as tmp_dir:
+        snapshot_dir = settings.snapshot_dir or Path(tmp_dir)
+        snapshot_dir.mkdir(parents=True, exist_ok=True)
+
+        poller = multiprocessing.get_context("spawn").Process(
+            target=run_poller,
+            args=(settings, snapshot_dir),
+            name="edge-proxy-poller",
+            daemon=True,
+        )
+        poller.start()
+
+        environ = {
+            SNAPSHOT_FOLLOWER_ENV_VAR: "1",
+            SNAPSHOT_DIR_ENV_VAR: str(snapshot_dir),
+        }
+        previous_environ = {name: os.environ.get(name) for name in environ}
+        os.environ.update(environ)
+        try:
+            yield snapshot_dir
+        finally:
+            for name, value in previous_environ.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+            poller.terminate()
+            poller.join()
+
+
+def run_poller(settings: AppSettings, snapshot_dir: Path) -> None:
+    setup_logging(settings.logging)
+    asyncio.run(poll_environments(settings, snapshot_dir))
+
+
+async def poll_environments(settings: AppSettings, snapshot_dir: Path) -> None:
+    # The poller never serves requests, so there is nothing to pre-render or
+    # cache beyond the documents themselves.
+    settings = settings.model_copy(
+        update={
+            "snapshot_dir": snapshot_dir,
+            "endpoint_caches": None,
+            "prerender_flags": False,
+        }
+    )
+    environment_service = EnvironmentService(
+        create_environments_cache(settings),
+        httpx.AsyncClient(
+            timeout=settings.api_poll_timeout_seconds,
+            follow_redirects=True,
+        ),
+        settings,
+    )
+    # Revalidate existing snapshots rather than downloading every document again.
+    environment_service.load_snapshots()
+    while True:
+        await environment_service.refresh_environment_caches()
+        try:
+            write_environment_statuses(
+                snapshot_dir, environment_service.environment_statuses
+            )
+        except OSError:
+            logger.exception("error_writing_environment_statuses")
+        await asyncio.sleep(settings.api_poll_frequency_seconds)
+
+
+async def follow_snapshots(
+    environment_service: EnvironmentService,
+    snapshot_dir: Path,
+) -> None:
+    while True:
+        try:
+            await environment_service.reload_snapshots()
+            _update_environment_statuses(
+                environment_service, read_environment_statuses(snapshot_dir)
+            )
+        except (OSError, orjson.JSONDecodeError):
+            logger.exception("error_following_snapshots")
+        await asyncio.sleep(SNAPSHOT_RELOAD_INTERVAL_SECONDS)
+
+
+async def poll_with_lease(
+    environment_service: EnvironmentService,
+    lease: BaseLease,
+    settings: AppSettings,
+) -> None:
+    """
+    Poll upstream while holding the lease, sharing documents and statuses
+    with the other replicas through the cache. Otherwise, follow the ones
+    shared by the replica holding it.
+
+    Calls to the lease and the shared statuses, which may block on a store,
+    run in a thread.
+    """
+    is_leader = False
+    while True:
+        was_leader, is_leader = is_leader, await asyncio.to_thread(lease.acquire)
+        if is_leader and not was_leader:
+            logger.info("lease_acquired")
+        elif was_leader and not is_leader:
+            logger.info("lease_lost")
+
+        if is_leader:
+            if not was_leader:
+                # Catch up with the previous leader's documents, so that they
+                # are revalidated rather than fetched again.
+                await environment_service.reload_snapshots()
+            await environment_service.refresh_environment_caches()
+            await asyncio.to_thread(
+                environment_service.cache.put_statuses,
+                dump_environment_statuses(environment_service.environment_statuses),
+            )
+            await asyncio.sleep(settings.api_poll_frequency_seconds)
+            continue
+
+        await environment_service.reload_snapshots()
+        if content := await asyncio.to_thread(environment_service.cache.get_statuses):
+            try:
+                _update_environment_statuses(
+                    environment_service, load_environment_statuses(content)
+                )
+            except orjson.JSONDecodeError:
+                logger.exception("error_reading_environment_statuses")
+        await asyncio.sleep(SNAPSHOT_RELOAD_INTERVAL_SECONDS)
+
+
+def write_environment_statuses(
+    snapshot_dir: Path,
+    environment_statuses: dict[str, EnvironmentStatus],
+) -> None:
+    write_file_atomically(
+        snapshot_dir / STATUSES_FILE_NAME,
+        dump_environment_statuses(environment_statuses),
+    )
+
+
+def read_environment_statuses(snapshot_dir: Path) -> dict[str, EnvironmentStatus]:
+    try:
+        content = (snapshot_dir / STATUSES_FILE_NAME).read_bytes()
+    except FileNotFoundError:
+        return {}
+    return load_environment_statuses(content)
+
+
+def dump_environment_statuses(
+    environment_statuses: dict[str, EnvironmentStatus],
+) -> bytes:
+    return orjson.dumps(
+        {
+            client_side_key: asdict(status)
+            for client_side_key, status in environment_statuses.items()
+        }
+    )
+
+
+def load_environment_statuses(content: bytes) -> dict[str, EnvironmentStatus]:
+    return {
+        client_side_key: EnvironmentStatus(
+            last_attempted_at=_parse_datetime(status["last_attempted_at"]),
+            last_successful_fetch_at=_parse_datetime(
+                status["last_successful_fetch_at"]
+            ),
+            last_changed_at=_parse_datetime(status["last_changed_at"]),
+            error_streak=status["error_streak"],
+            restored_at=_parse_datetime(status.get("restored_at")),
+        )
+        for client_side_key, status in orjson.loads(content).items()
+    }
+
+
+def _update_environment_statuses(
+    environment_service: EnvironmentService,
+    environment_statuses: dict[str, EnvironmentStatus],
+) -> None:
+    environment_service.environment_statuses.update(
+        (client_side_key, status)
+        for client_side_key, status in environment_statuses.items()
+        if client_side_key in environment_service.environment_statuses
+    )
+
+
+def _parse_datetime(value: str | None) -> datetime | None:
+    return datetime.fromisoformat(value) if value else None
@@ -1,6 +1,9 @@
+import threading
 import typing
 
 import pytest
+import redis
+from fakeredis import TcpFakeServer
 from pytest_mock import MockerFixture
 from fastapi.testclient import TestClient
 
@@ -73,7 +76,9 @@ def environment_service() -> "EnvironmentService":
 def mocked_environment_cache(mocker: MockerFixture) -> typing.Any:
     mock = mocker.patch("edge_proxy.server.environment_service.cache")
     mock.get_environment.return_value = None
+    mock.get_environment_content.return_value = None
     mock.get_feature_types.return_value = None
+    mock.get_compiled_environment.return_value = None
     return mock
 
 
@@ -83,3 +88,23 @@ def client():
 
     with TestClient(app) as c:
         yield c
+
+
+@pytest.fixture
+def redis_client() -> typing.Iterator[redis.Redis]:
+    """
+    A client of a Redis stand-in listening on a local port, for the code
+    talking the Redis protocol over the network.
+    """
+    server = TcpFakeServer(("127.0.0.1", 0), server_type="redis")
+    thread = threading.Thread(
+        target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True
+    )
+    thread.start()
+    host, port = server.server_address
+    client = redis.Redis(host=host, port=port)
+    yield client
+    client.close()
+    server.shutdown()
+    server.server_close()
+    thread.join()
@@ -0,0 +1,88 @@
+import httpx
+import orjson
+
+from benchmarks.documents import (
+    DocumentSpec,
+    generate_environment_document,
+    generate_identities,
+)
+from benchmarks.results import BenchmarkResult, compare_results
+from benchmarks.upstream import ENVIRONMENT_DOCUMENT_PATH, run_upstream
+from edge_proxy.compiled import compile_environment
+from edge_proxy.models import IdentityWithTraits
+
+
+def test_generate_environment_document__spec__return_expected() -> None:
+    # Given
+    spec = DocumentSpec(features=7, segments=3, identity_overrides=4, seed=1)
+
+    # When
+    environment_document = generate_environment_document(spec)
+
+    # Then
+    assert environment_document == generate_environment_document(spec)
+    compiled_environment = compile_environment(environment_document)
+    assert len(compiled_environment.context["features"]) == 7
+    assert len(compiled_environment.segment_index.segments) == 3
+    assert len(compiled_environment.identity_overrides) == 4
+
+
+def test_generate_identities__return_valid_identities() -> None:
+    # Given
+    spec = DocumentSpec(trait_keys=3)
+
+    # When
+    identities = generate_identities(spec, count=5, traits_per_identity=5)
+
+    # Then
+    assert len(identities) == 5
+    for identity in identities:
+        assert len(IdentityWithTraits.model_validate(identity).traits) == 3
+
+
+def test_run_upstream__revalidated_document__return_304() -> None:
+    # Given
+    document = orjson.dumps(generate_environment_document(DocumentSpec()))
+
+    with run_upstream({"ser.key": document}) as upstream:
+        url = f"{upstream.api_url.removesuffix('/api/v1')}{ENVIRONMENT_DOCUMENT_PATH}"
+
+        # When
+        response = httpx.get(url, headers={"X-Environment-Key": "ser.key"})
+        revalidated_response = httpx.get(
+            url,
+            headers={
+                "X-Environment-Key": "ser.key",
+                "If-None-Match": response.headers["ETag"],
+            },
+        )
+        unknown_key_response = httpx.get(url, headers={"X-Environment-Key": "ser.x"})
+
+    # Then
+    assert response.status_code == 200
+    assert response.content == document
+    assert revalidated_response.status_code == 304
+    assert unknown_key_response.status_code == 401
+    assert upstream.requests == 3
+
+
+def test_compare_results__return_relative_changes() -> None:
+    # Given
+    baseline = {
+        "results": [
+            BenchmarkResult(name="a", samples=[1.0]).to_dict(),
+            BenchmarkResult(name="b", samples=[2.0]).to_dict(),
+        ]
+    }
+    current = {
+        "results": [
+            BenchmarkResult(name="a", samples=[1.5]).to_dict(),
+            BenchmarkResult(name="c", samples=[1.0]).to_dict(),
+        ]
+    }
+
+    # When
+    comparison = compare_results(baseline, current)
+
+    # Then
+    assert comparison == [("a", 1.0, 1.5, 0.5)]
@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from edge_proxy.broadcast import EnvironmentBroadcaster
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_subscribe__published_before_subscribing__yields_latest_message() -> None:
+    # Given
+    broadcaster = EnvironmentBroadcaster()
+    broadcaster.publish(b"first")
+    broadcaster.publish(b"second")
+
+    # When
+    subscription = broadcaster.subscribe()
+    message = await anext(subscription)
+
+    # Then
+    assert message == b"second"
+
+
+async def test_subscribe__many_subscribers__all_notified_of_publish() -> None:
+    # Given
+    broadcaster = EnvironmentBroadcaster()
+    subscriptions = [broadcaster.subscribe() for _ in range(100)]
+    waiters = [
+        asyncio.create_task(anext(subscription)) for subscription in subscriptions
+    ]
+    await asyncio.sleep(0)
+
+    # When
+    broadcaster.publish(b"changed")
+
+    # Then
+    assert await asyncio.gather(*waiters) == [b"changed"] * 100
+
+
+async def test_subscribe__slow_subscriber__skips_to_latest_message() -> None:
+    # Given
+    broadcaster = EnvironmentBroadcaster()
+    subscription = broadcaster.subscribe()
+    broadcaster.publish(b"first")
+    assert await anext(subscription) == b"first"
+
+    # When
+    broadcaster.publish(b"second")
+    broadcaster.publish(b"third")
+
+    # Then
+    assert await anext(subscription) == b"third"
+
+
+async def test_subscribe__idle__yields_keepalive() -> None:
+    # Given
+    broadcaster = EnvironmentBroadcaster()
+    subscription = broadcaster.subscribe(keepalive_seconds=0.01)
+
+    # When
+    message = await anext(subscription)
+
+    # Then
+    assert message is None
+    assert broadcaster.version == 0
+
+
+async def test_wait__nothing_published__times_out() -> None:
+    # Given
+    broadcaster = EnvironmentBroadcaster()
+
+    # When
+    published = await broadcaster.wait(broadcaster.version, timeout=0.01)
+
+    # Then
+    assert published is False
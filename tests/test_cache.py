@@ -0,0 +1,257 @@
+import copy
+from pathlib import Path
+
+import orjson
+import pytest
+
+from edge_proxy.cache import (
+    CompactEnvironmentsCache,
+    EnvironmentValidators,
+    LocalMemEnvironmentsCache,
+    create_environments_cache,
+)
+from edge_proxy.compiled import get_document_digest
+from edge_proxy.redis_cache import RedisEnvironmentsCache
+from edge_proxy.settings import AppSettings, EnvironmentsCacheBackend
+from tests.fixtures.response_data import environment_1, environment_1_api_key
+
+
+def test_put_environment__no_validators__compares_documents() -> None:
+    # Given
+    cache = LocalMemEnvironmentsCache()
+    modified_document = copy.deepcopy(environment_1)
+    modified_document["name"] = "modified"
+
+    # When
+    results = [
+        cache.put_environment(environment_1_api_key, environment_1),
+        cache.put_environment(environment_1_api_key, copy.deepcopy(environment_1)),
+        cache.put_environment(environment_1_api_key, modified_document),
+    ]
+
+    # Then
+    assert results == [True, False, True]
+    assert cache.get_environment(environment_1_api_key) == modified_document
+
+
+def test_put_environment__validators__compares_digests() -> None:
+    # Given
+    cache = LocalMemEnvironmentsCache()
+    validators = EnvironmentValidators(etag='"abc"', digest=get_document_digest(b"1"))
+
+    # When
+    results = [
+        cache.put_environment(environment_1_api_key, environment_1, validators),
+        cache.put_environment(environment_1_api_key, environment_1, validators),
+        cache.put_environment(
+            environment_1_api_key,
+            environment_1,
+            EnvironmentValidators(digest=get_document_digest(b"2")),
+        ),
+    ]
+
+    # Then
+    assert results == [True, False, True]
+    assert cache.get_validators(environment_1_api_key) == EnvironmentValidators(
+        digest=get_document_digest(b"2")
+    )
+
+
+def test_load_snapshot__snapshot_written_on_put__restores_environment(
+    tmp_path: Path,
+) -> None:
+    # Given
+    validators = EnvironmentValidators(etag='"abc"', digest=get_document_digest(b"1"))
+    LocalMemEnvironmentsCache(snapshot_dir=tmp_path).put_environment(
+        environment_1_api_key, environment_1, validators
+    )
+    cache = LocalMemEnvironmentsCache(snapshot_dir=tmp_path)
+
+    # When
+    loaded = cache.load_snapshot(environment_1_api_key)
+
+    # Then
+    assert loaded is True
+    assert cache.get_environment(environment_1_api_key) == environment_1
+    assert cache.get_validators(environment_1_api_key) == validators
+    assert cache.get_compiled_environment(environment_1_api_key)
+
+
+def test_load_snapshot__no_snapshot__return_false(tmp_path: Path) -> None:
+    # Given
+    cache = LocalMemEnvironmentsCache(snapshot_dir=tmp_path)
+
+    # When
+    loaded = cache.load_snapshot(environment_1_api_key)
+
+    # Then
+    assert loaded is False
+    assert cache.get_environment(environment_1_api_key) is None
+
+
+def test_get_statuses__put_by_another_process__return_expected(
+    tmp_path: Path,
+) -> None:
+    # Given
+    LocalMemEnvironmentsCache(snapshot_dir=tmp_path).put_statuses(b'{"key":{}}')
+
+    # When
+    statuses = LocalMemEnvironmentsCache(snapshot_dir=tmp_path).get_statuses()
+    no_statuses = LocalMemEnvironmentsCache().get_statuses()
+
+    # Then
+    assert statuses == b'{"key":{}}'
+    assert no_statuses is None
+
+
+def test_reload_snapshot__unchanged_snapshot__return_false(tmp_path: Path) -> None:
+    # Given
+    LocalMemEnvironmentsCache(snapshot_dir=tmp_path).put_environment(
+        environment_1_api_key, environment_1
+    )
+    cache = LocalMemEnvironmentsCache(snapshot_dir=tmp_path)
+
+    # When
+    first_reload = cache.reload_snapshot(environment_1_api_key)
+    second_reload = cache.reload_snapshot(environment_1_api_key)
+
+    # Then
+    assert first_reload is True
+    assert second_reload is False
+    assert cache.get_environment(environment_1_api_key) == environment_1
+
+
+def test_reload_snapshot__snapshot_rewritten__loads_new_document(
+    tmp_path: Path,
+) -> None:
+    # Given
+    writer = LocalMemEnvironmentsCache(snapshot_dir=tmp_path)
+    writer.put_environment(environment_1_api_key, environment_1)
+    cache = LocalMemEnvironmentsCache(snapshot_dir=tmp_path)
+    cache.reload_snapshot(environment_1_api_key)
+
+    updated_environment = {**environment_1, "updated_at": "2024-01-01T00:00:00Z"}
+    writer.put_environment(environment_1_api_key, updated_environment)
+
+    # When
+    reloaded = cache.reload_snapshot(environment_1_api_key)
+
+    # Then
+    assert reloaded is True
+    assert cache.get_environment(environment_1_api_key) == updated_environment
+
+
+def test_get_environment_changes__document_replaced__return_changes() -> None:
+    # Given
+    cache = LocalMemEnvironmentsCache()
+    modified_document = copy.deepcopy(environment_1)
+    modified_document["feature_states"][0]["enabled"] = True
+
+    # When
+    cache.put_environment(environment_1_api_key, environment_1)
+    initial_changes = cache.get_environment_changes(environment_1_api_key)
+    cache.put_environment(environment_1_api_key, modified_document)
+    changes = cache.get_environment_changes(environment_1_api_key)
+
+    # Then
+    assert initial_changes is None
+    assert changes.features == {"feature_1"}
+
+
+def test_put_environment__content__keeps_content_with_document() -> None:
+    # Given
+    cache = LocalMemEnvironmentsCache()
+    content = orjson.dumps(environment_1, option=orjson.OPT_INDENT_2)
+
+    # When
+    cache.put_environment(environment_1_api_key, environment_1, content=content)
+    kept_content = cache.get_environment_content(environment_1_api_key)
+    cache.put_environment(environment_1_api_key, {**environment_1, "name": "renamed"})
+
+    # Then
+    assert kept_content is content
+    assert cache.get_environment_content(environment_1_api_key) is None
+    assert cache.get_environment(environment_1_api_key)["name"] == "renamed"
+
+
+def test_compact_environments_cache__put_environment__keeps_content() -> None:
+    # Given
+    cache = CompactEnvironmentsCache()
+    content = orjson.dumps(environment_1, option=orjson.OPT_INDENT_2)
+
+    # When
+    cache.put_environment(
+        environment_1_api_key, copy.deepcopy(environment_1), content=content
+    )
+
+    # Then
+    assert cache.has_environment(environment_1_api_key)
+    assert cache.get_environment_content(environment_1_api_key) is content
+    assert cache.get_environment(environment_1_api_key) == environment_1
+    assert cache.get_compiled_environment(environment_1_api_key)
+    assert not cache.has_environment("unknown")
+    assert cache.get_environment("unknown") is None
+
+
+def test_compact_environments_cache__documents__share_strings() -> None:
+    # Given
+    cache = CompactEnvironmentsCache()
+    documents = [orjson.loads(orjson.dumps(environment_1)) for _ in range(2)]
+
+    # When
+    cache.put_environment("first", documents[0])
+    cache.put_environment("second", documents[1])
+
+    # Then
+    first, second = (
+        cache.get_compiled_environment(key).context["features"]
+        for key in ("first", "second")
+    )
+    for name, feature in first.items():
+        assert feature["name"] is second[name]["name"]
+
+
+def test_compact_environments_cache__snapshot__restores_environment(
+    tmp_path: Path,
+) -> None:
+    # Given
+    content = orjson.dumps(environment_1)
+    CompactEnvironmentsCache(snapshot_dir=tmp_path).put_environment(
+        environment_1_api_key, copy.deepcopy(environment_1), content=content
+    )
+    cache = CompactEnvironmentsCache(snapshot_dir=tmp_path)
+
+    # When
+    loaded = cache.load_snapshot(environment_1_api_key)
+
+    # Then
+    assert loaded is True
+    assert cache.get_environment_content(environment_1_api_key) == content
+
+
+@pytest.mark.parametrize(
+    "backend, expected_cache_class",
+    [
+        (EnvironmentsCacheBackend.LOCAL_MEM, LocalMemEnvironmentsCache),
+        (EnvironmentsCacheBackend.COMPACT, CompactEnvironmentsCache),
+        (EnvironmentsCacheBackend.REDIS, RedisEnvironmentsCache),
+    ],
+)
+def test_create_environments_cache__backend__return_expected(
+    tmp_path: Path,
+    backend: EnvironmentsCacheBackend,
+    expected_cache_class: type,
+) -> None:
+    # Given
+    settings = AppSettings(
+        environment_key_pairs=[],
+        environments_cache_backend=backend,
+        snapshot_dir=tmp_path,
+    )
+
+    # When
+    cache = create_environments_cache(settings)
+
+    # Then
+    assert type(cache) is expected_cache_class
+    assert cache.snapshot_dir == tmp_path
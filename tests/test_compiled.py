@@ -0,0 +1,120 @@
+import copy
+from datetime import datetime, timezone
+
+from edge_proxy.compiled import compile_environment
+from tests.fixtures.response_data import (
+    environment_1,
+    environment_with_hide_disabled_flags,
+    environment_with_multivariate_feature,
+)
+
+
+def test_compile_environment__return_expected() -> None:
+    # When
+    compiled_environment = compile_environment(environment_1)
+
+    # Then
+    assert compiled_environment.feature_types == {
+        1: "STANDARD",
+        2: "STANDARD",
+        3: "STANDARD",
+    }
+    assert compiled_environment.server_key_only_feature_ids == frozenset({3})
+    assert compiled_environment.hide_disabled_flags is False
+    assert compiled_environment.updated_at == datetime(
+        1969, 7, 20, 20, 17, 40, tzinfo=timezone.utc
+    )
+    assert compiled_environment.version == compile_environment(environment_1).version
+    assert set(compiled_environment.context["features"]) == {
+        "feature_1",
+        "feature_2",
+        "feature_3",
+    }
+
+
+def test_compile_environment__hide_disabled_flags__return_expected() -> None:
+    # When
+    compiled_environment = compile_environment(environment_with_hide_disabled_flags)
+
+    # Then
+    assert compiled_environment.hide_disabled_flags is True
+    assert compiled_environment.server_key_only_feature_ids == frozenset()
+
+
+def test_compile_environment__environment_context__excludes_trait_segments() -> None:
+    # When
+    compiled_environment = compile_environment(environment_1)
+
+    # Then
+    assert compiled_environment.context["segments"]
+    assert compiled_environment.environment_context["segments"] == {
+        key: segment
+        for key, segment in compiled_environment.context["segments"].items()
+        if key in compiled_environment.segment_index.unconstrained_segments
+    }
+
+
+def test_compile_environment__identity_overrides__indexed_by_identifier() -> None:
+    # Given
+    environment_document = {
+        **environment_1,
+        "identity_overrides": [
+            {**environment_1["identity_overrides"][0], "identifier": identifier}
+            for identifier in ("overridden-id", "other-overridden-id")
+        ],
+    }
+
+    # When
+    compiled_environment = compile_environment(environment_document)
+
+    # Then
+    assert set(compiled_environment.identity_overrides) == {
+        "overridden-id",
+        "other-overridden-id",
+    }
+    (segment,) = compiled_environment.identity_overrides["overridden-id"].values()
+    assert segment["overrides"][0]["value"] == "identity_override"
+    assert segment["rules"] == [{"type": "ALL", "conditions": []}]
+    assert all(
+        segment["metadata"]["source"] != "identity_overrides"
+        for segment in compiled_environment.segment_index.segments.values()
+    )
+
+
+def test_compile_environment__segment_matching_without_traits__no_default_identity_flags() -> (
+    None
+):
+    # Given
+    environment_document = copy.deepcopy(environment_1)
+    environment_document["project"]["segments"][0]["rules"] = [
+        {
+            "type": "ALL",
+            "rules": [],
+            "conditions": [
+                {"operator": "PERCENTAGE_SPLIT", "property_": "", "value": "50"}
+            ],
+        }
+    ]
+
+    # When
+    compiled_environment = compile_environment(environment_document)
+
+    # Then
+    assert compiled_environment.default_identity_flags is None
+
+
+def test_compile_environment__multivariate_feature__default_identity_flags_vary_by_identifier() -> (
+    None
+):
+    # When
+    compiled_environment = compile_environment(environment_with_multivariate_feature)
+
+    # Then
+    default_identity_flags = compiled_environment.default_identity_flags[False]
+    assert len(default_identity_flags.multivariate_features) == 1
+    assert {
+        flag["feature_state_value"]
+        for identifier in range(100)
+        for flag in default_identity_flags.get_response_data(str(identifier))
+        if flag["feature"]["name"] == "mv_feature"
+    } == {"variant_a", "variant_b"}
@@ -0,0 +1,52 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from edge_proxy.conditional import ResponseValidators
+
+validators = ResponseValidators(
+    etag='W/"abc-c"',
+    last_modified=datetime(2024, 1, 1, 12, 0, 0, 500000, tzinfo=timezone.utc),
+)
+
+
+def test_headers__return_expected() -> None:
+    assert validators.headers == {
+        "ETag": 'W/"abc-c"',
+        "Last-Modified": "Mon, 01 Jan 2024 12:00:00 GMT",
+    }
+
+
+@pytest.mark.parametrize(
+    "if_none_match, if_modified_since, expected_result",
+    [
+        (None, None, False),
+        ('W/"abc-c"', None, True),
+        ('"abc-c"', None, True),
+        ('"other", W/"abc-c"', None, True),
+        ("*", None, True),
+        ('W/"abc-s"', None, False),
+        (None, "Mon, 01 Jan 2024 12:00:00 GMT", True),
+        (None, "Tue, 02 Jan 2024 12:00:00 GMT", True),
+        (None, "Mon, 01 Jan 2024 11:59:59 GMT", False),
+        (None, "not a date", False),
+        ('W/"abc-s"', "Tue, 02 Jan 2024 12:00:00 GMT", False),
+    ],
+)
+def test_is_not_modified__return_expected(
+    if_none_match: str | None,
+    if_modified_since: str | None,
+    expected_result: bool,
+) -> None:
+    assert (
+        validators.is_not_modified(if_none_match, if_modified_since) is expected_result
+    )
+
+
+def test_is_not_modified__no_last_modified__ignores_if_modified_since() -> None:
+    assert (
+        ResponseValidators(etag='W/"abc-c"').is_not_modified(
+            None, "Mon, 01 Jan 2024 12:00:00 GMT"
+        )
+        is False
+    )
@@ -0,0 +1,94 @@
+import copy
+
+from edge_proxy.compiled import compile_environment
+from edge_proxy.diffing import EnvironmentChanges, diff_compiled_environments
+from tests.fixtures.response_data import environment_1
+
+
+def _diff(modified_document: dict) -> EnvironmentChanges:
+    return diff_compiled_environments(
+        compile_environment(environment_1), compile_environment(modified_document)
+    )
+
+
+def test_diff_compiled_environments__metadata_changed__no_changes() -> None:
+    # Given
+    modified_document = {**environment_1, "updated_at": "2024-01-01T00:00:00Z"}
+
+    # When
+    changes = _diff(modified_document)
+
+    # Then
+    assert changes == EnvironmentChanges(
+        project=False,
+        features=frozenset(),
+        segment_requirements=(),
+        identity_overrides=frozenset(),
+    )
+    assert changes.get_changed_environment_flags() == frozenset()
+
+
+def test_diff_compiled_environments__feature_state_changed__return_feature() -> None:
+    # Given
+    modified_document = copy.deepcopy(environment_1)
+    modified_document["feature_states"][1]["feature_state_value"] = "modified"
+
+    # When
+    changes = _diff(modified_document)
+
+    # Then
+    assert changes.project is False
+    assert changes.features == {"feature_2"}
+    assert changes.segment_requirements == ()
+    assert changes.get_changed_environment_flags() == {"feature_2"}
+
+
+def test_diff_compiled_environments__segment_changed__return_requirements() -> None:
+    # Given
+    modified_document = copy.deepcopy(environment_1)
+    modified_document["project"]["segments"][0]["feature_states"][0][
+        "feature_state_value"
+    ] = "modified"
+
+    # When
+    changes = _diff(modified_document)
+
+    # Then
+    assert changes.features == frozenset()
+    assert changes.segment_requirements == (
+        (frozenset({"first_name"}),),
+        (frozenset({"first_name"}),),
+    )
+    # The segment depends on a trait, so cannot change environment flags.
+    assert changes.get_changed_environment_flags() == frozenset()
+
+
+def test_diff_compiled_environments__identity_override_changed__return_identifier() -> (
+    None
+):
+    # Given
+    modified_document = copy.deepcopy(environment_1)
+    modified_document["identity_overrides"][0]["identity_features"][0][
+        "feature_state_value"
+    ] = "modified"
+
+    # When
+    changes = _diff(modified_document)
+
+    # Then
+    assert changes.identity_overrides == {"overridden-id"}
+    assert changes.features == frozenset()
+    assert changes.segment_requirements == ()
+
+
+def test_diff_compiled_environments__project_settings_changed__return_project() -> None:
+    # Given
+    modified_document = copy.deepcopy(environment_1)
+    modified_document["project"]["hide_disabled_flags"] = True
+
+    # When
+    changes = _diff(modified_document)
+
+    # Then
+    assert changes.project is True
+    assert changes.get_changed_environment_flags() is None
@@ -0,0 +1,114 @@
+import pytest
+
+from edge_proxy.endpoint_cache import EndpointCache, EndpointCacheInfo
+from edge_proxy.exceptions import FlagsmithUnknownKeyError
+
+
+def test_endpoint_cache__get_or_compute__caches_per_environment() -> None:
+    # Given
+    endpoint_cache = EndpointCache(maxsize=2)
+    computed = []
+
+    def compute(value: str) -> str:
+        computed.append(value)
+        return value
+
+    # When
+    results = [
+        endpoint_cache.get_or_compute("env_1", "key", lambda: compute("env_1")),
+        endpoint_cache.get_or_compute("env_1", "key", lambda: compute("env_1")),
+        endpoint_cache.get_or_compute("env_2", "key", lambda: compute("env_2")),
+    ]
+
+    # Then
+    assert results == ["env_1", "env_1", "env_2"]
+    assert computed == ["env_1", "env_2"]
+    assert endpoint_cache.cache_infos() == {
+        "env_1": EndpointCacheInfo(
+            hits=1, misses=1, evictions=0, currsize=1, maxsize=2, generation=0
+        ),
+        "env_2": EndpointCacheInfo(
+            hits=0, misses=1, evictions=0, currsize=1, maxsize=2, generation=0
+        ),
+    }
+
+
+def test_endpoint_cache__get_or_compute__evicts_least_recently_used() -> None:
+    # Given
+    endpoint_cache = EndpointCache(maxsize=2)
+    endpoint_cache.get_or_compute("env", "a", lambda: "a")
+    endpoint_cache.get_or_compute("env", "b", lambda: "b")
+    endpoint_cache.get_or_compute("env", "a", lambda: "a")
+
+    # When
+    endpoint_cache.get_or_compute("env", "c", lambda: "c")
+
+    # Then
+    assert endpoint_cache.get_or_compute("env", "a", lambda: "miss") == "a"
+    assert endpoint_cache.get_or_compute("env", "b", lambda: "miss") == "miss"
+    assert endpoint_cache.cache_info("env").evictions == 2
+
+
+def test_endpoint_cache__get_or_compute__compute_raises__no_partition() -> None:
+    # Given
+    endpoint_cache = EndpointCache(maxsize=2)
+
+    def compute() -> str:
+        raise FlagsmithUnknownKeyError("unknown_key")
+
+    # When
+    with pytest.raises(FlagsmithUnknownKeyError):
+        endpoint_cache.get_or_compute("unknown_key", "key", compute)
+
+    # Then
+    assert endpoint_cache.cache_infos() == {}
+
+
+def test_endpoint_cache__get_or_compute__generation_changed__not_cached() -> None:
+    # Given
+    endpoint_cache = EndpointCache(maxsize=2)
+    generation = endpoint_cache.get_generation("env")
+    endpoint_cache.invalidate("env")
+
+    # When
+    result = endpoint_cache.get_or_compute("env", "key", lambda: "old", generation)
+
+    # Then
+    assert result == "old"
+    assert endpoint_cache.cache_info("env").currsize == 0
+    assert endpoint_cache.get_or_compute("env", "key", lambda: "new") == "new"
+
+
+def test_endpoint_cache__invalidate__only_clears_given_environment() -> None:
+    # Given
+    endpoint_cache = EndpointCache(maxsize=2)
+    endpoint_cache.get_or_compute("env_1", "key", lambda: "value")
+    endpoint_cache.get_or_compute("env_2", "key", lambda: "value")
+
+    # When
+    endpoint_cache.invalidate("env_1")
+
+    # Then
+    assert endpoint_cache.cache_info("env_1").currsize == 0
+    assert endpoint_cache.cache_info("env_1").generation == 1
+    assert endpoint_cache.cache_info("env_2").currsize == 1
+    assert endpoint_cache.cache_info("env_2").generation == 0
+
+
+def test_endpoint_cache__update__replaces_or_drops_entries() -> None:
+    # Given
+    endpoint_cache = EndpointCache(maxsize=3)
+    for key in ("a", "b", "c"):
+        endpoint_cache.get_or_compute("env", key, lambda: key)
+
+    # When
+    endpoint_cache.update(
+        "env",
+        lambda key, value: None if key == "b" else value.upper(),
+    )
+
+    # Then
+    assert endpoint_cache.get_or_compute("env", "a", lambda: "miss") == "A"
+    assert endpoint_cache.get_or_compute("env", "b", lambda: "miss") == "miss"
+    assert endpoint_cache.get_or_compute("env", "c", lambda: "miss") == "C"
+    assert endpoint_cache.cache_info("env").generation == 1
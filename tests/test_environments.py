@@ -1,25 +1,38 @@
+import asyncio
+import contextlib
 import copy
+import typing
 import unittest.mock
-from datetime import datetime
+from datetime import datetime, timedelta
+from pathlib import Path
 
 import httpx
 import pytest
+import redis
 from freezegun import freeze_time
 from orjson import orjson
 from pytest_mock import MockerFixture
 
-from edge_proxy.environments import EnvironmentService
+import edge_proxy.compiled
+import edge_proxy.environments
+from edge_proxy.cache import CompactEnvironmentsCache, LocalMemEnvironmentsCache
+from edge_proxy.environments import EnvironmentService, EnvironmentStatus
 from edge_proxy.exceptions import (
     FeatureNotFoundError,
     FlagsmithUnknownKeyError,
 )
-from edge_proxy.models import IdentityWithTraits
+from edge_proxy.models import IdentityWithTraits, TraitModel
+from edge_proxy.redis_cache import RedisEnvironmentsCache
 from edge_proxy.settings import (
     AppSettings,
     EndpointCacheSettings,
     EndpointCachesSettings,
 )
-from tests.fixtures.response_data import environment_1, environment_1_api_key
+from tests.fixtures.response_data import (
+    environment_1,
+    environment_1_api_key,
+    environment_with_multivariate_feature,
+)
 
 pytestmark = pytest.mark.asyncio
 
@@ -33,14 +46,39 @@ settings = AppSettings(
     ],
 )
 now = datetime.now()
+# Traits that a segment of environment_1 depends on.
+segment_traits = [TraitModel(trait_key="first_name", trait_value="test")]
+
+
+def mock_upstream_client(mocker: MockerFixture) -> unittest.mock.Mock:
+    """
+    Return a mock httpx client that streams the responses mocked on its `get`
+    method, in small chunks.
+    """
+    client = mocker.Mock()
+    client.get = mocker.AsyncMock()
+
+    @contextlib.asynccontextmanager
+    async def stream(method: str, **kwargs: typing.Any):
+        response = await client.get(**kwargs)
+        response.aiter_bytes = lambda: _iter_chunks(response.content)
+        yield response
+
+    client.stream = stream
+    return client
+
+
+async def _iter_chunks(content: bytes, chunk_size: int = 64):
+    for start in range(0, len(content), chunk_size):
+        yield content[start : start + chunk_size]
 
 
 async def test_refresh_makes_correct_http_call(mocker: MockerFixture):
     # Given
-    mock_client = mocker.AsyncMock()
+    mock_client = mock_upstream_client(mocker)
     mock_client.get.side_effect = [
-        unittest.mock.Mock(text='{"key1": "value1"}'),
-        unittest.mock.Mock(text='{"key2": "value2"}'),
+        unittest.mock.Mock(headers={}, content=b'{"key1": "value1"}'),
+        unittest.mock.Mock(headers={}, content=b'{"key2": "value2"}'),
     ]
 
     environment_service = EnvironmentService(client=mock_client, settings=settings)
@@ -77,10 +115,10 @@ async def test_refresh_does_not_update_last_updated_at_if_any_request_fails(
     mocker: MockerFixture,
 ):
     # Given
-    mock_client = mocker.AsyncMock()
+    mock_client = mock_upstream_client(mocker)
     mock_client.get.side_effect = [
         httpx.ConnectTimeout("timeout"),
-        unittest.mock.Mock(text='{"key2": "value2"}'),
+        unittest.mock.Mock(headers={}, content=b'{"key2": "value2"}'),
     ]
     environment_service = EnvironmentService(client=mock_client, settings=settings)
 
@@ -93,13 +131,17 @@ async def test_refresh_does_not_update_last_updated_at_if_any_request_fails(
 
 async def test_get_environment_works_correctly(mocker: MockerFixture):
     # Given
-    mock_client = mocker.AsyncMock()
+    mock_client = mock_upstream_client(mocker)
     doc_1 = {"key1": "value1"}
     doc_2 = {"key2": "value2"}
 
     mock_client.get.side_effect = [
-        mocker.MagicMock(text=orjson.dumps(doc_1), raise_for_status=lambda: None),
-        mocker.MagicMock(text=orjson.dumps(doc_2), raise_for_status=lambda: None),
+        mocker.MagicMock(
+            headers={}, content=orjson.dumps(doc_1), raise_for_status=lambda: None
+        ),
+        mocker.MagicMock(
+            headers={}, content=orjson.dumps(doc_2), raise_for_status=lambda: None
+        ),
     ]
 
     environment_service = EnvironmentService(settings=settings, client=mock_client)
@@ -132,6 +174,88 @@ async def test_get_environment_works_correctly(mocker: MockerFixture):
     assert mock_client.get.call_count == 2
 
 
+async def test_refresh_environment_caches__document_over_spool_size__cached_expected(
+    mocker: MockerFixture,
+) -> None:
+    # Given
+    _settings = settings.model_copy(update={"api_poll_spool_max_memory_bytes": 16})
+    mock_client = mock_upstream_client(mocker)
+    mock_client.get.return_value = mocker.MagicMock(
+        headers={}, content=orjson.dumps(environment_1)
+    )
+    environment_service = EnvironmentService(settings=_settings, client=mock_client)
+    spooled_documents = mocker.spy(edge_proxy.environments, "SpooledDocument")
+
+    # When
+    await environment_service.refresh_environment_caches()
+
+    # Then
+    assert (
+        environment_service.get_environment(environment_key=environment_1_api_key)
+        == environment_1
+    )
+    spooled_documents.assert_called_with(max_memory_size=16)
+
+
+async def test_refresh_environment_caches__compact_cache__serves_upstream_content(
+    mocker: MockerFixture,
+) -> None:
+    # Given
+    content = orjson.dumps(environment_1, option=orjson.OPT_INDENT_2)
+    mock_client = mock_upstream_client(mocker)
+    mock_client.get.return_value = mocker.MagicMock(headers={}, content=content)
+    environment_service = EnvironmentService(
+        CompactEnvironmentsCache(), client=mock_client, settings=settings
+    )
+
+    # When
+    await environment_service.refresh_environment_caches()
+    await environment_service.refresh_environment_caches()
+
+    # Then
+    assert (
+        environment_service.get_rendered_environment_document("ser.key1").identity
+        == content
+    )
+    assert environment_service.get_flags_response_data(environment_1_api_key)
+    # The second poll revalidates using the cached document's updated_at.
+    assert mock_client.get.call_args.kwargs["headers"]["If-Modified-Since"] == (
+        "Sun, 20 Jul 1969 20:17:40 GMT"
+    )
+
+
+async def test_refresh_environment_caches__rendered_document_replaced__renders_new_content(
+    mocker: MockerFixture,
+) -> None:
+    # Given
+    content = orjson.dumps(environment_1)
+    modified_content = orjson.dumps({**environment_1, "name": "renamed"})
+    mock_client = mock_upstream_client(mocker)
+    # One response per key pair and refresh.
+    mock_client.get.side_effect = [
+        mocker.MagicMock(headers={}, content=content),
+        mocker.MagicMock(headers={}, content=content),
+        mocker.MagicMock(headers={}, content=modified_content),
+        mocker.MagicMock(headers={}, content=modified_content),
+    ]
+    environment_service = EnvironmentService(client=mock_client, settings=settings)
+    await environment_service.refresh_environment_caches()
+    environment_service.get_rendered_environment_document("ser.key1")
+    encode_body = mocker.spy(edge_proxy.environments, "encode_body")
+
+    # When
+    await environment_service.refresh_environment_caches()
+
+    # Then
+    # Only the document that had been requested is rendered, ahead of requests.
+    encode_body.assert_called_once_with(modified_content)
+    assert (
+        environment_service.get_rendered_environment_document("ser.key1").identity
+        == modified_content
+    )
+    encode_body.assert_called_once()
+
+
 def test_get_environment_raises_for_unknown_keys():
     environment_service = EnvironmentService(settings=settings)
     with pytest.raises(FlagsmithUnknownKeyError):
@@ -159,39 +283,46 @@ async def test_refresh_environment_caches_clears_endpoint_caches_if_environment_
 
     # and set up the client to return the initial document twice and
     # subsequently the modified one
-    mocked_client = mocker.AsyncMock()
+    mocked_client = mock_upstream_client(mocker)
     mocked_client.get.side_effect = [
         mocker.MagicMock(
-            text=orjson.dumps(environment_1), raise_for_status=lambda: None
+            headers={},
+            content=orjson.dumps(environment_1),
+            raise_for_status=lambda: None,
         ),
         mocker.MagicMock(
-            text=orjson.dumps(environment_1), raise_for_status=lambda: None
+            headers={},
+            content=orjson.dumps(environment_1),
+            raise_for_status=lambda: None,
         ),
         mocker.MagicMock(
-            text=orjson.dumps(modified_document), raise_for_status=lambda: None
+            headers={},
+            content=orjson.dumps(modified_document),
+            raise_for_status=lambda: None,
         ),
     ]
 
     # Now let's create the environment service, refresh the environment caches and
-    # make a call to get_flags_response_data method. This will initialise the LRU
-    # cache on the get_flags_response_data method.
+    # make a call to get_flags_response_data method. This will populate the
+    # environment's partition of the flags endpoint cache.
     environment_service = EnvironmentService(settings=_settings, client=mocked_client)
     await environment_service.refresh_environment_caches()
     environment_service.get_flags_response_data(environment_1_api_key)
-    assert environment_service.get_flags_response_data.cache_info().currsize == 1
+    flags_cache = environment_service.flags_cache
+    assert flags_cache.cache_info(environment_1_api_key).currsize == 1
 
     # Refreshing the environment caches a second time shouldn't clear the cache
     # since the environment document is the same as what's in the environment cache.
     await environment_service.refresh_environment_caches()
-    assert environment_service.get_flags_response_data.cache_info().currsize == 1
+    assert flags_cache.cache_info(environment_1_api_key).currsize == 1
 
     # When
     # We refresh the environment caches again (which should return a modified environment)
     await environment_service.refresh_environment_caches()
 
     # Then
-    # The LRU cache on the get_flags_response_data method has been reset.
-    assert environment_service.get_flags_response_data.cache_info().currsize == 0
+    # The environment's partition of the flags endpoint cache has been reset.
+    assert flags_cache.cache_info(environment_1_api_key).currsize == 0
 
 
 async def test_refresh_environment_caches_sets_last_modified_if_environment_was_cached(
@@ -206,10 +337,11 @@ async def test_refresh_environment_caches_sets_last_modified_if_environment_was_
         if headers := kwargs.get("headers"):
             if_modified_since = headers.get("If-Modified-Since")
         return mocker.MagicMock(
-            text=orjson.dumps(environment_1),
+            headers={},
+            content=orjson.dumps(environment_1),
         )
 
-    mocked_client = mocker.AsyncMock()
+    mocked_client = mock_upstream_client(mocker)
     mocked_client.get.side_effect = save_if_modified_since
     environment_service = EnvironmentService(settings=settings, client=mocked_client)
 
@@ -235,13 +367,17 @@ async def test_refresh_environment_caches__deleted_identity_override__cached_exp
     modified_document = copy.deepcopy(environment_1)
     modified_document["identity_overrides"] = []
 
-    mocked_client = mocker.AsyncMock()
+    mocked_client = mock_upstream_client(mocker)
     mocked_client.get.side_effect = [
         mocker.MagicMock(
-            text=orjson.dumps(environment_1), raise_for_status=lambda: None
+            headers={},
+            content=orjson.dumps(environment_1),
+            raise_for_status=lambda: None,
         ),
         mocker.MagicMock(
-            text=orjson.dumps(modified_document), raise_for_status=lambda: None
+            headers={},
+            content=orjson.dumps(modified_document),
+            raise_for_status=lambda: None,
         ),
     ]
 
@@ -330,28 +466,32 @@ async def test_get_identity_flags_response_skips_cache_for_different_identity(
         ),
     )
 
-    mocked_client = mocker.AsyncMock()
+    mocked_client = mock_upstream_client(mocker)
     mocked_client.get.return_value = mocker.MagicMock(
-        text=orjson.dumps(environment_1), raise_for_status=lambda: None
+        headers={}, content=orjson.dumps(environment_1), raise_for_status=lambda: None
     )
 
     environment_service = EnvironmentService(settings=_settings, client=mocked_client)
     await environment_service.refresh_environment_caches()
 
     # When
-    # We retrieve the flags for 2 separate identities
+    # We retrieve the flags for 2 separate identities, with traits that a
+    # segment depends on so that their flags are evaluated
     environment_service.get_identity_response_data(
-        IdentityWithTraits(identifier="foo"), environment_1_api_key
+        IdentityWithTraits(identifier="foo", traits=segment_traits),
+        environment_1_api_key,
     )
     environment_service.get_identity_response_data(
-        IdentityWithTraits(identifier="bar"), environment_1_api_key
+        IdentityWithTraits(identifier="bar", traits=segment_traits),
+        environment_1_api_key,
     )
 
     # Then
     # we get 2 cache misses
-    assert environment_service.get_identity_response_data.cache_info().currsize == 2
-    assert environment_service.get_identity_response_data.cache_info().misses == 2
-    assert environment_service.get_identity_response_data.cache_info().hits == 0
+    cache_info = environment_service.identities_cache.cache_info(environment_1_api_key)
+    assert cache_info.currsize == 2
+    assert cache_info.misses == 2
+    assert cache_info.hits == 0
 
 
 async def test_get_flags_response_data_skips_filter_for_server_key(
@@ -364,9 +504,9 @@ async def test_get_flags_response_data_skips_filter_for_server_key(
         environment_key_pairs=[{"client_side_key": api_key, "server_side_key": api_key}]
     )
 
-    mocked_client = mocker.AsyncMock()
+    mocked_client = mock_upstream_client(mocker)
     mocked_client.get.return_value = mocker.MagicMock(
-        text=orjson.dumps(environment_1), raise_for_status=lambda: None
+        headers={}, content=orjson.dumps(environment_1), raise_for_status=lambda: None
     )
 
     environment_service = EnvironmentService(settings=_settings, client=mocked_client)
@@ -395,9 +535,9 @@ async def test_get_flags_response_data_filters_server_side_features_for_client_k
         ]
     )
 
-    mocked_client = mocker.AsyncMock()
+    mocked_client = mock_upstream_client(mocker)
     mocked_client.get.return_value = mocker.MagicMock(
-        text=orjson.dumps(environment_1), raise_for_status=lambda: None
+        headers={}, content=orjson.dumps(environment_1), raise_for_status=lambda: None
     )
 
     environment_service = EnvironmentService(settings=_settings, client=mocked_client)
@@ -424,9 +564,9 @@ async def test_get_identity_flags_response_skips_filter_for_server_key(
         environment_key_pairs=[{"client_side_key": api_key, "server_side_key": api_key}]
     )
 
-    mocked_client = mocker.AsyncMock()
+    mocked_client = mock_upstream_client(mocker)
     mocked_client.get.return_value = mocker.MagicMock(
-        text=orjson.dumps(environment_1), raise_for_status=lambda: None
+        headers={}, content=orjson.dumps(environment_1), raise_for_status=lambda: None
     )
 
     environment_service = EnvironmentService(settings=_settings, client=mocked_client)
@@ -443,3 +583,912 @@ async def test_get_identity_flags_response_skips_filter_for_server_key(
     flags = result.get("flags")
     assert len(flags) == 3
     assert flags[2].get("feature").get("name") == "feature_3"
+
+
+async def test_get_response_data__compiles_environment_once_per_document_change(
+    mocker: MockerFixture,
+) -> None:
+    # Given
+    _settings = AppSettings(
+        environment_key_pairs=[
+            {"client_side_key": environment_1_api_key, "server_side_key": "ser.key"}
+        ]
+    )
+
+    mocked_client = mock_upstream_client(mocker)
+    mocked_client.get.return_value = mocker.MagicMock(
+        headers={}, content=orjson.dumps(environment_1), raise_for_status=lambda: None
+    )
+    map_environment_document_to_context_spy = mocker.spy(
+        edge_proxy.compiled, "map_environment_document_to_context"
+    )
+
+    environment_service = EnvironmentService(settings=_settings, client=mocked_client)
+    await environment_service.refresh_environment_caches()
+
+    # When
+    environment_service.get_flags_response_data(environment_1_api_key)
+    environment_service.get_identity_response_data(
+        IdentityWithTraits(identifier="foo"), environment_1_api_key
+    )
+    await environment_service.refresh_environment_caches()
+    environment_service.get_flags_response_data(environment_1_api_key)
+
+    # Then
+    map_environment_document_to_context_spy.assert_called_once()
+
+
+async def test_get_rendered_flags__prerender_flags_enabled__return_expected(
+    mocker: MockerFixture,
+) -> None:
+    # Given
+    _settings = AppSettings(
+        environment_key_pairs=[
+            {"client_side_key": environment_1_api_key, "server_side_key": "ser.key"}
+        ],
+        prerender_flags=True,
+    )
+
+    mocked_client = mock_upstream_client(mocker)
+    mocked_client.get.return_value = mocker.MagicMock(
+        headers={}, content=orjson.dumps(environment_1), raise_for_status=lambda: None
+    )
+
+    environment_service = EnvironmentService(settings=_settings, client=mocked_client)
+    await environment_service.refresh_environment_caches()
+
+    # When
+    client_rendered_flags = environment_service.get_rendered_flags(
+        environment_1_api_key
+    )
+    server_rendered_flags = environment_service.get_rendered_flags("ser.key")
+
+    # Then
+    assert orjson.loads(
+        client_rendered_flags.flags.identity
+    ) == environment_service.get_flags_response_data(environment_1_api_key)
+    assert set(client_rendered_flags.features) == {"feature_1", "feature_2"}
+    assert orjson.loads(client_rendered_flags.features["feature_1"]) == (
+        environment_service.get_flags_response_data(environment_1_api_key, "feature_1")
+    )
+    assert len(orjson.loads(server_rendered_flags.flags.identity)) == 3
+    assert set(server_rendered_flags.features) == {
+        "feature_1",
+        "feature_2",
+        "feature_3",
+    }
+
+
+async def test_get_rendered_flags__prerender_flags_disabled__return_none(
+    mocker: MockerFixture,
+) -> None:
+    # Given
+    mocked_client = mock_upstream_client(mocker)
+    mocked_client.get.return_value = mocker.MagicMock(
+        headers={}, content=orjson.dumps(environment_1), raise_for_status=lambda: None
+    )
+
+    environment_service = EnvironmentService(settings=settings, client=mocked_client)
+    await environment_service.refresh_environment_caches()
+
+    # When
+    rendered_flags = environment_service.get_rendered_flags(environment_1_api_key)
+
+    # Then
+    assert rendered_flags is None
+
+
+async def test_refresh_environment_caches__one_environment_changes__other_endpoint_caches_kept(
+    mocker: MockerFixture,
+) -> None:
+    # Given
+    _settings = AppSettings(
+        environment_key_pairs=[
+            {"client_side_key": environment_1_api_key, "server_side_key": "ser.key1"},
+            {"client_side_key": client_key_2, "server_side_key": "ser.key2"},
+        ],
+        endpoint_caches=EndpointCachesSettings(
+            identities=EndpointCacheSettings(use_cache=True),
+        ),
+    )
+
+    modified_document = copy.deepcopy(environment_1)
+    modified_document["feature_states"].pop()
+
+    mocked_client = mock_upstream_client(mocker)
+    mocked_client.get.side_effect = [
+        mocker.MagicMock(
+            headers={},
+            content=orjson.dumps(environment_1),
+            raise_for_status=lambda: None,
+        ),
+        mocker.MagicMock(
+            headers={},
+            content=orjson.dumps(environment_1),
+            raise_for_status=lambda: None,
+        ),
+        mocker.MagicMock(
+            headers={},
+            content=orjson.dumps(modified_document),
+            raise_for_status=lambda: None,
+        ),
+        mocker.MagicMock(
+            headers={},
+            content=orjson.dumps(environment_1),
+            raise_for_status=lambda: None,
+        ),
+    ]
+
+    environment_service = EnvironmentService(settings=_settings, client=mocked_client)
+    await environment_service.refresh_environment_caches()
+    for environment_key in (environment_1_api_key, client_key_2):
+        environment_service.get_identity_response_data(
+            IdentityWithTraits(identifier="foo", traits=segment_traits), environment_key
+        )
+
+    # When
+    # only the first environment's document changes
+    await environment_service.refresh_environment_caches()
+
+    # Then
+    identities_cache = environment_service.identities_cache
+    assert identities_cache.cache_info(environment_1_api_key).currsize == 0
+    assert identities_cache.cache_info(environment_1_api_key).generation == 2
+    assert identities_cache.cache_info(client_key_2).currsize == 1
+    assert identities_cache.cache_info(client_key_2).generation == 1
+
+
+async def test_get_identity_response_data__reordered_traits__cache_hit(
+    mocker: MockerFixture,
+) -> None:
+    # Given
+    _settings = AppSettings(
+        environment_key_pairs=[
+            {"client_side_key": environment_1_api_key, "server_side_key": "ser.key"}
+        ],
+        endpoint_caches=EndpointCachesSettings(
+            identities=EndpointCacheSettings(use_cache=True),
+        ),
+    )
+
+    mocked_client = mock_upstream_client(mocker)
+    mocked_client.get.return_value = mocker.MagicMock(
+        headers={}, content=orjson.dumps(environment_1), raise_for_status=lambda: None
+    )
+
+    environment_service = EnvironmentService(settings=_settings, client=mocked_client)
+    await environment_service.refresh_environment_caches()
+
+    traits = [
+        {"trait_key": "first_name", "trait_value": "test"},
+        {"trait_key": "age", "trait_value": 21},
+    ]
+
+    # When
+    result = environment_service.get_identity_response_data(
+        IdentityWithTraits(identifier="foo", traits=traits), environment_1_api_key
+    )
+    reordered_result = environment_service.get_identity_response_data(
+        IdentityWithTraits(identifier="foo", traits=traits[::-1]),
+        environment_1_api_key,
+    )
+
+    # Then
+    cache_info = environment_service.identities_cache.cache_info(environment_1_api_key)
+    assert cache_info.hits == 1
+    assert cache_info.misses == 1
+    assert reordered_result["flags"] == result["flags"]
+    assert reordered_result["traits"] == traits[::-1]
+
+
+async def test_refresh_environment_caches__fetches_concurrently_up_to_limit(
+    mocker: MockerFixture,
+) -> None:
+    # Given
+    _settings = AppSettings(
+        environment_key_pairs=[
+            {"client_side_key": f"key_{i}", "server_side_key": f"ser.key_{i}"}
+            for i in range(5)
+        ],
+        api_poll_concurrency=2,
+    )
+
+    in_flight = 0
+    max_in_flight = 0
+
+    async def get(**kwargs: typing.Any) -> unittest.mock.Mock:
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return mocker.MagicMock(
+            headers={},
+            content=orjson.dumps(environment_1),
+            raise_for_status=lambda: None,
+        )
+
+    mocked_client = mock_upstream_client(mocker)
+    mocked_client.get.side_effect = get
+
+    environment_service = EnvironmentService(settings=_settings, client=mocked_client)
+
+    # When
+    await environment_service.refresh_environment_caches()
+
+    # Then
+    assert mocked_client.get.call_count == 5
+    assert max_in_flight == 2
+    assert environment_service.last_updated_at is not None
+
+
+async def test_refresh_environment_caches__tracks_status_per_environment(
+    mocker: MockerFixture,
+) -> None:
+    # Given
+    mock_client = mock_upstream_client(mocker)
+    mock_client.get.side_effect = [
+        mocker.MagicMock(
+            headers={},
+            content=orjson.dumps(environment_1),
+            raise_for_status=lambda: None,
+        ),
+        httpx.ConnectTimeout("timeout"),
+        mocker.MagicMock(
+            headers={},
+            content=orjson.dumps(environment_1),
+            raise_for_status=lambda: None,
+        ),
+        httpx.ConnectTimeout("timeout"),
+    ]
+    environment_service = EnvironmentService(client=mock_client, settings=settings)
+
+    # When
+    with freeze_time(now):
+        await environment_service.refresh_environment_caches()
+    with freeze_time(later := now + timedelta(seconds=10)):
+        await environment_service.refresh_environment_caches()
+
+    # Then
+    assert environment_service.environment_statuses == {
+        environment_1_api_key: EnvironmentStatus(
+            last_attempted_at=later,
+            last_successful_fetch_at=later,
+            last_changed_at=now,
+            error_streak=0,
+        ),
+        client_key_2: EnvironmentStatus(
+            last_attempted_at=later,
+            last_successful_fetch_at=None,
+            last_changed_at=None,
+            error_streak=2,
+        ),
+    }
+    assert environment_service.last_updated_at is None
+
+
+async def test_refresh_environment_caches__sends_cached_validators(
+    mocker: MockerFixture,
+) -> None:
+    # Given
+    sent_headers = []
+
+    def get(**kwargs: typing.Any) -> unittest.mock.MagicMock:
+        sent_headers.append(kwargs["headers"])
+        return mocker.MagicMock(
+            status_code=200,
+            headers={"ETag": '"abc"', "Last-Modified": "Wed, 21 Oct 2015 07:28:00 GMT"},
+            content=orjson.dumps(environment_1),
+        )
+
+    mocked_client = mock_upstream_client(mocker)
+    mocked_client.get.side_effect = get
+    _settings = AppSettings(
+        environment_key_pairs=[
+            {"client_side_key": environment_1_api_key, "server_side_key": "ser.key"}
+        ]
+    )
+    environment_service = EnvironmentService(settings=_settings, client=mocked_client)
+
+    # When
+    await environment_service.refresh_environment_caches()
+    await environment_service.refresh_environment_caches()
+
+    # Then
+    assert sent_headers == [
+        {"X-Environment-Key": "ser.key"},
+        {
+            "X-Environment-Key": "ser.key",
+            "If-None-Match": '"abc"',
+            "If-Modified-Since": "Wed, 21 Oct 2015 07:28:00 GMT",
+        },
+    ]
+
+
+async def test_refresh_environment_caches__shared_write_failed__rewritten_on_not_modified(
+    mocker: MockerFixture,
+    redis_client: redis.Redis,
+) -> None:
+    # Given
+    content = orjson.dumps(environment_1)
+    mocked_client = mock_upstream_client(mocker)
+    mocked_client.get.side_effect = [
+        mocker.MagicMock(status_code=200, headers={"ETag": '"abc"'}, content=content),
+        mocker.MagicMock(status_code=304, headers={}),
+    ]
+    _settings = AppSettings(
+        environment_key_pairs=[
+            {"client_side_key": environment_1_api_key, "server_side_key": "ser.key"}
+        ]
+    )
+    environment_service = EnvironmentService(
+        RedisEnvironmentsCache(redis_client), mocked_client, _settings
+    )
+    mocker.patch.object(
+        redis.client.Pipeline, "execute", side_effect=redis.ConnectionError()
+    )
+    await environment_service.refresh_environment_caches()
+    mocker.stopall()
+    follower = RedisEnvironmentsCache(redis_client)
+
+    # When
+    await environment_service.refresh_environment_caches()
+
+    # Then
+    assert mocked_client.get.call_args.kwargs["headers"]["If-None-Match"] == '"abc"'
+    assert follower.load_snapshot(environment_1_api_key) is True
+    assert follower.get_environment_content(environment_1_api_key) == content
+
+
+async def test_refresh_environment_caches__unchanged_body__skips_parsing(
+    mocker: MockerFixture,
+) -> None:
+    # Given
+    mocked_client = mock_upstream_client(mocker)
+    mocked_client.get.return_value = mocker.MagicMock(
+        status_code=200, headers={}, content=orjson.dumps(environment_1)
+    )
+    _settings = AppSettings(
+        environment_key_pairs=[
+            {"client_side_key": environment_1_api_key, "server_side_key": "ser.key"}
+        ]
+    )
+    environment_service = EnvironmentService(settings=_settings, client=mocked_client)
+    put_environment_spy = mocker.spy(environment_service.cache, "put_environment")
+
+    await environment_service.refresh_environment_caches()
+    loads_spy = mocker.spy(edge_proxy.environments.orjson, "loads")
+
+    # When
+    await environment_service.refresh_environment_caches()
+
+    # Then
+    loads_spy.assert_not_called()
+    put_environment_spy.assert_called_once()
+    assert environment_service.environment_statuses[
+        environment_1_api_key
+    ].last_successful_fetch_at
+
+
+async def test_load_snapshots__all_environments_restored__return_true(
+    mocker: MockerFixture,
+    tmp_path: Path,
+) -> None:
+    # Given
+    _settings = AppSettings(
+        environment_key_pairs=[
+            {"client_side_key": environment_1_api_key, "server_side_key": "ser.key"}
+        ],
+        snapshot_dir=tmp_path,
+    )
+    mocked_client = mock_upstream_client(mocker)
+    mocked_client.get.return_value = mocker.MagicMock(
+        status_code=200, headers={}, content=orjson.dumps(environment_1)
+    )
+    await EnvironmentService(
+        cache=LocalMemEnvironmentsCache(snapshot_dir=tmp_path),
+        settings=_settings,
+        client=mocked_client,
+    ).refresh_environment_caches()
+
+    environment_service = EnvironmentService(
+        cache=LocalMemEnvironmentsCache(snapshot_dir=tmp_path),
+        settings=_settings,
+        client=mocked_client,
+    )
+
+    # When
+    restored_all = environment_service.load_snapshots()
+
+    # Then
+    assert restored_all is True
+    assert environment_service.last_updated_at
+    status = environment_service.environment_statuses[environment_1_api_key]
+    assert status.restored_at
+    assert status.last_successful_fetch_at is None
+    assert len(environment_service.get_flags_response_data(environment_1_api_key)) == 2
+    assert mocked_client.get.call_count == 1
+
+
+async def test_load_snapshots__missing_snapshot__return_false(
+    tmp_path: Path,
+) -> None:
+    # Given
+    environment_service = EnvironmentService(
+        cache=LocalMemEnvironmentsCache(snapshot_dir=tmp_path),
+        settings=settings,
+    )
+
+    # When
+    restored_all = environment_service.load_snapshots()
+
+    # Then
+    assert restored_all is False
+    assert environment_service.last_updated_at is None
+
+
+async def test_reload_snapshots__snapshot_changed__clears_endpoint_caches(
+    mocker: MockerFixture,
+    tmp_path: Path,
+) -> None:
+    # Given
+    _settings = AppSettings(
+        environment_key_pairs=[
+            {"client_side_key": environment_1_api_key, "server_side_key": "ser.key"}
+        ],
+        snapshot_dir=tmp_path,
+        endpoint_caches={"flags": {"use_cache": True}},
+    )
+    writer = LocalMemEnvironmentsCache(snapshot_dir=tmp_path)
+    writer.put_environment(environment_1_api_key, environment_1)
+
+    environment_service = EnvironmentService(
+        cache=LocalMemEnvironmentsCache(snapshot_dir=tmp_path),
+        settings=_settings,
+        client=mock_upstream_client(mocker),
+    )
+    environment_service.load_snapshots()
+    environment_service.get_flags_response_data(environment_1_api_key)
+
+    modified_document = copy.deepcopy(environment_1)
+    modified_document["updated_at"] = "2024-01-01T00:00:00Z"
+    modified_document["feature_states"][0]["enabled"] = not environment_1[
+        "feature_states"
+    ][0]["enabled"]
+    writer.put_environment(environment_1_api_key, modified_document)
+
+    # When
+    await environment_service.reload_snapshots()
+
+    # Then
+    cache_info = environment_service.flags_cache.cache_info(environment_1_api_key)
+    assert cache_info.currsize == 0
+    assert cache_info.generation == 1
+    assert (
+        environment_service.cache.get_environment(environment_1_api_key)["updated_at"]
+        == "2024-01-01T00:00:00Z"
+    )
+
+
+async def test_refresh_environment_caches__records_poll_metrics(
+    mocker: MockerFixture,
+) -> None:
+    # Given
+    content = orjson.dumps(environment_1)
+    mocked_client = mock_upstream_client(mocker)
+    mocked_client.get.side_effect = [
+        mocker.MagicMock(status_code=200, headers={}, content=content),
+        mocker.MagicMock(status_code=304, headers={}),
+        httpx.ConnectTimeout("timed out"),
+    ]
+    _settings = AppSettings(
+        environment_key_pairs=[
+            {"client_side_key": environment_1_api_key, "server_side_key": "ser.key"}
+        ]
+    )
+    environment_service = EnvironmentService(settings=_settings, client=mocked_client)
+    registry = environment_service.metrics.registry
+
+    # When
+    for _ in range(3):
+        await environment_service.refresh_environment_caches()
+
+    # Then
+    for outcome in ("200", "304", "error"):
+        assert (
+            registry.get_sample_value(
+                "edge_proxy_polls_total",
+                {"environment": environment_1_api_key, "outcome": outcome},
+            )
+            == 1
+        )
+    assert (
+        registry.get_sample_value(
+            "edge_proxy_poll_duration_seconds_count",
+            {"environment": environment_1_api_key},
+        )
+        == 3
+    )
+    assert registry.get_sample_value(
+        "edge_proxy_environment_document_size_bytes",
+        {"environment": environment_1_api_key},
+    ) == len(content)
+    assert (
+        registry.get_sample_value(
+            "edge_proxy_environment_document_age_seconds",
+            {"environment": environment_1_api_key},
+        )
+        is not None
+    )
+
+
+async def test_get_bulk_identities_response_data__compiles_environment_once(
+    mocker: MockerFixture,
+) -> None:
+    # Given
+    cache = mocker.MagicMock()
+    cache.get_environment.return_value = environment_1
+    cache.get_compiled_environment.return_value = None
+    environment_service = EnvironmentService(cache=cache, settings=settings)
+    compile_spy = mocker.spy(edge_proxy.environments, "compile_environment")
+    identities = [IdentityWithTraits(identifier=f"identity_{i}") for i in range(3)]
+
+    # When
+    result = list(
+        environment_service.get_bulk_identities_response_data(
+            identities, environment_1_api_key
+        )
+    )
+
+    # Then
+    assert [data["identifier"] for data in result] == [
+        "identity_0",
+        "identity_1",
+        "identity_2",
+    ]
+    compile_spy.assert_called_once()
+
+
+async def test_get_bulk_identities_response_data__document_replaced_while_streamed__not_cached() -> (
+    None
+):
+    # Given
+    environment_service = EnvironmentService(
+        settings=settings.model_copy(
+            update={
+                "endpoint_caches": EndpointCachesSettings(
+                    identities=EndpointCacheSettings(use_cache=True),
+                )
+            }
+        )
+    )
+    environment_service.cache.put_environment(environment_1_api_key, environment_1)
+    modified_document = copy.deepcopy(environment_1)
+    modified_document["feature_states"][0]["feature_state_value"] = "modified"
+    identities = [
+        IdentityWithTraits(identifier=identifier, traits=segment_traits)
+        for identifier in ("first", "second")
+    ]
+    results = environment_service.get_bulk_identities_response_data(
+        identities, environment_1_api_key
+    )
+    next(results)
+
+    # When
+    environment_service.cache.put_environment(environment_1_api_key, modified_document)
+    await environment_service._update_endpoint_caches(environment_1_api_key)
+    list(results)
+    result = environment_service.get_identity_response_data(
+        identities[1], environment_1_api_key
+    )
+
+    # Then
+    assert result["flags"][0]["feature_state_value"] == "modified"
+
+
+async def test_get_bulk_identities_response_data__unknown_key__raises_eagerly() -> None:
+    # Given
+    environment_service = EnvironmentService(settings=settings)
+
+    # When / Then
+    with pytest.raises(FlagsmithUnknownKeyError):
+        environment_service.get_bulk_identities_response_data(
+            [IdentityWithTraits(identifier="identity")], "ser.unknown"
+        )
+
+
+@pytest.mark.parametrize(
+    "identifier, expected_value",
+    [("overridden-id", "identity_override"), ("other-id", "feature_1_value")],
+)
+async def test_get_identity_response_data__identity_overrides__applied_by_identifier(
+    identifier: str,
+    expected_value: str,
+) -> None:
+    # Given
+    environment_service = EnvironmentService(settings=settings)
+    environment_service.cache.put_environment(environment_1_api_key, environment_1)
+
+    # When
+    result = environment_service.get_identity_response_data(
+        IdentityWithTraits(identifier=identifier), environment_1_api_key
+    )
+
+    # Then
+    assert result["flags"][0]["feature"]["name"] == "feature_1"
+    assert result["flags"][0]["feature_state_value"] == expected_value
+
+
+async def test_get_flags_response_data__unknown_key__no_endpoint_cache_partition() -> (
+    None
+):
+    # Given
+    environment_service = EnvironmentService(
+        settings=settings.model_copy(
+            update={
+                "endpoint_caches": EndpointCachesSettings(
+                    flags=EndpointCacheSettings(use_cache=True),
+                )
+            }
+        )
+    )
+
+    # When
+    for environment_key in ("unknown_key", "ser.unknown_key"):
+        with pytest.raises(FlagsmithUnknownKeyError):
+            environment_service.get_flags_response_data(environment_key)
+
+    # Then
+    assert environment_service.flags_cache.cache_infos() == {}
+
+
+async def test_get_flags_response_data__server_key__resolves_client_key_once(
+    mocker: MockerFixture,
+) -> None:
+    # Given
+    environment_service = EnvironmentService(settings=settings)
+    environment_service.cache.put_environment(environment_1_api_key, environment_1)
+    get_client_key_spy = mocker.spy(
+        environment_service, "_get_client_key_from_server_key"
+    )
+
+    # When
+    result = environment_service.get_flags_response_data("ser.key1")
+
+    # Then
+    assert len(result) == 3
+    get_client_key_spy.assert_called_once_with("ser.key1")
+
+
+async def test_get_flags_response_data__unknown_server_key__raises() -> None:
+    # Given
+    environment_service = EnvironmentService(settings=settings)
+
+    # When / Then
+    with pytest.raises(FlagsmithUnknownKeyError):
+        environment_service.get_flags_response_data("ser.unknown")
+
+
+async def test_refresh_environment_caches__environment_changes__publishes_updated_at(
+    mocker: MockerFixture,
+) -> None:
+    # Given
+    mocked_client = mock_upstream_client(mocker)
+    mocked_client.get.side_effect = [
+        mocker.MagicMock(
+            headers={},
+            content=orjson.dumps(environment_1),
+            raise_for_status=lambda: None,
+        ),
+        httpx.ConnectError("unreachable"),
+    ]
+    environment_service = EnvironmentService(settings=settings, client=mocked_client)
+    subscription = environment_service.get_broadcaster(
+        environment_1_api_key
+    ).subscribe()
+
+    # When
+    await environment_service.refresh_environment_caches()
+
+    # Then
+    message = await anext(subscription)
+    assert orjson.loads(message) == {
+        "updated_at": datetime.fromisoformat(environment_1["updated_at"]).timestamp()
+    }
+    assert environment_service.get_broadcaster(client_key_2).version == 0
+
+
+@pytest.mark.parametrize("environment_key", ["unknown", "ser.key1"])
+async def test_get_broadcaster__unknown_or_server_key__raises(
+    environment_key: str,
+) -> None:
+    # Given
+    environment_service = EnvironmentService(settings=settings)
+
+    # When / Then
+    with pytest.raises(FlagsmithUnknownKeyError):
+        environment_service.get_broadcaster(environment_key)
+
+
+@pytest.mark.parametrize("is_server_key", [False, True])
+@pytest.mark.parametrize(
+    "environment_document",
+    [environment_1, environment_with_multivariate_feature],
+)
+async def test_get_identity_response_data__no_segment_traits__return_evaluated_flags(
+    mocker: MockerFixture,
+    environment_document: dict[str, typing.Any],
+    is_server_key: bool,
+) -> None:
+    # Given
+    client_side_key = environment_document["api_key"]
+    environment_service = EnvironmentService(
+        settings=AppSettings(
+            environment_key_pairs=[
+                {"client_side_key": client_side_key, "server_side_key": "ser.key"}
+            ],
+        )
+    )
+    environment_service.cache.put_environment(client_side_key, environment_document)
+    compiled_environment = environment_service._get_compiled_environment(
+        client_side_key
+    )
+    evaluate_spy = mocker.spy(edge_proxy.environments, "get_evaluation_result")
+
+    for identifier in ("foo", "bar", "baz"):
+        input_data = IdentityWithTraits(identifier=identifier)
+
+        # When
+        result = environment_service.get_identity_response_data(
+            input_data, "ser.key" if is_server_key else client_side_key
+        )
+
+        # Then
+        assert result["flags"] == environment_service._get_identity_flags_response_data(
+            input_data, client_side_key, is_server_key, compiled_environment
+        )
+    assert evaluate_spy.call_count == 3
+
+
+async def test_get_identity_response_data__identity_override__evaluated() -> None:
+    # Given
+    environment_service = EnvironmentService(settings=settings)
+    environment_service.cache.put_environment(environment_1_api_key, environment_1)
+    identifier = environment_1["identity_overrides"][0]["identifier"]
+
+    # When
+    result = environment_service.get_identity_response_data(
+        IdentityWithTraits(identifier=identifier), environment_1_api_key
+    )
+
+    # Then
+    assert result["flags"] != environment_service.get_flags_response_data(
+        environment_1_api_key
+    )
+
+
+async def test_refresh_environment_caches__feature_state_changed__patches_identity_caches(
+    mocker: MockerFixture,
+) -> None:
+    # Given
+    _settings = AppSettings(
+        environment_key_pairs=[
+            {"client_side_key": environment_1_api_key, "server_side_key": "ser.key"}
+        ],
+        endpoint_caches=EndpointCachesSettings(
+            identities=EndpointCacheSettings(use_cache=True),
+        ),
+    )
+    modified_document = copy.deepcopy(environment_1)
+    modified_document["feature_states"][0]["feature_state_value"] = "modified"
+
+    mocked_client = mock_upstream_client(mocker)
+    mocked_client.get.side_effect = [
+        mocker.MagicMock(
+            headers={}, content=orjson.dumps(document), raise_for_status=lambda: None
+        )
+        for document in (environment_1, modified_document)
+    ]
+    environment_service = EnvironmentService(settings=_settings, client=mocked_client)
+    await environment_service.refresh_environment_caches()
+    input_data = IdentityWithTraits(identifier="foo", traits=segment_traits)
+    environment_service.get_identity_response_data(input_data, environment_1_api_key)
+
+    # When
+    await environment_service.refresh_environment_caches()
+    result = environment_service.get_identity_response_data(
+        input_data, environment_1_api_key
+    )
+
+    # Then
+    cache_info = environment_service.identities_cache.cache_info(environment_1_api_key)
+    assert cache_info.hits == 1
+    assert cache_info.generation == 2
+    assert result["flags"][0]["feature_state_value"] == "modified"
+    assert result["flags"] == environment_service._get_identity_flags_response_data(
+        input_data,
+        environment_1_api_key,
+        False,
+        environment_service._get_compiled_environment(environment_1_api_key),
+    )
+
+
+async def test_refresh_environment_caches__identity_override_changed__evicts_only_identity(
+    mocker: MockerFixture,
+) -> None:
+    # Given
+    _settings = AppSettings(
+        environment_key_pairs=[
+            {"client_side_key": environment_1_api_key, "server_side_key": "ser.key"}
+        ],
+        endpoint_caches=EndpointCachesSettings(
+            identities=EndpointCacheSettings(use_cache=True),
+        ),
+    )
+    modified_document = copy.deepcopy(environment_1)
+    modified_document["identity_overrides"][0]["identity_features"][0][
+        "feature_state_value"
+    ] = "modified"
+
+    mocked_client = mock_upstream_client(mocker)
+    mocked_client.get.side_effect = [
+        mocker.MagicMock(
+            headers={}, content=orjson.dumps(document), raise_for_status=lambda: None
+        )
+        for document in (environment_1, modified_document)
+    ]
+    environment_service = EnvironmentService(settings=_settings, client=mocked_client)
+    await environment_service.refresh_environment_caches()
+    for identifier in ("overridden-id", "foo"):
+        environment_service.get_identity_response_data(
+            IdentityWithTraits(identifier=identifier, traits=segment_traits),
+            environment_1_api_key,
+        )
+
+    # When
+    await environment_service.refresh_environment_caches()
+
+    # Then
+    cache_info = environment_service.identities_cache.cache_info(environment_1_api_key)
+    assert cache_info.currsize == 1
+    result = environment_service.get_identity_response_data(
+        IdentityWithTraits(identifier="overridden-id", traits=segment_traits),
+        environment_1_api_key,
+    )
+    assert result["flags"][0]["feature_state_value"] == "modified"
+
+
+async def test_refresh_environment_caches__segment_changed__keeps_rendered_flags(
+    mocker: MockerFixture,
+) -> None:
+    # Given
+    _settings = AppSettings(
+        environment_key_pairs=[
+            {"client_side_key": environment_1_api_key, "server_side_key": "ser.key"}
+        ],
+        prerender_flags=True,
+    )
+    modified_document = copy.deepcopy(environment_1)
+    modified_document["project"]["segments"][0]["feature_states"][0][
+        "feature_state_value"
+    ] = "modified"
+
+    mocked_client = mock_upstream_client(mocker)
+    mocked_client.get.side_effect = [
+        mocker.MagicMock(
+            headers={}, content=orjson.dumps(document), raise_for_status=lambda: None
+        )
+        for document in (environment_1, modified_document)
+    ]
+    environment_service = EnvironmentService(settings=_settings, client=mocked_client)
+    await environment_service.refresh_environment_caches()
+    rendered_flags = environment_service.get_rendered_flags(environment_1_api_key)
+
+    # When
+    await environment_service.refresh_environment_caches()
+
+    # Then
+    # the segment depends on a trait, so environment flags are unaffected
+    assert (
+        environment_service.get_rendered_flags(environment_1_api_key) is rendered_flags
+    )
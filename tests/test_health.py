@@ -4,6 +4,7 @@ import pytest
 from fastapi.testclient import TestClient
 from pytest_mock import MockerFixture
 
+from edge_proxy.environments import EnvironmentStatus
 from edge_proxy.settings import HealthCheckSettings
 
 READINESS_ENDPOINTS = [
@@ -24,8 +25,10 @@ def test_health_check_returns_200_if_cache_was_updated_recently(
     client: TestClient,
     endpoint: str,
 ) -> None:
-    mocked_environment_service = mocker.patch("edge_proxy.server.environment_service")
-    mocked_environment_service.last_updated_at = datetime.now()
+    mocker.patch(
+        "edge_proxy.server.environment_service.environment_statuses",
+        {"key": EnvironmentStatus(last_successful_fetch_at=datetime.now())},
+    )
 
     response = client.get(endpoint)
     assert response.status_code == 200
@@ -52,8 +55,10 @@ def test_health_check_returns_503_if_cache_is_stale(
     endpoint: str,
 ) -> None:
     last_updated_at = datetime.now() - timedelta(days=10)
-    mocked_environment_service = mocker.patch("edge_proxy.server.environment_service")
-    mocked_environment_service.last_updated_at = last_updated_at
+    mocker.patch(
+        "edge_proxy.server.environment_service.environment_statuses",
+        {"key": EnvironmentStatus(last_successful_fetch_at=last_updated_at)},
+    )
 
     response = client.get(endpoint)
 
@@ -76,8 +81,10 @@ def test_health_check_returns_200_if_cache_is_never_stale(
     mocker.patch("edge_proxy.server.settings.health_check", health_check)
 
     last_updated_at = datetime.now() - timedelta(days=10)
-    mocked_environment_service = mocker.patch("edge_proxy.server.environment_service")
-    mocked_environment_service.last_updated_at = last_updated_at
+    mocker.patch(
+        "edge_proxy.server.environment_service.environment_statuses",
+        {"key": EnvironmentStatus(last_successful_fetch_at=last_updated_at)},
+    )
 
     # When
     response = client.get(endpoint)
@@ -89,3 +96,193 @@ def test_health_check_returns_200_if_cache_is_never_stale(
         "reason": None,
         "last_successful_update": last_updated_at.isoformat(),
     }
+
+
+@pytest.mark.parametrize("endpoint", READINESS_ENDPOINTS)
+def test_health_check__one_environment_failing__return_200(
+    mocker: MockerFixture,
+    client: TestClient,
+    endpoint: str,
+) -> None:
+    # Given
+    now = datetime.now()
+    stale_fetch_at = now - timedelta(days=10)
+    mocker.patch(
+        "edge_proxy.server.environment_service.environment_statuses",
+        {
+            "healthy_key_1": EnvironmentStatus(last_successful_fetch_at=now),
+            "healthy_key_2": EnvironmentStatus(last_successful_fetch_at=now),
+            "healthy_key_3": EnvironmentStatus(last_successful_fetch_at=now),
+            "stale_key": EnvironmentStatus(
+                last_successful_fetch_at=stale_fetch_at, error_streak=100
+            ),
+        },
+    )
+
+    # When
+    response = client.get(endpoint)
+
+    # Then
+    assert response.status_code == 200
+    assert response.json() == {
+        "status": "ok",
+        "reason": None,
+        "last_successful_update": stale_fetch_at.isoformat(),
+    }
+
+
+@pytest.mark.parametrize("endpoint", READINESS_ENDPOINTS)
+def test_health_check__one_environment_never_fetched__return_503(
+    mocker: MockerFixture,
+    client: TestClient,
+    endpoint: str,
+) -> None:
+    # Given
+    now = datetime.now()
+    mocker.patch(
+        "edge_proxy.server.environment_service.environment_statuses",
+        {
+            "healthy_key_1": EnvironmentStatus(last_successful_fetch_at=now),
+            "healthy_key_2": EnvironmentStatus(last_successful_fetch_at=now),
+            "broken_key": EnvironmentStatus(last_attempted_at=now, error_streak=100),
+        },
+    )
+
+    # When
+    response = client.get(endpoint)
+
+    # Then
+    assert response.status_code == 503
+    assert response.json() == {
+        "status": "error",
+        "reason": "environment document(s) not updated.",
+        "last_successful_update": None,
+    }
+
+
+@pytest.mark.parametrize(
+    "min_fresh_environments, expected_status_code",
+    [(2, 200), (3, 503), (10, 503)],
+)
+def test_health_check__min_fresh_environments__return_expected(
+    mocker: MockerFixture,
+    client: TestClient,
+    min_fresh_environments: int,
+    expected_status_code: int,
+) -> None:
+    # Given
+    health_check = HealthCheckSettings(min_fresh_environments=min_fresh_environments)
+    mocker.patch("edge_proxy.server.settings.health_check", health_check)
+    now = datetime.now()
+    mocker.patch(
+        "edge_proxy.server.environment_service.environment_statuses",
+        {
+            "healthy_key_1": EnvironmentStatus(last_successful_fetch_at=now),
+            "healthy_key_2": EnvironmentStatus(last_successful_fetch_at=now),
+            "stale_key": EnvironmentStatus(
+                last_successful_fetch_at=now - timedelta(days=10)
+            ),
+        },
+    )
+
+    # When
+    response = client.get("/proxy/health/readiness")
+
+    # Then
+    assert response.status_code == expected_status_code
+
+
+def test_environments_health_check__return_expected(
+    mocker: MockerFixture,
+    client: TestClient,
+) -> None:
+    # Given
+    now = datetime.now()
+    stale_fetch_at = now - timedelta(days=10)
+    mocker.patch(
+        "edge_proxy.server.environment_service.environment_statuses",
+        {
+            "fresh_key": EnvironmentStatus(
+                last_attempted_at=now,
+                last_successful_fetch_at=now,
+                last_changed_at=stale_fetch_at,
+            ),
+            "stale_key": EnvironmentStatus(
+                last_attempted_at=now,
+                last_successful_fetch_at=stale_fetch_at,
+                last_changed_at=stale_fetch_at,
+                error_streak=3,
+            ),
+            "new_key": EnvironmentStatus(last_attempted_at=now, error_streak=1),
+            "restored_key": EnvironmentStatus(
+                last_attempted_at=now, error_streak=1, restored_at=now
+            ),
+        },
+    )
+
+    # When
+    response = client.get("/proxy/health/environments")
+
+    # Then
+    assert response.status_code == 503
+    assert response.json() == {
+        "environments": {
+            "fresh_key": {
+                "status": "ok",
+                "last_attempted_at": now.isoformat(),
+                "last_successful_fetch_at": now.isoformat(),
+                "last_changed_at": stale_fetch_at.isoformat(),
+                "error_streak": 0,
+                "restored_at": None,
+            },
+            "stale_key": {
+                "status": "stale",
+                "last_attempted_at": now.isoformat(),
+                "last_successful_fetch_at": stale_fetch_at.isoformat(),
+                "last_changed_at": stale_fetch_at.isoformat(),
+                "error_streak": 3,
+                "restored_at": None,
+            },
+            "new_key": {
+                "status": "not_updated",
+                "last_attempted_at": now.isoformat(),
+                "last_successful_fetch_at": None,
+                "last_changed_at": None,
+                "error_streak": 1,
+                "restored_at": None,
+            },
+            "restored_key": {
+                "status": "restored",
+                "last_attempted_at": now.isoformat(),
+                "last_successful_fetch_at": None,
+                "last_changed_at": None,
+                "error_streak": 1,
+                "restored_at": now.isoformat(),
+            },
+        }
+    }
+
+
+def test_environments_health_check__all_environments_fresh__return_200(
+    mocker: MockerFixture,
+    client: TestClient,
+) -> None:
+    # Given
+    now = datetime.now()
+    mocker.patch(
+        "edge_proxy.server.environment_service.environment_statuses",
+        {
+            "fresh_key": EnvironmentStatus(
+                last_attempted_at=now,
+                last_successful_fetch_at=now,
+                last_changed_at=now,
+            ),
+        },
+    )
+
+    # When
+    response = client.get("/proxy/health/environments")
+
+    # Then
+    assert response.status_code == 200
+    assert response.json()["environments"]["fresh_key"]["status"] == "ok"
@@ -0,0 +1,173 @@
+import time
+from pathlib import Path
+
+import redis
+from pytest_mock import MockerFixture
+
+from edge_proxy.leases import (
+    LEASE_FILE_NAME,
+    FileLease,
+    RedisLease,
+    create_lease,
+    get_leader_election,
+)
+from edge_proxy.settings import (
+    AppSettings,
+    EnvironmentsCacheBackend,
+    LeaderElection,
+)
+
+
+def test_redis_lease__held_by_another_replica__not_acquired(
+    redis_client: redis.Redis,
+) -> None:
+    # Given
+    lease = RedisLease(redis_client, key="lease", ttl_seconds=30)
+    other_lease = RedisLease(redis_client, key="lease", ttl_seconds=30)
+
+    # When
+    results = [lease.acquire(), other_lease.acquire(), lease.acquire()]
+
+    # Then
+    assert results == [True, False, True]
+    assert redis_client.get("lease") == lease.token.encode()
+
+
+def test_redis_lease__released__acquired_by_another_replica(
+    redis_client: redis.Redis,
+) -> None:
+    # Given
+    lease = RedisLease(redis_client, key="lease", ttl_seconds=30)
+    other_lease = RedisLease(redis_client, key="lease", ttl_seconds=30)
+    lease.acquire()
+
+    # When
+    other_lease.release()
+    still_held = not other_lease.acquire()
+    lease.release()
+
+    # Then
+    assert still_held
+    assert other_lease.acquire() is True
+
+
+def test_redis_lease__expired__acquired_by_another_replica(
+    redis_client: redis.Redis,
+) -> None:
+    # Given
+    lease = RedisLease(redis_client, key="lease", ttl_seconds=1)
+    other_lease = RedisLease(redis_client, key="lease", ttl_seconds=1)
+    lease.acquire()
+
+    # When
+    time.sleep(1.1)
+
+    # Then
+    assert other_lease.acquire() is True
+    assert lease.acquire() is False
+
+
+def test_redis_lease__store_unavailable__acquired(mocker: MockerFixture) -> None:
+    # Given
+    client = mocker.Mock(spec=redis.Redis)
+    client.set.side_effect = redis.ConnectionError()
+
+    # When
+    acquired = RedisLease(client, key="lease", ttl_seconds=30).acquire()
+
+    # Then
+    assert acquired is True
+
+
+def test_create_lease__backend__return_expected() -> None:
+    # Given
+    local_settings = AppSettings(environment_key_pairs=[])
+    redis_settings = AppSettings(
+        environment_key_pairs=[],
+        environments_cache_backend=EnvironmentsCacheBackend.REDIS,
+        redis={"key_prefix": "proxy"},
+    )
+
+    # When
+    local_lease = create_lease(local_settings)
+    redis_lease = create_lease(redis_settings)
+
+    # Then
+    assert local_lease is None
+    assert isinstance(redis_lease, RedisLease)
+    assert redis_lease.key == "proxy:lease"
+
+
+def test_create_lease__file_lock__return_expected(tmp_path: Path) -> None:
+    # Given
+    settings = AppSettings(
+        environment_key_pairs=[],
+        environments_cache_backend=EnvironmentsCacheBackend.REDIS,
+        leader_election=LeaderElection.FILE_LOCK,
+        snapshot_dir=tmp_path,
+    )
+
+    # When
+    lease = create_lease(settings)
+
+    # Then
+    assert isinstance(lease, FileLease)
+    assert lease.path == tmp_path / LEASE_FILE_NAME
+
+
+def test_get_leader_election__disabled_with_redis_backend__return_none() -> None:
+    # Given
+    settings = AppSettings(
+        environment_key_pairs=[],
+        environments_cache_backend=EnvironmentsCacheBackend.REDIS,
+        leader_election=LeaderElection.NONE,
+    )
+
+    # When
+    leader_election = get_leader_election(settings)
+
+    # Then
+    assert leader_election == LeaderElection.NONE
+    assert create_lease(settings) is None
+
+
+def test_file_lease__held_by_another_replica__not_acquired(tmp_path: Path) -> None:
+    # Given
+    lease = FileLease(tmp_path / "shared" / LEASE_FILE_NAME)
+    other_lease = FileLease(tmp_path / "shared" / LEASE_FILE_NAME)
+
+    # When
+    results = [lease.acquire(), other_lease.acquire(), lease.acquire()]
+
+    # Then
+    assert results == [True, False, True]
+    lease.release()
+
+
+def test_file_lease__released__acquired_by_another_replica(tmp_path: Path) -> None:
+    # Given
+    lease = FileLease(tmp_path / LEASE_FILE_NAME)
+    other_lease = FileLease(tmp_path / LEASE_FILE_NAME)
+    lease.acquire()
+
+    # When
+    other_lease.release()
+    still_held = not other_lease.acquire()
+    lease.release()
+
+    # Then
+    assert still_held
+    assert other_lease.acquire() is True
+    other_lease.release()
+
+
+def test_file_lease__file_unavailable__acquired(tmp_path: Path) -> None:
+    # Given
+    (tmp_path / "file").touch()
+    lease = FileLease(tmp_path / "file" / LEASE_FILE_NAME)
+
+    # When
+    acquired = lease.acquire()
+
+    # Then
+    assert acquired is True
@@ -0,0 +1,67 @@
+from fastapi import FastAPI
+from fastapi.responses import Response
+from fastapi.testclient import TestClient
+
+from edge_proxy.metrics import FLAGS_ROUTE, Metrics, MetricsMiddleware
+from edge_proxy.settings import EnvironmentKeyPair
+
+key_pair = EnvironmentKeyPair(server_side_key="ser.key", client_side_key="key")
+
+
+def _get_test_client(metrics: Metrics) -> TestClient:
+    app = FastAPI()
+
+    @app.get(FLAGS_ROUTE)
+    @app.get("/other")
+    async def route() -> Response:
+        return Response()
+
+    app.add_middleware(MetricsMiddleware, metrics=metrics)
+    return TestClient(app)
+
+
+def _get_request_count(metrics: Metrics, route: str, environment: str) -> float:
+    return metrics.registry.get_sample_value(
+        "edge_proxy_request_duration_seconds_count",
+        {"route": route, "environment": environment},
+    )
+
+
+def test_metrics_middleware__server_and_client_keys__recorded_per_environment() -> None:
+    # Given
+    metrics = Metrics([key_pair])
+    client = _get_test_client(metrics)
+
+    # When
+    client.get(FLAGS_ROUTE, headers={"X-Environment-Key": "key"})
+    client.get(FLAGS_ROUTE, headers={"X-Environment-Key": "ser.key"})
+
+    # Then
+    assert _get_request_count(metrics, FLAGS_ROUTE, "key") == 2
+
+
+def test_metrics_middleware__unknown_key__recorded_as_unknown() -> None:
+    # Given
+    metrics = Metrics([key_pair])
+    client = _get_test_client(metrics)
+
+    # When
+    client.get(FLAGS_ROUTE, headers={"X-Environment-Key": "nope"})
+    client.get(FLAGS_ROUTE)
+
+    # Then
+    assert _get_request_count(metrics, FLAGS_ROUTE, "unknown") == 2
+    assert _get_request_count(metrics, FLAGS_ROUTE, "nope") is None
+
+
+def test_metrics_middleware__other_route__not_recorded() -> None:
+    # Given
+    metrics = Metrics([key_pair])
+    client = _get_test_client(metrics)
+
+    # When
+    client.get("/other", headers={"X-Environment-Key": "key"})
+
+    # Then
+    assert _get_request_count(metrics, "/other", "key") is None
+    assert _get_request_count(metrics, FLAGS_ROUTE, "key") == 0
@@ -1,4 +1,6 @@
-from edge_proxy.models import IdentityWithTraits
+import pytest
+
+from edge_proxy.models import IdentityWithTraits, TraitValue
 
 
 def test_identity_with_traits_str():
@@ -39,3 +41,79 @@ def test_identity_with_traits_hash():
 
     # Then
     assert hash(identity_with_traits) == expected
+
+
+def test_identity_with_traits_cache_key__trait_order__same_key():
+    # Given
+    identity_with_traits = IdentityWithTraits.model_validate(
+        {
+            "identifier": "foo",
+            "traits": [
+                {"trait_key": "foo", "trait_value": "bar"},
+                {"trait_key": "age", "trait_value": 21},
+            ],
+        }
+    )
+    reordered_identity_with_traits = IdentityWithTraits.model_validate(
+        {
+            "identifier": "foo",
+            "traits": [
+                {"trait_key": "age", "trait_value": 21},
+                {"trait_key": "foo", "trait_value": "bar"},
+            ],
+        }
+    )
+
+    # Then
+    assert identity_with_traits.cache_key == reordered_identity_with_traits.cache_key
+    assert hash(identity_with_traits.cache_key) == hash(
+        reordered_identity_with_traits.cache_key
+    )
+
+
+@pytest.mark.parametrize(
+    "trait_value, other_trait_value",
+    (
+        (1, "1"),
+        (1, True),
+        (1, 1.0),
+        ("True", True),
+        ("None", None),
+    ),
+)
+def test_identity_with_traits_cache_key__trait_value_types__different_keys(
+    trait_value: TraitValue,
+    other_trait_value: TraitValue,
+):
+    # Given
+    identity_with_traits = IdentityWithTraits.model_validate(
+        {
+            "identifier": "foo",
+            "traits": [{"trait_key": "foo", "trait_value": trait_value}],
+        }
+    )
+    other_identity_with_traits = IdentityWithTraits.model_validate(
+        {
+            "identifier": "foo",
+            "traits": [{"trait_key": "foo", "trait_value": other_trait_value}],
+        }
+    )
+
+    # Then
+    assert identity_with_traits.cache_key != other_identity_with_traits.cache_key
+
+
+def test_identity_with_traits_cache_key__duplicate_trait_keys__last_value_wins():
+    # Given
+    identity_with_traits = IdentityWithTraits.model_validate(
+        {
+            "identifier": "foo",
+            "traits": [
+                {"trait_key": "foo", "trait_value": "bar"},
+                {"trait_key": "foo", "trait_value": "baz"},
+            ],
+        }
+    )
+
+    # Then
+    assert identity_with_traits.cache_key == ("foo", (("foo", str, "baz"),))
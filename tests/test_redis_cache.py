@@ -0,0 +1,208 @@
+import copy
+from pathlib import Path
+
+import orjson
+import pytest
+import redis
+from pytest_mock import MockerFixture
+
+import edge_proxy.redis_cache
+from edge_proxy.cache import EnvironmentValidators
+from edge_proxy.compiled import get_document_digest
+from edge_proxy.redis_cache import RedisEnvironmentsCache
+from tests.fixtures.response_data import environment_1, environment_1_api_key
+
+validators = EnvironmentValidators(
+    etag='"abc"',
+    last_modified="Wed, 21 Oct 2015 07:28:00 GMT",
+    digest=get_document_digest(b"1"),
+)
+
+
+@pytest.mark.asyncio
+async def test_load_snapshot__environment_put_by_another_replica__restores_environment(
+    redis_client: redis.Redis,
+) -> None:
+    # Given
+    content = orjson.dumps(environment_1)
+    leader = RedisEnvironmentsCache(redis_client)
+    leader.put_environment(
+        environment_1_api_key, environment_1, validators, content=content
+    )
+    await leader.write_shared_environments()
+    cache = RedisEnvironmentsCache(redis_client)
+
+    # When
+    loaded = cache.load_snapshot(environment_1_api_key)
+
+    # Then
+    assert loaded is True
+    assert cache.get_environment(environment_1_api_key) == environment_1
+    assert cache.get_environment_content(environment_1_api_key) == content
+    assert cache.get_validators(environment_1_api_key) == validators
+    assert cache.get_compiled_environment(environment_1_api_key)
+
+
+def test_load_snapshot__nothing_shared__return_false(
+    redis_client: redis.Redis,
+) -> None:
+    # Given
+    cache = RedisEnvironmentsCache(redis_client)
+
+    # When
+    loaded = cache.load_snapshot(environment_1_api_key)
+
+    # Then
+    assert loaded is False
+    assert cache.get_environment(environment_1_api_key) is None
+
+
+@pytest.mark.asyncio
+async def test_reload_snapshots__new_version__loads_new_document(
+    redis_client: redis.Redis,
+) -> None:
+    # Given
+    leader = RedisEnvironmentsCache(redis_client)
+    follower = RedisEnvironmentsCache(redis_client)
+    leader.put_environment(environment_1_api_key, environment_1)
+    await leader.write_shared_environments()
+    follower.load_snapshot(environment_1_api_key)
+    updated_environment = {**copy.deepcopy(environment_1), "name": "updated"}
+
+    # When
+    unchanged_reloaded = await follower.reload_snapshots([environment_1_api_key])
+    leader.put_environment(environment_1_api_key, updated_environment)
+    await leader.write_shared_environments()
+    reloaded = await follower.reload_snapshots([environment_1_api_key, "unknown_key"])
+
+    # Then
+    assert unchanged_reloaded == []
+    assert reloaded == [environment_1_api_key]
+    assert follower.get_environment(environment_1_api_key) == updated_environment
+    assert follower.get_environment_changes(environment_1_api_key)
+
+
+@pytest.mark.asyncio
+async def test_reload_snapshots__many_environments__checks_versions_in_one_round_trip(
+    mocker: MockerFixture,
+    redis_client: redis.Redis,
+) -> None:
+    # Given
+    environment_api_keys = [f"key_{i}" for i in range(10)]
+    leader = RedisEnvironmentsCache(redis_client)
+    for environment_api_key in environment_api_keys:
+        leader.put_environment(environment_api_key, environment_1)
+    await leader.write_shared_environments()
+    follower = RedisEnvironmentsCache(redis_client)
+    await follower.reload_snapshots(environment_api_keys)
+    execute_spy = mocker.spy(redis.client.Pipeline, "execute")
+    to_thread_spy = mocker.spy(edge_proxy.redis_cache.asyncio, "to_thread")
+
+    # When
+    reloaded = await follower.reload_snapshots(environment_api_keys)
+
+    # Then
+    assert reloaded == []
+    execute_spy.assert_called_once()
+    to_thread_spy.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_put_environment__key_prefix__isolates_deployments(
+    redis_client: redis.Redis,
+) -> None:
+    # Given
+    leader = RedisEnvironmentsCache(redis_client, key_prefix="first")
+    leader.put_environment(environment_1_api_key, environment_1)
+    await leader.write_shared_environments()
+
+    # When
+    loaded = RedisEnvironmentsCache(redis_client, key_prefix="second").load_snapshot(
+        environment_1_api_key
+    )
+
+    # Then
+    assert loaded is False
+
+
+@pytest.mark.asyncio
+async def test_write_shared_environments__store_unavailable__serves_locally(
+    mocker: MockerFixture,
+) -> None:
+    # Given
+    client = mocker.Mock(spec=redis.Redis)
+    client.pipeline.return_value.execute.side_effect = redis.ConnectionError()
+    cache = RedisEnvironmentsCache(client)
+
+    # When
+    changed = cache.put_environment(environment_1_api_key, environment_1, validators)
+    await cache.write_shared_environments()
+
+    # Then
+    assert changed is True
+    assert cache.get_environment(environment_1_api_key) == environment_1
+    assert cache.get_validators(environment_1_api_key) == validators
+
+
+@pytest.mark.asyncio
+async def test_write_shared_environments__store_failed_once__writes_document(
+    mocker: MockerFixture,
+    redis_client: redis.Redis,
+) -> None:
+    # Given
+    content = orjson.dumps(environment_1)
+    leader = RedisEnvironmentsCache(redis_client)
+    mocker.patch.object(
+        redis.client.Pipeline, "execute", side_effect=redis.ConnectionError()
+    )
+    leader.put_environment(
+        environment_1_api_key, environment_1, validators, content=content
+    )
+    await leader.write_shared_environments()
+    mocker.stopall()
+    follower = RedisEnvironmentsCache(redis_client)
+
+    # When
+    unwritten_loaded = follower.load_snapshot(environment_1_api_key)
+    await leader.write_shared_environments()
+    loaded = follower.load_snapshot(environment_1_api_key)
+
+    # Then
+    assert unwritten_loaded is False
+    assert loaded is True
+    assert follower.get_environment_content(environment_1_api_key) == content
+    assert follower.get_validators(environment_1_api_key) == validators
+
+
+def test_load_snapshot__store_unavailable__falls_back_to_snapshot(
+    mocker: MockerFixture,
+    redis_client: redis.Redis,
+    tmp_path: Path,
+) -> None:
+    # Given
+    RedisEnvironmentsCache(redis_client, snapshot_dir=tmp_path).put_environment(
+        environment_1_api_key, environment_1
+    )
+    client = mocker.Mock(spec=redis.Redis)
+    client.hgetall.side_effect = redis.ConnectionError()
+    cache = RedisEnvironmentsCache(client, snapshot_dir=tmp_path)
+
+    # When
+    loaded = cache.load_snapshot(environment_1_api_key)
+
+    # Then
+    assert loaded is True
+    assert cache.get_environment(environment_1_api_key) == environment_1
+
+
+def test_get_statuses__put_by_another_replica__return_expected(
+    redis_client: redis.Redis,
+) -> None:
+    # Given
+    RedisEnvironmentsCache(redis_client).put_statuses(b'{"key": {}}')
+
+    # When
+    statuses = RedisEnvironmentsCache(redis_client).get_statuses()
+
+    # Then
+    assert statuses == b'{"key": {}}'
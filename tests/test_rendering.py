@@ -0,0 +1,49 @@
+import gzip
+
+import brotli
+import orjson
+import pytest
+import zstandard
+
+from edge_proxy.rendering import negotiate_encoding, render_body
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, expected_encoding",
+    (
+        (None, "identity"),
+        ("", "identity"),
+        ("gzip", "gzip"),
+        ("gzip, deflate, br", "br"),
+        ("br;q=0, gzip", "gzip"),
+        ("BR;q=0.5", "br"),
+        ("*", "br"),
+        ("*, br;q=0", "zstd"),
+        ("*, br;q=0, zstd;q=0", "gzip"),
+        ("gzip, deflate, br, zstd", "br"),
+        ("gzip, zstd", "zstd"),
+        ("deflate", "identity"),
+        ("gzip;q=invalid", "identity"),
+    ),
+)
+def test_negotiate_encoding__return_expected(
+    accept_encoding: str | None,
+    expected_encoding: str,
+) -> None:
+    assert negotiate_encoding(accept_encoding) == expected_encoding
+
+
+def test_render_body__return_expected() -> None:
+    # Given
+    content = [{"feature": {"id": 1, "name": "feature_1"}, "enabled": True}]
+
+    # When
+    rendered_body = render_body(content)
+
+    # Then
+    assert orjson.loads(rendered_body.get_encoded("identity")) == content
+    assert gzip.decompress(rendered_body.get_encoded("gzip")) == orjson.dumps(content)
+    assert brotli.decompress(rendered_body.get_encoded("br")) == orjson.dumps(content)
+    assert zstandard.decompress(rendered_body.get_encoded("zstd")) == orjson.dumps(
+        content
+    )
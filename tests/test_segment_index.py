@@ -0,0 +1,98 @@
+from typing import Any
+
+import pytest
+
+from edge_proxy.segment_index import build_segment_index
+
+
+def _segment(key: str, rules: list[dict[str, Any]]) -> dict[str, Any]:
+    return {"key": key, "name": f"segment_{key}", "rules": rules}
+
+
+def _condition(
+    property_: str, operator: str = "EQUAL", value: str = "1"
+) -> dict[str, Any]:
+    return {"property": property_, "operator": operator, "value": value}
+
+
+segments = {
+    "all": _segment(
+        "all",
+        [{"type": "ALL", "conditions": [_condition("a"), _condition("b")]}],
+    ),
+    "any": _segment(
+        "any",
+        [{"type": "ANY", "conditions": [_condition("a"), _condition("c")]}],
+    ),
+    "none": _segment(
+        "none",
+        [{"type": "NONE", "conditions": [_condition("a")]}],
+    ),
+    "is_not_set": _segment(
+        "is_not_set",
+        [{"type": "ALL", "conditions": [_condition("d", "IS_NOT_SET")]}],
+    ),
+    "identifier": _segment(
+        "identifier",
+        [
+            {
+                "type": "ALL",
+                "conditions": [_condition("$.identity.identifier", "IN", "x,y")],
+            }
+        ],
+    ),
+    "percentage_split": _segment(
+        "percentage_split",
+        [{"type": "ALL", "conditions": [_condition("", "PERCENTAGE_SPLIT", "50")]}],
+    ),
+    "no_rules": _segment("no_rules", []),
+    "nested": _segment(
+        "nested",
+        [
+            {
+                "type": "ALL",
+                "rules": [
+                    {"type": "ANY", "conditions": [_condition("b")]},
+                    {"type": "ANY", "conditions": [_condition("c")]},
+                ],
+            }
+        ],
+    ),
+}
+
+unconstrained = ["none", "is_not_set", "identifier", "percentage_split"]
+
+
+@pytest.mark.parametrize(
+    "traits, expected_segment_keys",
+    [
+        (None, unconstrained),
+        ({}, unconstrained),
+        ({"a": 1, "b": None}, ["any", *unconstrained]),
+        ({"a": 1, "b": 1}, ["all", "any", *unconstrained]),
+        ({"c": 1}, ["any", *unconstrained]),
+        ({"b": 1, "c": 1}, ["any", *unconstrained, "nested"]),
+        ({"unrelated": 1}, unconstrained),
+    ],
+)
+def test_get_candidate_segments__return_expected_in_order(
+    traits: dict[str, Any] | None,
+    expected_segment_keys: list[str],
+) -> None:
+    # Given
+    segment_index = build_segment_index(segments)
+
+    # When
+    candidate_segments = segment_index.get_candidate_segments(traits)
+
+    # Then
+    assert list(candidate_segments) == expected_segment_keys
+    assert all(candidate_segments[key] is segments[key] for key in candidate_segments)
+
+
+def test_build_segment_index__no_segments__return_empty_index() -> None:
+    # When
+    segment_index = build_segment_index(None)
+
+    # Then
+    assert segment_index.get_candidate_segments({"a": 1}) == {}
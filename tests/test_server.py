@@ -1,9 +1,15 @@
+import copy
+import gzip
 import typing
 
+import brotli
 import orjson
+import pytest
+import zstandard
 from fastapi.testclient import TestClient
 from pytest_mock import MockerFixture
 
+from edge_proxy.broadcast import EnvironmentBroadcaster
 from edge_proxy.main import serve
 from edge_proxy.settings import EnvironmentKeyPair
 from tests.fixtures.response_data import (
@@ -196,6 +202,7 @@ def test_serve_passes_proxy_headers_setting(mocker: MockerFixture) -> None:
     # Given
     mock_settings = mocker.patch("edge_proxy.main.get_settings")
     mock_settings.return_value.server.proxy_headers = True
+    mock_settings.return_value.server.workers = 1
 
     mock_uvicorn = mocker.patch("edge_proxy.main.uvicorn.run")
 
@@ -216,11 +223,13 @@ def test_get_environment_document(
         EnvironmentKeyPair(server_side_key="ser.good", client_side_key="foo")
     ]
     mocker.patch(
-        "edge_proxy.server.settings.environment_key_pairs", environment_key_pairs
+        "edge_proxy.server.environment_service._client_keys_by_server_key",
+        {"ser.good": "foo"},
     )
-    mocker.patch(
-        "edge_proxy.server.environment_service.cache"
-    ).get_environment.return_value = environment_1
+    mocked_cache = mocker.patch("edge_proxy.server.environment_service.cache")
+    mocked_cache.get_environment.return_value = environment_1
+    mocked_cache.get_environment_content.return_value = None
+    mocked_cache.get_compiled_environment.return_value = None
 
     # When
     response = client.get(
@@ -327,6 +336,28 @@ def test_get_flags__server_key__hide_disabled_flags_enabled__returns_all_flags(
     assert "feature_3" in flag_names  # disabled flag
 
 
+@pytest.mark.parametrize("route", ["/api/v1/flags/", "/api/v1/environment-document"])
+def test_get_server_key_route__resolves_client_key_once(
+    mocker: MockerFixture,
+    mocked_environment_cache,
+    client: TestClient,
+    route: str,
+) -> None:
+    # Given
+    mocked_environment_cache.get_environment.return_value = environment_1
+    get_client_key = mocker.patch(
+        "edge_proxy.server.environment_service._get_client_key_from_server_key",
+        return_value="test_client_key",
+    )
+
+    # When
+    response = client.get(route, headers={"X-Environment-Key": "ser.test_server_key"})
+
+    # Then
+    assert response.status_code == 200
+    get_client_key.assert_called_once_with("ser.test_server_key")
+
+
 def test_get_flags__client_key__hide_disabled_flags_enabled__single_disabled_feature__returns_404(
     mocked_environment_cache,
     client: TestClient,
@@ -431,3 +462,336 @@ def test_get_flags__multivariate_feature__returns_correct_type(
 
     standard_flag = next(f for f in flags if f["feature"]["name"] == "feature_1")
     assert standard_flag["feature"]["type"] == "STANDARD"
+
+
+def test_get_flags__prerender_flags__serves_rendered_payload(
+    mocker: MockerFixture,
+    environment_service: "EnvironmentService",
+    environment_1_feature_states_response_list: list[dict],
+    client: TestClient,
+) -> None:
+    # Given
+    environment_key = "test_environment_key"
+    mocker.patch("edge_proxy.server.settings.prerender_flags", True)
+    mocker.patch.object(environment_service, "_rendered_flags", {})
+    environment_service.cache.put_environment(environment_key, environment_1)
+    environment_service._render_flags(environment_key)
+
+    # When
+    response = client.get(
+        "/api/v1/flags",
+        headers={"X-Environment-Key": environment_key, "Accept-Encoding": "br"},
+    )
+    feature_response = client.get(
+        "/api/v1/flags",
+        headers={"X-Environment-Key": environment_key},
+        params={"feature": "feature_1"},
+    )
+    missing_feature_response = client.get(
+        "/api/v1/flags",
+        headers={"X-Environment-Key": environment_key},
+        params={"feature": "feature_3"},
+    )
+
+    # Then
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "br"
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert response.json() == environment_1_feature_states_response_list
+    assert feature_response.json() == environment_1_feature_states_response_list[0]
+    assert missing_feature_response.status_code == 404
+
+
+def test_metrics__flags_requested__exposes_request_metrics(
+    mocked_environment_cache,
+    client: TestClient,
+) -> None:
+    # Given
+    mocked_environment_cache.get_environment.return_value = environment_1
+    client.get("/api/v1/flags/", headers={"X-Environment-Key": "def456"})
+
+    # When
+    response = client.get("/proxy/metrics")
+
+    # Then
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert (
+        'edge_proxy_request_duration_seconds_count{environment="def456",'
+        'route="/api/v1/flags/"}'
+    ) in response.text
+    assert (
+        'edge_proxy_serialization_duration_seconds_count{route="/api/v1/flags/"}'
+        in response.text
+    )
+    assert (
+        'edge_proxy_evaluation_duration_seconds_count{environment="def456"}'
+        in response.text
+    )
+
+
+def test_post_bulk_identities__return_response_per_identity(
+    mocked_environment_cache,
+    environment_1_feature_states_response_list: list[dict],
+    environment_1_feature_states_response_list_response_with_segment_override,
+    client: TestClient,
+) -> None:
+    # Given
+    mocked_environment_cache.get_environment.return_value = environment_1
+    identities = [
+        {"identifier": "identity_1"},
+        {
+            "identifier": "identity_2",
+            "traits": [{"trait_key": "first_name", "trait_value": "test"}],
+        },
+    ]
+    expected_flags = copy.deepcopy(environment_1_feature_states_response_list)
+    expected_flags[1]["feature_state_value"] = "2.3"
+
+    # When
+    response = client.post(
+        "/api/v1/identities/bulk/",
+        headers={"X-Environment-Key": "test_environment_key"},
+        content=orjson.dumps({"identities": identities}),
+    )
+
+    # Then
+    assert response.status_code == 200
+    assert response.json() == [
+        {"identifier": "identity_1", "traits": [], "flags": expected_flags},
+        {
+            "identifier": "identity_2",
+            "traits": identities[1]["traits"],
+            "flags": environment_1_feature_states_response_list_response_with_segment_override,
+        },
+    ]
+
+
+def test_post_bulk_identities__unknown_key__return_401(
+    mocked_environment_cache,
+    client: TestClient,
+) -> None:
+    # When
+    response = client.post(
+        "/api/v1/identities/bulk/",
+        headers={"X-Environment-Key": "unknown_key"},
+        content=orjson.dumps({"identities": [{"identifier": "identity_1"}]}),
+    )
+
+    # Then
+    assert response.status_code == 401
+
+
+def test_post_bulk_identities__empty_list__return_422(client: TestClient) -> None:
+    # When
+    response = client.post(
+        "/api/v1/identities/bulk/",
+        headers={"X-Environment-Key": "test_environment_key"},
+        content=orjson.dumps({"identities": []}),
+    )
+
+    # Then
+    assert response.status_code == 422
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, expected_encoding, decompress",
+    [
+        ("br", "br", brotli.decompress),
+        ("zstd", "zstd", zstandard.decompress),
+        ("gzip", "gzip", gzip.decompress),
+    ],
+)
+def test_get_environment_document__accept_encoding__serves_pre_encoded_body(
+    mocked_environment_cache,
+    accept_encoding: str,
+    expected_encoding: str,
+    decompress: typing.Callable[[bytes], bytes],
+    client: TestClient,
+) -> None:
+    # Given
+    mocked_environment_cache.get_environment.return_value = environment_1
+
+    # When
+    with client.stream(
+        "GET",
+        "/api/v1/environment-document",
+        headers={
+            "X-Environment-Key": "test_environment_key",
+            "Accept-Encoding": accept_encoding,
+        },
+    ) as response:
+        body = b"".join(response.iter_raw())
+
+    # Then
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == expected_encoding
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert orjson.loads(decompress(body)) == environment_1
+
+
+def test_get_rendered_environment_document__document_replaced__rendered_again(
+    environment_service: "EnvironmentService",
+) -> None:
+    # Given
+    environment_key = "test_environment_key"
+    environment_service.cache.put_environment(environment_key, environment_1)
+    rendered_document = environment_service.get_rendered_environment_document(
+        environment_key
+    )
+
+    # When
+    unchanged_rendered_document = environment_service.get_rendered_environment_document(
+        environment_key
+    )
+    environment_service.cache.put_environment(
+        environment_key, {**environment_1, "name": "renamed"}
+    )
+    replaced_rendered_document = environment_service.get_rendered_environment_document(
+        environment_key
+    )
+
+    # Then
+    assert unchanged_rendered_document is rendered_document
+    assert orjson.loads(replaced_rendered_document.identity)["name"] == "renamed"
+
+
+def test_get_environment_document__upstream_content__served_as_is(
+    environment_service: "EnvironmentService",
+    client: TestClient,
+) -> None:
+    # Given
+    environment_key = "test_environment_key"
+    content = orjson.dumps(environment_1, option=orjson.OPT_INDENT_2)
+    environment_service.cache.put_environment(
+        environment_key, environment_1, content=content
+    )
+
+    # When
+    response = client.get(
+        "/api/v1/environment-document",
+        headers={"X-Environment-Key": environment_key, "Accept-Encoding": "identity"},
+    )
+
+    # Then
+    assert response.status_code == 200
+    assert response.content == content
+    assert response.headers["Content-Type"] == "application/json"
+    assert response.headers["ETag"]
+    assert response.headers["Last-Modified"]
+
+
+@pytest.mark.parametrize("path", ["/api/v1/flags/", "/api/v1/environment-document"])
+def test_conditional_request__unchanged_document__return_304(
+    mocked_environment_cache,
+    path: str,
+    client: TestClient,
+) -> None:
+    # Given
+    mocked_environment_cache.get_environment.return_value = environment_1
+    headers = {"X-Environment-Key": "test_environment_key"}
+    response = client.get(path, headers=headers)
+
+    # When
+    etag_response = client.get(
+        path, headers={**headers, "If-None-Match": response.headers["ETag"]}
+    )
+    last_modified_response = client.get(
+        path,
+        headers={**headers, "If-Modified-Since": response.headers["Last-Modified"]},
+    )
+
+    # Then
+    assert response.status_code == 200
+    assert response.headers["Last-Modified"] == "Sun, 20 Jul 1969 20:17:40 GMT"
+    assert etag_response.status_code == 304
+    assert etag_response.content == b""
+    assert etag_response.headers["ETag"] == response.headers["ETag"]
+    assert last_modified_response.status_code == 304
+
+
+def test_conditional_request__changed_document__return_200(
+    mocked_environment_cache,
+    client: TestClient,
+) -> None:
+    # Given
+    mocked_environment_cache.get_environment.return_value = environment_1
+    headers = {"X-Environment-Key": "test_environment_key"}
+    etag = client.get("/api/v1/flags/", headers=headers).headers["ETag"]
+    mocked_environment_cache.get_environment.return_value = {
+        **environment_1,
+        "feature_states": environment_1["feature_states"][:1],
+    }
+
+    # When
+    response = client.get("/api/v1/flags/", headers={**headers, "If-None-Match": etag})
+
+    # Then
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert len(response.json()) == 1
+
+
+def test_conditional_request__server_and_client_keys__different_etags(
+    mocker: MockerFixture,
+    mocked_environment_cache,
+    client: TestClient,
+) -> None:
+    # Given
+    mocked_environment_cache.get_environment.return_value = environment_1
+    mocker.patch(
+        "edge_proxy.server.environment_service._client_keys_by_server_key",
+        {"ser.key": "key"},
+    )
+
+    # When
+    client_key_response = client.get(
+        "/api/v1/flags/", headers={"X-Environment-Key": "key"}
+    )
+    server_key_response = client.get(
+        "/api/v1/flags/", headers={"X-Environment-Key": "ser.key"}
+    )
+
+    # Then
+    assert client_key_response.headers["ETag"] != server_key_response.headers["ETag"]
+
+
+@pytest.mark.parametrize("environment_key", ["unknown", "ser.abc123"])
+def test_environment_stream__unknown_or_server_key__return_401(
+    environment_service: "EnvironmentService",
+    client: TestClient,
+    environment_key: str,
+) -> None:
+    # Given
+    assert environment_service.resolve_environment_key("ser.abc123") == (
+        "def456",
+        True,
+    )
+
+    # When
+    response = client.get(f"/sse/environments/{environment_key}/stream")
+
+    # Then
+    assert response.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_render_environment_events__publish__renders_sdk_compatible_events() -> (
+    None
+):
+    # Given
+    from edge_proxy.server import _render_environment_events
+
+    broadcaster = EnvironmentBroadcaster()
+    broadcaster.publish(orjson.dumps({"updated_at": 1700000000.0}))
+    events = _render_environment_events(broadcaster, keepalive_seconds=0.01)
+
+    # When
+    first_event = await anext(events)
+    keepalive = await anext(events)
+
+    # Then
+    assert first_event == (
+        b'event: environment_updated\ndata: {"updated_at":1700000000.0}\n\n'
+    )
+    assert keepalive == b": keepalive\n\n"
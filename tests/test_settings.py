@@ -4,7 +4,12 @@ import pytest
 from pytest_mock import MockerFixture
 from pydantic import ValidationError
 
-from edge_proxy.settings import get_settings, AppSettings
+from edge_proxy.settings import (
+    AppSettings,
+    EnvironmentsCacheBackend,
+    LeaderElection,
+    get_settings,
+)
 
 
 @pytest.mark.parametrize(
@@ -78,3 +83,36 @@ def test_settings_are_loaded_correctly(
     # Then
     for key, value in expected_config.items():
         assert getattr(config, key) == value
+
+
+@pytest.mark.parametrize(
+    "leader_election, environments_cache_backend, snapshot_dir, is_valid",
+    (
+        (LeaderElection.FILE_LOCK, EnvironmentsCacheBackend.REDIS, None, False),
+        (LeaderElection.FILE_LOCK, EnvironmentsCacheBackend.LOCAL_MEM, "/tmp", True),
+        (LeaderElection.REDIS, EnvironmentsCacheBackend.LOCAL_MEM, None, False),
+        (LeaderElection.REDIS, EnvironmentsCacheBackend.LOCAL_MEM, "/tmp", True),
+        (LeaderElection.REDIS, EnvironmentsCacheBackend.REDIS, None, True),
+        (None, EnvironmentsCacheBackend.LOCAL_MEM, None, True),
+    ),
+)
+def test_leader_election_validation(
+    leader_election: LeaderElection | None,
+    environments_cache_backend: EnvironmentsCacheBackend,
+    snapshot_dir: str | None,
+    is_valid: bool,
+) -> None:
+    # Given
+    settings = dict(
+        environment_key_pairs=[],
+        leader_election=leader_election,
+        environments_cache_backend=environments_cache_backend,
+        snapshot_dir=snapshot_dir,
+    )
+
+    # When
+    if is_valid:
+        AppSettings(**settings)
+        return
+    with pytest.raises(ValidationError):
+        AppSettings(**settings)
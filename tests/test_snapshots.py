@@ -0,0 +1,76 @@
+from pathlib import Path
+
+import orjson
+import pytest
+
+from edge_proxy.exceptions import InvalidSnapshotError
+from edge_proxy.snapshots import (
+    Snapshot,
+    get_snapshot_path,
+    read_snapshot,
+    write_snapshot,
+)
+from tests.fixtures.response_data import environment_1
+
+
+def test_write_snapshot__read_snapshot__return_expected(tmp_path: Path) -> None:
+    # Given
+    path = get_snapshot_path(tmp_path, "environment/key")
+
+    # When
+    write_snapshot(
+        path,
+        orjson.dumps(environment_1),
+        etag='"abc"',
+        last_modified="Wed, 21 Oct 2015 07:28:00 GMT",
+        digest=b"digest",
+    )
+
+    # Then
+    assert path.parent == tmp_path
+    assert read_snapshot(path) == Snapshot(
+        document=environment_1,
+        etag='"abc"',
+        last_modified="Wed, 21 Oct 2015 07:28:00 GMT",
+        digest=b"digest",
+    )
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_write_snapshot__no_validators__read_snapshot_return_expected(
+    tmp_path: Path,
+) -> None:
+    # Given
+    path = get_snapshot_path(tmp_path, "key")
+
+    # When
+    write_snapshot(path, orjson.dumps(environment_1))
+
+    # Then
+    assert read_snapshot(path) == Snapshot(
+        document=environment_1,
+        etag=None,
+        last_modified=None,
+        digest=None,
+    )
+
+
+@pytest.mark.parametrize(
+    "content",
+    (
+        b"",
+        b"not a snapshot at all",
+        b"EPSNAP\x00\x01" + b"\x00" * 14 + b"{}",
+    ),
+)
+def test_read_snapshot__invalid_file__raises_expected(
+    tmp_path: Path,
+    content: bytes,
+) -> None:
+    # Given
+    path = tmp_path / "invalid.snapshot"
+    path.write_bytes(content)
+
+    # When & Then
+    with pytest.raises(InvalidSnapshotError):
+        read_snapshot(path)
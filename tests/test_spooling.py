@@ -0,0 +1,35 @@
+import orjson
+import pytest
+
+from edge_proxy.compiled import get_document_digest
+from edge_proxy.spooling import SpooledDocument
+from tests.fixtures.response_data import environment_1
+
+
+@pytest.mark.parametrize("max_memory_size", [0, 100, 1024 * 1024])
+def test_spooled_document__chunks__load_return_expected(
+    max_memory_size: int,
+) -> None:
+    # Given
+    content = orjson.dumps(environment_1)
+
+    # When
+    with SpooledDocument(max_memory_size=max_memory_size) as document:
+        for start in range(0, len(content), 64):
+            document.write(content[start : start + 64])
+
+        # Then
+        assert document.spooled is (len(content) > max_memory_size)
+        assert document.size == len(content)
+        assert document.digest == get_document_digest(content)
+        assert document.load() == environment_1
+
+
+def test_spooled_document__invalid_json__load_raises_expected() -> None:
+    # Given
+    with SpooledDocument(max_memory_size=0) as document:
+        document.write(b'{"truncated": ')
+
+        # When & Then
+        with pytest.raises(orjson.JSONDecodeError):
+            document.load()
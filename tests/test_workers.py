@@ -0,0 +1,153 @@
+import asyncio
+import os
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+from edge_proxy.environments import EnvironmentStatus
+from edge_proxy.main import serve
+from edge_proxy.settings import AppSettings, LeaderElection
+from edge_proxy.workers import (
+    SNAPSHOT_DIR_ENV_VAR,
+    SNAPSHOT_FOLLOWER_ENV_VAR,
+    dump_environment_statuses,
+    is_snapshot_follower,
+    poll_with_lease,
+    read_environment_statuses,
+    run_poller_process,
+    write_environment_statuses,
+)
+
+
+def test_read_environment_statuses__written_statuses__return_expected(
+    tmp_path: Path,
+) -> None:
+    # Given
+    environment_statuses = {
+        "key": EnvironmentStatus(
+            last_attempted_at=datetime(2024, 1, 1, 12, 0, 1),
+            last_successful_fetch_at=datetime(2024, 1, 1, 12, 0, 0),
+            error_streak=1,
+        )
+    }
+    write_environment_statuses(tmp_path, environment_statuses)
+
+    # When
+    result = read_environment_statuses(tmp_path)
+
+    # Then
+    assert result == environment_statuses
+
+
+def test_read_environment_statuses__no_statuses__return_empty(
+    tmp_path: Path,
+) -> None:
+    # When
+    result = read_environment_statuses(tmp_path)
+
+    # Then
+    assert result == {}
+
+
+def test_run_poller_process__starts_poller_and_sets_follower_environment(
+    mocker: MockerFixture,
+    tmp_path: Path,
+) -> None:
+    # Given
+    settings = AppSettings(environment_key_pairs=[], snapshot_dir=tmp_path)
+    mocked_process = mocker.patch(
+        "edge_proxy.workers.multiprocessing.get_context"
+    ).return_value.Process
+
+    # When
+    with run_poller_process(settings) as snapshot_dir:
+        environ = dict(os.environ)
+
+    # Then
+    assert snapshot_dir == tmp_path
+    assert environ[SNAPSHOT_FOLLOWER_ENV_VAR] == "1"
+    assert environ[SNAPSHOT_DIR_ENV_VAR] == str(tmp_path)
+    assert not is_snapshot_follower()
+    mocked_process.assert_called_once()
+    assert mocked_process.call_args.kwargs["args"] == (settings, tmp_path)
+    mocked_process.return_value.start.assert_called_once_with()
+    mocked_process.return_value.terminate.assert_called_once_with()
+
+
+def test_serve__multiple_workers__runs_poller_process(mocker: MockerFixture) -> None:
+    # Given
+    mock_settings = mocker.patch("edge_proxy.main.get_settings")
+    mock_settings.return_value.server.workers = 4
+    mock_settings.return_value.leader_election = LeaderElection.NONE
+    mock_run_poller_process = mocker.patch("edge_proxy.main.run_poller_process")
+    mock_uvicorn = mocker.patch("edge_proxy.main.uvicorn.run")
+
+    # When
+    serve()
+
+    # Then
+    mock_run_poller_process.assert_called_once_with(mock_settings.return_value)
+    _, kwargs = mock_uvicorn.call_args
+    assert kwargs["workers"] == 4
+    assert "reload" not in kwargs
+
+
+def test_serve__multiple_workers_electing_leader__no_poller_process(
+    mocker: MockerFixture,
+) -> None:
+    # Given
+    mock_settings = mocker.patch("edge_proxy.main.get_settings")
+    mock_settings.return_value.server.workers = 4
+    mock_settings.return_value.leader_election = LeaderElection.FILE_LOCK
+    mock_run_poller_process = mocker.patch("edge_proxy.main.run_poller_process")
+    mock_uvicorn = mocker.patch("edge_proxy.main.uvicorn.run")
+
+    # When
+    serve()
+
+    # Then
+    mock_run_poller_process.assert_not_called()
+    _, kwargs = mock_uvicorn.call_args
+    assert kwargs["workers"] == 4
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("is_leader", [True, False])
+async def test_poll_with_lease__lease__polls_or_follows(
+    mocker: MockerFixture,
+    is_leader: bool,
+) -> None:
+    # Given
+    status = EnvironmentStatus(last_successful_fetch_at=datetime(2024, 1, 1))
+    environment_service = mocker.Mock()
+    environment_service.reload_snapshots = mocker.AsyncMock()
+    environment_service.refresh_environment_caches = mocker.AsyncMock()
+    environment_service.environment_statuses = {"key": EnvironmentStatus()}
+    environment_service.cache.get_statuses.return_value = dump_environment_statuses(
+        {"key": status, "unknown_key": status}
+    )
+    lease = mocker.Mock()
+    lease.acquire.return_value = is_leader
+    # Stop after the first iteration.
+    mocker.patch("edge_proxy.workers.asyncio.sleep", side_effect=asyncio.CancelledError)
+
+    # When
+    with pytest.raises(asyncio.CancelledError):
+        await poll_with_lease(
+            environment_service,
+            lease,
+            AppSettings(environment_key_pairs=[]),
+        )
+
+    # Then
+    environment_service.reload_snapshots.assert_awaited_once_with()
+    if is_leader:
+        environment_service.refresh_environment_caches.assert_awaited_once_with()
+        environment_service.cache.put_statuses.assert_called_once_with(
+            dump_environment_statuses({"key": EnvironmentStatus()})
+        )
+    else:
+        environment_service.refresh_environment_caches.assert_not_called()
+        assert environment_service.environment_statuses == {"key": status}